@@ -0,0 +1,172 @@
+# Streaming assembler
+#
+# Reads the source one line at a time and assembles each line as soon as it is read, so the raw text is never kept :
+# memory grows with the emitted program, the tokens and the decoded instruction of each address, not with comments
+# and blank lines. Flags are set and data is written to memory in the same pass, with the rules of parse_flags
+#
+# An operand which may name a flag defined further down cannot be decoded yet : the instruction is left empty and
+# its address is kept in a list of patches, decoded once the last line is read and every flag is known
+#
+# The pass does not stop at the first error : every line is decoded, and once the flags are patched each instruction
+# which could not be decoded (invalid opcode, register or operand, unknown flag) is reported with the other syntax
+# errors. The program does not run when there was at least one
+
+from VirtualMachine import OP_LDD, OP_LDI, OP_LDX, OP_STO, OP_ADD, OP_SUB, OP_AND, OP_OR, OP_XOR, OP_CMP, OP_JMP, \
+    OP_JPE, OP_JPN, OP_CMI, OP_FAULT
+
+# Operands of each opcode which may be the name of a flag
+
+OPERAND_ADDRESS = 1         # Data or instruction address : a number or a flag
+OPERAND_VALUE = 2           # Value, else data address : a byte, a number or a flag
+
+OPERANDS = {OP_LDD: OPERAND_ADDRESS, OP_LDI: OPERAND_ADDRESS, OP_LDX: OPERAND_ADDRESS, OP_STO: OPERAND_ADDRESS,
+    OP_JMP: OPERAND_ADDRESS, OP_JPE: OPERAND_ADDRESS, OP_JPN: OPERAND_ADDRESS, OP_CMI: OPERAND_ADDRESS,
+    OP_ADD: OPERAND_VALUE, OP_SUB: OPERAND_VALUE, OP_AND: OPERAND_VALUE, OP_OR: OPERAND_VALUE, OP_XOR: OPERAND_VALUE,
+    OP_CMP: OPERAND_VALUE}
+
+BYTE_BASES = {'#': 10, '&': 16, 'B': 2}
+
+class Assembler:
+    def __init__(self, vm):
+        self.vm = vm
+        self.patches = []           # Addresses of the instructions decoded once every flag is known
+        self.errors = 0             # Syntax errors which stop the program from running
+        self.parsing_data = False   # Lines after a data flag are data while they hold a byte
+        self.operands = {name: OPERANDS[number] for name, number in vm.opcode_numbers.items() if number in OPERANDS}
+
+    def assemble(self, lines):
+        vm = self.vm
+
+        vm.tree = []
+        vm.program = []
+        vm.directive_maps = []
+
+        for line in lines:
+            line = line.replace('\t', ' ').strip()
+            if line == '' or line.startswith("//"):
+                continue
+            tokens = [token for token in line.split(' ') if token != '']
+            if tokens[0].startswith('.'):                                   # Directives do not take an address
+                if vm.parse_directive(tokens) != 0:
+                    self.errors += 1
+                continue
+            if tokens[0].endswith(':') or self.parsing_data:
+                tokens = self.parse_line(tokens)
+            self.emit(tokens)
+
+        vm.debug(f"initialized syntax tree with {len(vm.tree)} instructions")
+
+        for pc in self.patches:
+            vm.program[pc] = vm.decode_instruction(pc)
+
+        vm.debug(f"decoded {len(vm.program)} instructions with {len(self.patches)} patches")
+
+        for pc, instruction in enumerate(vm.program):                          # Faults would only fail once run
+            if instruction is not None and instruction[0] == OP_FAULT:
+                for error in instruction[2]:
+                    self.error(f"{error} at instruction {pc} : {' '.join(vm.tree[pc])}")
+
+        if self.errors > 0:
+            vm.throw_syntax_error(f"could not assemble the program : {self.errors} errors")
+            return 1
+
+        return 0
+
+    def error(self, error):
+        self.vm.throw_syntax_error(error)
+        self.errors += 1
+
+    def parse_line(self, tokens):
+        # Sets the flag or writes the data of a line, and returns the tokens left for its address
+        vm = self.vm
+        address = len(vm.tree)
+
+        if tokens[0].endswith(':'):
+            if len(tokens[0]) <= 1:
+                self.error("flag name must have at least 1 character")
+                return tokens
+
+            flagname = tokens[0][0:len(tokens[0]) - 1]
+
+            if len(tokens) < 2:
+                vm.data_flags[flagname] = address
+                return []
+
+            if vm.is_valid_opcode(tokens[1]):
+                vm.code_flags[flagname] = address
+                vm.debug(f"set new source flag <{flagname}>: at instruction : {address}")
+                return tokens[1:]
+
+            if len(tokens) > 2:
+                self.error(f"too many arguments at data location {address} : {' '.join(tokens)}")
+                return []
+
+            data = vm.parse_byte_representation(tokens[1])
+            if data == -1:
+                self.error(f"invalid byte at position {address} : {' '.join(tokens)}")
+            elif vm.set_mem(address, data) != 0:
+                self.errors += 1
+            self.parsing_data = True
+
+            vm.data_flags[flagname] = address
+            vm.debug(f"set new data flag <{flagname}>: at address : {address}")
+            return []
+
+        if not self.parsing_data:
+            return tokens
+
+        data = vm.parse_byte_representation(tokens[0])
+        if data == -1:
+            if tokens[0][0] in BYTE_BASES:
+                vm.throw_syntax_error(f"invalid byte at position {address} : {' '.join(tokens)}")
+            self.parsing_data = False
+            return tokens
+
+        if vm.set_mem(address, data) != 0:
+            self.errors += 1
+        return tokens[1:]
+
+    def emit(self, instruction):
+        vm = self.vm
+        pc = len(vm.tree)
+        vm.tree.append(instruction)
+
+        if len(instruction) > 2:
+            self.error(f"too many arguments at instruction {pc} : {' '.join(instruction)}")
+            vm.program.append(None)
+        elif self.names_flag(instruction):
+            vm.program.append(None)
+            self.patches.append(pc)
+        else:
+            vm.program.append(vm.decode_instruction(pc))
+
+    def names_flag(self, instruction):
+        # True when the operand may be a flag : a value or a number is decoded without the flags
+        if len(instruction) < 2:
+            return False
+
+        kind = self.operands.get(instruction[0].upper())
+        operand = instruction[1]
+
+        if kind is None:
+            return False
+        if kind == OPERAND_VALUE and self.is_byte(operand):
+            return False
+        if operand[0].isalpha():                                            # Not a number either
+            return True
+        try:
+            int(operand)
+            return False
+        except ValueError:
+            return True
+
+    def is_byte(self, operand):
+        # Same values as parse_byte_representation, without reporting the errors of the ones it rejects
+        base = BYTE_BASES.get(operand[:1])
+        if base is None or len(operand) < 2:
+            return False
+        try:
+            value = int(operand[1:], base)
+        except ValueError:
+            return False
+        return value != -1 and value <= self.vm.LIMIT
@@ -0,0 +1,204 @@
+# Batch runs of pseudo-ASM programs
+#
+# run_many spreads jobs over a pool of processes and returns one Result for each job, in the order of the jobs
+# A job is a tuple (source, input, options) : input holds the bytes read by IN and options the settings of the
+# machine. Input and options can be left out
+#
+# options :
+#   engine       -> switch (default), dispatch or compile
+#   fusion       -> merge common instruction sequences into superinstructions
+#   optimization -> remove dead code and redundant instructions : optimized or faithful clock cycles
+#   fast_forward -> compute the final state of counted loops instead of running each iteration
+#   memory       -> memory backend : list (default) or array
+#   memory_size  -> number of words of memory
+#   width        -> word width in bits
+#   path         -> file of the source : relative .map paths start there
+#   cache        -> directory of the cached assembled programs : jobs with the same source parse it once
+#   raw_output   -> do not write a newline after each output character
+#   console      -> output holds everything the command line would print : output and errors in their order
+#   cycle_limit  -> stop the program with interrupt 5 after this many clock cycles
+#   time_limit   -> stop the program with interrupt 6 after this many seconds of execution
+#   streaming    -> assemble the source line by line and report every syntax error
+#
+# Each process keeps the last assembled programs in memory, so jobs which run the same source again only parse it
+# once in each process
+
+import contextlib
+import io
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from VirtualMachine import VirtualMachine, OutputSink, BytesInput
+
+OPTIONS = ["engine", "fusion", "optimization", "fast_forward", "memory", "memory_size", "width", "path", "cache",
+    "raw_output", "console", "cycle_limit", "time_limit", "streaming"]
+
+class ProgramCache:
+    # Assembled programs of the last runs : the least recently used one is dropped once size programs are kept
+    def __init__(self, size=256):
+        self.size = size
+        self.programs = OrderedDict()
+
+    def get(self, key):
+        state = self.programs.get(key)
+        if state is not None:
+            self.programs.move_to_end(key)
+        return state
+
+    def __setitem__(self, key, state):
+        self.programs[key] = state
+        self.programs.move_to_end(key)
+        while len(self.programs) > self.size:
+            self.programs.popitem(last=False)
+
+PROGRAMS = ProgramCache()
+
+class Result:
+    # Final state of one job : errors holds every error the program reported, as printed by the machine
+    def __init__(self, interrupt, output, clock_cycles, registers, errors, exception=None):
+        self.interrupt = interrupt          # Exit interrupt : 10 once the program ends with END
+        self.output = output                # Bytes written by OUT
+        self.clock_cycles = clock_cycles
+        self.registers = registers          # ACC, IX, PC and EFLAGS
+        self.errors = errors
+        self.exception = exception          # Message of an exception which stopped the machine
+
+    def __repr__(self):
+        return f"Result(interrupt={self.interrupt}, clock_cycles={self.clock_cycles}, registers={self.registers}, " \
+            f"output={self.output!r}, errors={self.errors!r}, exception={self.exception!r})"
+
+def prepare(source, input=b"", options=None):
+    # Machine set up for one job : the source is loaded but not parsed yet
+    options = options or {}
+    for name in options:
+        if name not in OPTIONS:
+            raise ValueError(f"invalid option : {name}")
+
+    console = options.get("console", False)
+    separator = b"" if options.get("raw_output", False) else b"\n"
+
+    VM = VirtualMachine()
+    VM.quiet = not console
+    VM.program_cache = PROGRAMS
+    VM.set_output(OutputSink(separator=separator, capture=not console))
+    VM.set_input(BytesInput(input))
+
+    if "engine" in options:
+        VM.set_engine(options["engine"])
+    if "fusion" in options:
+        VM.set_fusion(options["fusion"])
+    if "optimization" in options:
+        VM.set_optimization(options["optimization"])
+    if "fast_forward" in options:
+        VM.set_fast_forward(options["fast_forward"])
+    if "streaming" in options:
+        VM.set_streaming(options["streaming"])
+    VM.set_memory(options.get("memory", VM.memory_type), options.get("memory_size", VM.MAX_ADDRESS),
+        options.get("width", VM.ARCH))
+
+    VM.set_limits(options.get("cycle_limit"), options.get("time_limit"))
+    VM.cache_dir = options.get("cache")
+    VM.load_source(source, options.get("path"))
+
+    return VM
+
+def collect(VM, run, console=False):
+    # Calls run and returns the final state of the machine
+    exception = None
+    stream = io.TextIOWrapper(io.BytesIO(), encoding="utf-8", write_through=True)
+
+    with contextlib.redirect_stdout(stream if console else sys.stdout):         # Errors and output in one stream
+        try:
+            run()
+        except Exception as err:
+            exception = str(err)
+
+    if console:
+        stream.flush()
+        output = stream.buffer.getvalue()
+    else:
+        output = VM.output.getvalue()
+
+    return Result(VM.interrupt, output, VM.clock_cycles, (VM.ACC, VM.IX, VM.PC, VM.EFLAGS), VM.errors, exception)
+
+def run_program(source, input=b"", options=None):
+    try:
+        VM = prepare(source, input, options)
+    except Exception as err:                                                # Invalid options : only this job fails
+        return Result(0, b"", 0, (0, 0, 0, 0), [], str(err))
+    return collect(VM, VM.run, (options or {}).get("console", False))
+
+def run_job(job):
+    if isinstance(job, str):
+        return run_program(job)
+    return run_program(*job)
+
+def run_many(jobs, workers=None, chunksize=None):
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+
+    if chunksize is None:                                               # Fewer round trips for many short programs
+        chunksize = max(1, len(jobs) // (workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs, chunksize=chunksize))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) <= 1:
+        print('''usage: asmbatch [flags] <sourcefile.s>...
+flags:
+\t--jobs=<n>   \tnumber of processes (default one for each CPU)
+\t--engine=<name>\texecution engine : switch (default), dispatch or compile
+\t--input=<file>\tread the input of IN of every program from a file
+''')
+        exit(0)
+
+    workers = None
+    input = b""
+    options = {}
+    files = []
+
+    for arg in sys.argv[1:]:
+        if arg.startswith("--jobs="):
+            try:
+                workers = int(arg[len("--jobs="):])
+            except ValueError:
+                print(f"error: invalid number : {arg}")
+                exit(1)
+        elif arg.startswith("--engine="):
+            options["engine"] = arg[len("--engine="):]
+            if options["engine"] not in ["switch", "dispatch", "compile"]:
+                print(f"error: invalid engine : {options['engine']}")
+                exit(1)
+        elif arg.startswith("--input="):
+            try:
+                with open(arg[len("--input="):], 'rb') as file:
+                    input = file.read()
+            except OSError as err:
+                print(f"error: could not open file: {err}")
+                exit(1)
+        elif arg.startswith('-'):
+            print(f"error: invalid flag : {arg}")
+            exit(1)
+        else:
+            files.append(arg)
+
+    jobs = []
+    for path in files:
+        try:
+            with open(path, 'r') as file:
+                jobs.append((file.read(), input, dict(options, path=path)))
+        except OSError as err:
+            print(f"error: could not open file: {err}")
+            exit(1)
+
+    for path, result in zip(files, run_many(jobs, workers)):
+        print(f"{path} : exit code {result.interrupt} : {result.clock_cycles} clock cycles : {len(result.errors)} errors")
+        for error in result.errors:
+            print(f"\t{error}")
+        if result.exception is not None:
+            print(f"\tuncaught exception: {result.exception}")
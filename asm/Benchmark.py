@@ -0,0 +1,295 @@
+# Benchmarks of the virtual machine
+#
+# Each workload is a generated pseudo-ASM program which stresses one path of the machine. Every workload is run
+# with every engine and reports :
+#   instructions per second -> clock cycles divided by the time of the run, best of the repeats
+#   parse time              -> time to parse and assemble the source, best of the repeats
+#   peak memory             -> largest memory allocated while loading and running, measured with tracemalloc
+#                              in a separate run as tracing slows the machine down
+# Results can be saved as a JSON baseline and compared with a previous baseline : the comparison fails when the
+# instructions per second of any workload drop by more than the threshold
+
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from VirtualMachine import VirtualMachine, OutputSink, BytesInput
+
+ENGINES = {
+    "switch": ("switch", False),
+    "dispatch": ("dispatch", False),
+    "fuse": ("dispatch", True),
+    "compile": ("compile", False),
+}
+
+# Workloads
+# Each generator returns the source and the memory size it needs : data flags take the address of their line
+
+def counter(name):
+    # Decrement a counter and compare it with 0 : the caller jumps back with JPN while it is not 0
+    return [f"LDD {name}", "DEC ACC", f"STO {name}", "CMP #0"]
+
+def workload_loop(scale):
+    count = 100000 * scale
+    lines = [
+        "loop: LDD counter",
+        "INC ACC",
+        "STO counter",
+        "CMP max",
+        "JPN loop",
+        "END",
+        "counter: #0",
+        f"max: #{count}",
+    ]
+    return lines, len(lines)
+
+def workload_sweep(scale):
+    size = 200
+    passes = 500 * scale
+    lines = [
+        "outer: LDM #0",
+        "STO i",
+        "inner: LDD i",
+        "MOV IX",
+        "LDX array",
+        "ADD sum",
+        "STO sum",
+        "LDD i",
+        "INC ACC",
+        "STO i",
+        "CMP size",
+        "JPN inner",
+    ] + counter("passes") + [
+        "JPN outer",
+        "END",
+        "i: #0",
+        "sum: #0",
+        f"passes: #{passes}",
+        f"size: #{size}",
+    ]
+    lines += [f"array: #{1}"] + [f"#{n % 7 + 1}" for n in range(1, size)]
+    return lines, len(lines)
+
+def workload_chase(scale):
+    nodes = 1000
+    steps = 100000 * scale
+    lines = ["loop: LDI ptr", "STO ptr"] + counter("count") + ["JPN loop", "END"]
+
+    base = len(lines) + 2                                               # Address of the first node
+    order = list(range(nodes))
+    random.Random(nodes).shuffle(order)                                 # One cycle through every node
+    following = [0] * nodes
+    for n in range(nodes):
+        following[order[n]] = base + order[(n + 1) % nodes]
+
+    lines += [f"ptr: #{base + order[0]}", f"count: #{steps}"]
+    lines += [f"nodes: #{following[0]}"] + [f"#{address}" for address in following[1:]]
+    return lines, len(lines)
+
+def workload_bitwise(scale):
+    steps = 50000 * scale
+    lines = [
+        "loop: LDD x",
+        "LSL #3",
+        "XOR x",
+        "AND mask",
+        "LSR #1",
+        "OR #1",
+        "XOR #165",
+        "ADD #7",
+        "AND #65535",
+        "STO x",
+    ] + counter("count") + [
+        "JPN loop",
+        "END",
+        "x: #12345",
+        "mask: &FFFF",
+        f"count: #{steps}",
+    ]
+    return lines, len(lines)
+
+def workload_output(scale):
+    steps = 20000 * scale
+    lines = [
+        "loop: LDR #0",
+        "LDX text",
+        "OUT",
+        "INC IX",
+        "LDX text",
+        "OUT",
+        "INC IX",
+        "LDX text",
+        "OUT",
+        "INC IX",
+        "LDX text",
+        "OUT",
+    ] + counter("count") + [
+        "JPN loop",
+        "END",
+        f"count: #{steps}",
+        "text: #80",
+        "#65",
+        "#83",
+        "#77",
+    ]
+    return lines, len(lines)
+
+def workload_parse(scale):
+    blocks = 5000 * scale
+    lines = []
+    for n in range(blocks):                                             # Many labels and data flags, run once
+        lines += [f"block{n}: LDD value{n % 100}", f"ADD #{n % 10}", "STO result", f"JMP block{n + 1}"]
+    lines += [f"block{blocks}: END", "result: #0"] + [f"value{n}: #{n}" for n in range(100)]
+    return lines, len(lines)
+
+WORKLOADS = {
+    "loop": workload_loop,
+    "sweep": workload_sweep,
+    "chase": workload_chase,
+    "bitwise": workload_bitwise,
+    "output": workload_output,
+    "parse": workload_parse,
+}
+
+# Measurements
+
+def run_workload(source, memory_size, engine, fusion):
+    VM = VirtualMachine()
+    VM.quiet = True
+    VM.set_output(OutputSink(capture=True))
+    VM.set_input(BytesInput(b""))
+    VM.set_engine(engine)
+    VM.set_fusion(fusion)
+    VM.set_memory(VM.memory_type, memory_size, VM.ARCH)
+    VM.load_source(source)
+
+    start = time.perf_counter()
+    if VM.load() != 0:
+        raise RuntimeError(f"could not load workload : {VM.errors}")
+    loaded = time.perf_counter()
+    VM.set_pc(0)
+    VM.resume()
+    end = time.perf_counter()
+
+    if VM.interrupt != 10:
+        raise RuntimeError(f"workload exited with exit code {VM.interrupt} : {VM.errors}")
+
+    return VM.clock_cycles, loaded - start, end - loaded
+
+def measure(source, memory_size, engine, fusion, repeat):
+    parse_time = execution_time = float("inf")
+    for _ in range(repeat):
+        clock_cycles, parsing, execution = run_workload(source, memory_size, engine, fusion)
+        parse_time = min(parse_time, parsing)
+        execution_time = min(execution_time, execution)
+
+    tracemalloc.start()
+    try:
+        run_workload(source, memory_size, engine, fusion)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "clock_cycles": clock_cycles,
+        "instructions_per_second": clock_cycles / execution_time,
+        "parse_time": parse_time,
+        "peak_memory": peak_memory,
+    }
+
+def run_benchmarks(workloads=None, engines=None, scale=1, repeat=3):
+    results = {}
+    for name in workloads or WORKLOADS:
+        lines, memory_size = WORKLOADS[name](scale)
+        source = '\n'.join(lines)
+        results[name] = {}
+        for engine in engines or ENGINES:
+            results[name][engine] = measure(source, memory_size, *ENGINES[engine], repeat)
+            print_result(name, engine, results[name][engine])
+    return results
+
+def compare(results, baseline, threshold):
+    # Returns the workloads and engines which are slower than the baseline by more than threshold percent
+    regressions = []
+    for name, engines in results.items():
+        for engine, result in engines.items():
+            previous = baseline.get(name, {}).get(engine)
+            if previous is None:
+                continue
+            change = (result["instructions_per_second"] / previous["instructions_per_second"] - 1) * 100
+            print(f"{name:<10}{engine:<10}{change:+8.1f} %")
+            if change < -threshold:
+                regressions.append((name, engine, change))
+    return regressions
+
+def print_result(name, engine, result):
+    print(f"{name:<10}{engine:<10}{result['instructions_per_second'] / 1e6:10.3f} Minstr/s"
+        f"{result['parse_time'] * 1e3:10.2f} ms parse{result['peak_memory'] / 1024:10.0f} KiB peak"
+        f"{result['clock_cycles']:12} cycles")
+
+
+if __name__ == "__main__":
+
+    if "-h" in sys.argv or "--help" in sys.argv:
+        print(f'''usage: asmbench [flags]
+flags:
+\t--workloads=<names>\tcomma separated workloads : {','.join(WORKLOADS)} (default all)
+\t--engines=<names>\tcomma separated engines : {','.join(ENGINES)} (default all)
+\t--scale=<n>  \tmultiply the length of every workload (default 1)
+\t--repeat=<n> \tnumber of timed runs : the best one is kept (default 3)
+\t--save=<file>\twrite the results to a JSON baseline
+\t--compare=<file>\tcompare the results with a JSON baseline
+\t--threshold=<percent>\tlargest drop of instructions per second before the comparison fails (default 10)
+''')
+        exit(0)
+
+    workloads = engines = None
+    scale = repeat = None
+    save = baseline = None
+    threshold = 10.0
+
+    for f in sys.argv[1:]:
+        name, _, value = f.partition('=')
+        try:
+            if name == "--workloads":
+                workloads = value.split(',')
+                for workload in workloads:
+                    if workload not in WORKLOADS:
+                        raise ValueError(f"invalid workload : {workload}")
+            elif name == "--engines":
+                engines = value.split(',')
+                for engine in engines:
+                    if engine not in ENGINES:
+                        raise ValueError(f"invalid engine : {engine}")
+            elif name == "--scale":
+                scale = int(value)
+            elif name == "--repeat":
+                repeat = int(value)
+            elif name == "--threshold":
+                threshold = float(value)
+            elif name == "--save":
+                save = value
+            elif name == "--compare":
+                with open(value, 'r') as file:
+                    baseline = json.load(file)
+            else:
+                raise ValueError(f"invalid flag : {f}")
+        except (ValueError, OSError) as err:
+            print(f"error: {err}")
+            exit(1)
+
+    results = run_benchmarks(workloads, engines, scale or 1, repeat or 3)
+
+    if save:
+        with open(save, 'w') as file:
+            json.dump({"python": platform.python_version(), "scale": scale or 1, "results": results}, file, indent=4)
+
+    if baseline is not None:
+        regressions = compare(results, baseline["results"], threshold)
+        for name, engine, change in regressions:
+            print(f"error: {name} with {engine} is {-change:.1f} % slower than the baseline")
+        if regressions:
+            exit(1)
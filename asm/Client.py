@@ -0,0 +1,179 @@
+# Thin client of the pseudo-ASM server
+#
+# Takes the same flags and file as asmvm and prints what asmvm would print, but the program runs on a server
+# started with Server.py : the client does not load the virtual machine nor parse the program
+# The program runs here instead, with VirtualMachine.py, when no server listens on the socket, when a flag shows
+# cycles or works with local files, or when the program reads keys from the terminal with IN
+
+import base64
+import hashlib
+import json
+import os
+import runpy
+import socket
+import stat
+import sys
+import tempfile
+
+# Flags the server runs the same way : the others run the program here
+
+REMOTE_FLAGS = ["--engine=", "--compile", "--fuse", "--optimize", "--optimize=", "--fast-forward", "--raw-output",
+    "--input=", "--memory=", "--memory-size=", "--width=", "--cycle-limit=", "--time-limit=", "--stream"]
+
+def socket_directory():
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(base, f"asmvm-{os.getuid()}")
+
+def default_socket_path():
+    if os.environ.get("ASMVM_SOCKET"):
+        return os.environ["ASMVM_SOCKET"]
+    return os.path.join(socket_directory(), "server.sock")
+
+def check_socket_directory(path, create=False):
+    # The default socket lives in a directory only its user can open, so another user can neither listen in place
+    # of the server nor send it requests : a socket given with ASMVM_SOCKET or --socket is not checked
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory != os.path.abspath(socket_directory()):
+        return
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} does not belong to the user")
+    if info.st_mode & 0o077:
+        raise PermissionError(f"{directory} is open to other users : expected mode 0700")
+
+def reads_input(source):
+    # True when a line of the program is an IN instruction, with or without a flag
+    for line in source.split('\n'):
+        tokens = line.split()
+        if tokens and tokens[0].endswith(':'):
+            tokens = tokens[1:]
+        if len(tokens) == 1 and tokens[0].upper() == "IN":
+            return True
+    return False
+
+def options_of(flags):
+    # Options of the server for the flags, or None when a flag only works here
+    options = {"console": True}
+    for f in flags:
+        if not any(f == flag or (flag.endswith('=') and f.startswith(flag)) for flag in REMOTE_FLAGS):
+            return None
+        name, _, value = f.partition('=')
+        try:
+            if name == "--engine":
+                options["engine"] = value
+            elif name == "--compile":
+                options["engine"] = "compile"
+            elif name == "--fuse":
+                options["fusion"] = True
+            elif name == "--fast-forward":
+                options["fast_forward"] = True
+            elif name == "--optimize":
+                options["optimization"] = value or "optimized"
+            elif name == "--stream":
+                options["streaming"] = True
+            elif name == "--raw-output":
+                options["raw_output"] = True
+            elif name == "--memory":
+                options["memory"] = value
+            elif name == "--memory-size":
+                options["memory_size"] = int(value)
+            elif name == "--width":
+                options["width"] = int(value)
+            elif name == "--cycle-limit":
+                options["cycle_limit"] = int(value)
+            elif name == "--time-limit":
+                options["time_limit"] = float(value)
+        except ValueError:
+            return None
+    return options
+
+def request(connection, message):
+    connection.sendall(json.dumps(message).encode() + b"\n")
+    response = b""
+    while not response.endswith(b"\n"):
+        data = connection.recv(65536)
+        if not data:
+            raise ConnectionError("the server closed the connection")
+        response += data
+    return json.loads(response)
+
+def run_remote(path, source, input, options):
+    program = hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+    message = {"program": program, "input": base64.b64encode(input).decode(), "options": options}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        response = request(connection, message)
+        if response.get("error") == "unknown program":                 # Send the source once
+            message["source"] = source
+            response = request(connection, message)
+
+    if "error" in response:
+        raise ConnectionError(response["error"])
+    return response
+
+def run_local():
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "VirtualMachine.py"), run_name="__main__")
+    exit(0)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) <= 1 or not os.path.isfile(sys.argv[len(sys.argv) - 1]):
+        run_local()                                                     # Usage and errors of asmvm
+
+    flags = sys.argv[1:len(sys.argv) - 1]
+    options = options_of(flags)
+    if options is None:
+        run_local()
+
+    path = sys.argv[len(sys.argv) - 1]
+    try:
+        with open(path, 'r') as file:
+            source = file.read()
+    except Exception:
+        run_local()
+
+    options["path"] = os.path.abspath(path)
+
+    input = b""
+    for f in flags:
+        if f.startswith("--input="):
+            try:
+                with open(f[len("--input="):], 'rb') as file:
+                    input = file.read()
+            except OSError:
+                run_local()
+            break
+    else:
+        if reads_input(source):
+            if sys.stdin.isatty():                                      # Keys are read from the terminal here
+                run_local()
+            input = sys.stdin.buffer.read()
+
+    socket_path = default_socket_path()
+    try:
+        check_socket_directory(socket_path)
+    except FileNotFoundError:                                           # No server ever started
+        run_local()
+    except OSError as err:
+        print(f"warning: {err} : running the program here", file=sys.stderr)
+        run_local()
+
+    try:
+        response = run_remote(socket_path, source, input, options)
+    except (OSError, ValueError):
+        run_local()
+
+    sys.stdout.buffer.write(base64.b64decode(response["output"]))
+    sys.stdout.buffer.flush()
+
+    if response["interrupt"] == 6 and "time_limit" not in options:
+        print(f"warning: the server stopped the run after its time limit of {response['time_limit']:g} seconds ; "
+            "run asmvm for longer runs", file=sys.stderr)
+
+    if response["exception"] is not None:
+        print(f"uncaught exception: {response['exception']}")
+        exit(1)
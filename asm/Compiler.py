@@ -0,0 +1,344 @@
+# Compiler from decoded pseudo-ASM programs to native Python functions
+#
+# The decoded program of a VirtualMachine is split into basic blocks (one for each label or jump target)
+# and each block is translated into the source of a Python function. The execute function selects the function of
+# the block at PC in a list indexed by address, so the source grows with the program and not with its number of
+# blocks. ACC, IX, PC, EFLAGS and the clock cycles live in local variables while the functions run and are written
+# back to the machine when execute returns
+# The functions keep the semantics of the interpreter : set_acc and set_ix clamping, get_mem and set_mem
+# bounds checks, the -1 error value of get_mem, the messages of each error and the interrupt codes
+# A sliced function, for runs under limits, returns before the next block could pass vm.cycle_end : the caller runs
+# the last cycles of the slice one at a time
+
+from VirtualMachine import OP_LDM, OP_LDD, OP_LDI, OP_LDX, OP_LDR, OP_MOV, OP_STO, OP_ADD, OP_SUB, OP_INC, \
+    OP_DEC, OP_JMP, OP_IN, OP_OUT, OP_END, OP_AND, OP_OR, OP_XOR, OP_LSL, OP_LSR, OP_CMP, OP_CMI, OP_JPE, \
+    OP_JPN, OP_NOP, OP_FAULT, MODE_INDIRECT, REG_ACC
+
+JUMPS = (OP_JMP, OP_JPE, OP_JPN)
+TERMINATORS = (OP_JMP, OP_JPE, OP_JPN, OP_END, OP_FAULT)
+
+def compile_program(vm, sliced=False):
+    source = generate_source(vm, sliced)
+    namespace = {"vm": vm, "mem": vm.MEM, "mem_size": len(vm.MEM), "fail": vm.fail}
+    exec(compile(source, "<pseudo-asm>", "exec"), namespace)
+    return namespace["execute"], source
+
+def find_leaders(program):
+    leaders = {0}
+    for i, (opcode, mode, operand) in enumerate(program):
+        if opcode in JUMPS and 0 <= operand < len(program):
+            leaders.add(operand)
+        if opcode in TERMINATORS and i + 1 < len(program):
+            leaders.add(i + 1)
+    return sorted(leaders)
+
+def generate_source(vm, sliced=False):
+    program = vm.program
+    size = len(program)
+    limit = vm.LIMIT
+    leaders = find_leaders(program)
+
+    # Memory can only hold words above the maximum of ACC when they are written as literals
+
+    clamp_loads = len(vm.MEM) > 0 and max(vm.MEM) >= limit
+
+    loops = vm.find_counted_loops() if vm.fast_forward else {}
+
+    labels = {}
+    for name, pc in vm.code_flags.items():
+        labels.setdefault(pc, []).append(name)
+
+    lines = [f"blocks = [None] * {size}"]
+
+    for n, start in enumerate(leaders):
+        end = leaders[n + 1] if n + 1 < len(leaders) else size
+        block = generate_block(vm, start, end, limit, clamp_loads)
+        if start in loops:
+            block = generate_counted_loop(vm, start, loops[start], limit, sliced) + block
+        lines += generate_function(start, block, labels.get(start, []), sliced)
+
+    arguments = "acc, ix, eflags, cycles, cycle_end" if sliced else "acc, ix, eflags, cycles"
+    lines += [
+        "",
+        "def execute(vm):",
+        "    acc = vm.ACC",
+        "    ix = vm.IX",
+        "    pc = vm.PC",
+        "    eflags = vm.EFLAGS",
+        "    cycles = vm.clock_cycles",
+    ]
+    if sliced:                                                                  # A block counts at most its length
+        span = max([end - start for start, end in zip(leaders, leaders[1:] + [size])] + [1])
+        lines += [
+            "    cycle_end = vm.cycle_end",
+            f"    stop = cycle_end - {span - 1}",
+        ]
+    lines += [
+        "    try:",
+        "        while True:",
+    ]
+    if sliced:
+        lines += [
+            "            if cycles >= stop:",
+            "                return",
+        ]
+    lines += [
+        f"            block = blocks[pc] if 0 <= pc < {size} else None",
+        "            if block is None:",                                       # Not the start of a block : interpreter
+        "                vm.ACC, vm.IX, vm.PC, vm.EFLAGS, vm.clock_cycles = acc, ix, pc, eflags, cycles",
+        "                try:",
+        "                    vm.next_instruction()",
+        "                finally:",
+        "                    acc, ix, pc, eflags, cycles = vm.ACC, vm.IX, vm.PC, vm.EFLAGS, vm.clock_cycles",
+        "                if vm.interrupt != 0:",
+        "                    return",
+        "                continue",
+        f"            pc, acc, ix, eflags, cycles, done = block({arguments})",
+        "            if done:",
+        "                return",
+        "    finally:",
+        "        vm.ACC = acc",
+        "        vm.IX = ix",
+        "        vm.PC = pc",
+        "        vm.EFLAGS = eflags",
+        "        vm.clock_cycles = cycles",
+        "",
+    ]
+    return "\n".join(lines)
+
+def generate_function(start, block, names, sliced):
+    # Function of a block : it returns the registers, the next PC and whether the run stops. A block which jumps back
+    # to its own start loops inside its function, except in a sliced function where the caller checks the slice
+    # The machine and its memory are globals of the module, bound to arguments when the function is defined so the
+    # block reads them as local variables
+    arguments = "acc, ix, eflags, cycles, cycle_end" if sliced else "acc, ix, eflags, cycles"
+    lines = [
+        "",
+        f"def block_{start}({arguments}, mem=mem, mem_size=mem_size, vm=vm, fail=fail):" + (f"                    # {', '.join(names)}" if names else ""),
+        f"    pc = {start}",
+        "    while True:",
+    ]
+
+    for line in block:
+        indent = line[:len(line) - len(line.lstrip())]
+        if line.strip() == "continue":
+            if not sliced:
+                lines.append(f"        {indent}if pc == {start}:")
+                lines.append(f"        {indent}    continue")
+            lines.append(f"        {indent}return pc, acc, ix, eflags, cycles, False")
+        elif line.strip() == "return":
+            lines.append(f"        {indent}return pc, acc, ix, eflags, cycles, True")
+        else:
+            lines.append(f"        {line}")
+
+    return lines + [f"blocks[{start}] = block_{start}"]
+
+def generate_block(vm, start, end, limit, clamp_loads):
+    program = vm.program
+    size = len(program)
+    length = end - start
+
+    lines = [f"cycles += {length}"]
+
+    for i in range(start, end):
+        opcode, mode, operand = program[i]
+        pc = i + 1
+        remaining = end - i - 1
+        last = pc == size
+
+        if opcode != OP_NOP:
+            lines.append(f"# {i}: {' '.join(vm.tree[i])}")
+
+        if last:
+            lines.append("vm.set_interrupt(1)")                                  # Program runs past its last instruction
+
+        lines += generate_instruction(vm, opcode, mode, operand, pc, remaining, limit, clamp_loads, last)
+
+        if opcode in TERMINATORS:
+            return lines
+
+    if end == size:
+        lines += [f"pc = {size}", "return"]
+    else:
+        lines += [f"pc = {end}", "continue"]
+    return lines
+
+def generate_counted_loop(vm, start, loop, limit, sliced):
+    # Jump over the remaining iterations of a counted loop : see VirtualMachine.find_counted_loops
+    counter, step, mode, operand = loop
+
+    if mode == MODE_INDIRECT:
+        if not 0 <= operand < len(vm.MEM):
+            return []
+        lines = [f"target = mem[{operand}]"]
+    else:
+        lines = [f"target = {operand}"]
+
+    condition = "data < target" if step == 1 else "target < data"
+
+    if sliced:                                                                  # Only the iterations which end by cycle_end
+        return lines + [
+            f"data = mem[{counter}]",
+            f"if 0 <= data < {limit} and 0 <= target < {limit} and {condition}:",
+            f"    count = min((target - data) * {step}, (cycle_end - cycles) // 5)",
+            "    if count > 0:",
+            "        cycles += 5 * count",
+            f"        mem[{counter}] = acc = data + count * {step}",
+            "        if acc == target:",
+            "            eflags |= 1",
+            f"            pc = {start + 5}",
+            "        else:",
+            "            eflags &= -2",
+            "        continue",
+        ]
+
+    return lines + [
+        f"data = mem[{counter}]",
+        f"if 0 <= data < {limit} and 0 <= target < {limit} and {condition}:",
+        f"    cycles += 5 * (target - data) * {step}",
+        f"    mem[{counter}] = acc = target",
+        "    eflags |= 1",
+        f"    pc = {start + 5}",
+        "    continue",
+    ]
+
+def generate_instruction(vm, opcode, mode, operand, pc, remaining, limit, clamp_loads, last):
+
+    def error(message):
+        return [f"fail({message!r})", f"pc = {pc}", f"cycles -= {remaining}", "return"]
+
+    def guarded(condition, message):
+        return [f"if {condition}:"] + ["    " + line for line in error(message)]
+
+    def check_acc(message):
+        return [f"if acc >= {limit}:", f"    acc = {limit - 1}"] + ["    " + line for line in error(message)]
+
+    def clamp_acc():
+        if clamp_loads:
+            return [f"if acc >= {limit}:", f"    acc = {limit - 1}"]
+        return []
+
+    def valid(addr):
+        return 0 <= addr < len(vm.MEM)
+
+    # Jump to the next block : the loop ends after the last instruction of the program
+
+    follow = "return" if last else "continue"
+
+    if opcode == OP_NOP:
+        return []
+
+    if opcode == OP_FAULT:
+        return [f"vm.raise_fault({mode}, {operand!r})", f"pc = {pc}", f"cycles -= {remaining}", "return"]
+
+    if opcode == OP_LDM:
+        if operand >= limit:
+            return [f"acc = {limit - 1}"] + error(f"exception at LDM : {pc}")
+        return [f"acc = {operand}"]
+
+    if opcode == OP_LDR:
+        return [f"ix = {min(operand, limit - 1)}"]
+
+    if opcode == OP_MOV:
+        return ["ix = acc", "if ix < 0:", "    ix = 0", f"elif ix >= {limit}:", f"    ix = {limit - 1}"]
+
+    if opcode == OP_LDD:
+        message = f"invalid data or position : {operand} : {pc}"
+        if not valid(operand):
+            return [f"vm.get_mem({operand})"] + error(message)
+        return [f"data = mem[{operand}]"] + guarded("data == -1", message) + ["acc = data"] + clamp_acc()
+
+    if opcode == OP_LDI:
+        message = f"invalid address or data during LDI : {pc}"
+        if not valid(operand):
+            return [f"vm.get_mem({operand})"] + error(message)
+        return [f"data = mem[{operand}]"] + guarded("data < 0 or data >= mem_size", message) + \
+            ["data = mem[data]"] + guarded("data == -1", message) + ["acc = data"] + clamp_acc()
+
+    if opcode == OP_LDX:
+        message = f"invalid address : {pc}"
+        return [f"data = {operand} + ix"] + guarded("data < 0 or data >= mem_size", message) + \
+            ["data = mem[data]"] + guarded("data == -1", message) + ["acc = data"] + clamp_acc()
+
+    if opcode == OP_STO:
+        if not valid(operand):
+            return [f"vm.set_mem({operand}, acc)"] + error(f"invalid address : {pc}")
+        if vm.memory_type == "array":                                           # Words wrap to the word width
+            return [f"mem[{operand}] = acc & {vm.MASK}"]
+        return [f"mem[{operand}] = acc"]
+
+    if opcode in (OP_ADD, OP_SUB, OP_AND, OP_OR, OP_XOR):
+        symbol = {OP_ADD: "+", OP_SUB: "-", OP_AND: "&", OP_OR: "|", OP_XOR: "^"}[opcode]
+        name = {OP_ADD: "ADD", OP_SUB: "SUB", OP_AND: "AND", OP_OR: "OR", OP_XOR: "XOR"}[opcode]
+        message = f"exception at {name} instruction : {pc}"
+        if mode != MODE_INDIRECT:
+            lines = [f"acc = acc {symbol} {operand}"]
+            if opcode == OP_SUB:                                                # Only lowers ACC : set_acc keeps negatives
+                return lines
+            return lines + check_acc(message)
+        if not valid(operand):
+            lines = [f"data = vm.get_mem({operand})"]
+        else:
+            lines = [f"data = mem[{operand}]"]
+        if opcode not in (OP_ADD, OP_SUB):                                      # ADD and SUB do not check for -1
+            lines += guarded("data == -1", message)
+        return lines + [f"acc = acc {symbol} data"] + check_acc(message)
+
+    if opcode == OP_INC:
+        if operand == REG_ACC:
+            return ["acc += 1"] + check_acc(f"error at INC : {pc}")
+        return ["ix += 1", f"if ix >= {limit}:", f"    ix = {limit - 1}"] + \
+            ["    " + line for line in error(f"error at INC : {pc}")]
+
+    if opcode == OP_DEC:
+        if operand == REG_ACC:
+            return ["acc -= 1"]
+        return ["ix -= 1", "if ix < 0:", "    ix = 0"] + ["    " + line for line in error(f"error at DEC : {pc}")]
+
+    if opcode in (OP_CMP, OP_CMI):
+        if opcode == OP_CMP and mode != MODE_INDIRECT:
+            return [f"eflags = eflags | 1 if acc == {operand} else eflags & -2"]
+        message = f"exception at CMP instruction : {pc}" if opcode == OP_CMP else f"error during CMI : {pc}"
+        if not valid(operand):
+            return [f"vm.get_mem({operand})"] + error(message)
+        return [f"data = mem[{operand}]"] + guarded("data == -1", message) + \
+            ["eflags = eflags | 1 if acc == data else eflags & -2"]
+
+    if opcode == OP_LSL:
+        message = f"exception at LSL : {pc}"
+        return [
+            "try:",
+            f"    acc = acc << {operand}",
+            "except Exception as err:",
+            f"    vm.throw_runtime_error(f\"uncaught VirtualMachine exception : {{err}} : {pc}\")",
+            "    vm.set_interrupt(3)",
+            f"    pc = {pc}",
+            f"    cycles -= {remaining}",
+            "    return",
+        ] + check_acc(message)
+
+    if opcode == OP_LSR:
+        return [f"acc = acc >> {operand}"]
+
+    if opcode in JUMPS:
+        name = {OP_JMP: "JMP", OP_JPE: "JPE", OP_JPN: "JPN"}[opcode]
+        condition = {OP_JMP: None, OP_JPE: "eflags & 1", OP_JPN: "not eflags & 1"}[opcode]
+        if operand < 0 or operand >= limit:
+            taken = [f"vm.set_pc({operand})"] + error(f"error during {name} : {pc}")
+        else:
+            taken = [f"pc = {operand}", follow]
+        if condition is None:
+            return taken
+        return [f"if {condition}:"] + ["    " + line for line in taken] + [f"pc = {pc}", follow]
+
+    if opcode == OP_END:
+        return [f"pc = {pc}", "vm.set_interrupt(10)", f"cycles -= {remaining}", "return"]
+
+    if opcode == OP_OUT:
+        return [f"pc = {pc}", "vm.ACC = acc"] + guarded("vm.OUT() != 0", f"exception at OUT : {pc}")
+
+    if opcode == OP_IN:
+        return [f"pc = {pc}", "vm.ACC = acc", "err = vm.IN()", "acc = vm.ACC"] + \
+            guarded("err != 0", f"exception at IN : {pc}")
+
+    raise ValueError(f"unknown opcode : {opcode}")
@@ -0,0 +1,140 @@
+# Write journal of a run for time-travel debugging
+#
+# Each clock cycle only records what it changed : the old value of each register it wrote, the address of the
+# instruction when it jumped, and the address and old value of each memory write. Going back one cycle applies the
+# old values of its entries, and PC goes back by one unless the cycle jumped
+# Every interval cycles a checkpoint copies the registers and the whole memory : going to any cycle restores the
+# first checkpoint at or after it, then undoes at most interval cycles
+#
+# Entries are kept in typed arrays, so the journal grows with the number of writes and not with the number of
+# cycles times the size of the state. The rare values which do not fit in 64 bits are kept aside
+
+import array
+from bisect import bisect_left, bisect_right
+
+# Kinds of entries : the value is the old value of the register, except for PC and the address of a memory write
+
+ACC = 0
+IX = 1
+EFLAGS = 2
+PC = 3                      # Address of the instruction of a cycle which jumped
+ADDRESS = 4                 # Address of a memory write : always followed by its MEMORY entry
+MEMORY = 5                  # Old value of the word at the ADDRESS entry before it
+
+class Journal:
+    def __init__(self, interval):
+        if interval < 1:
+            raise ValueError(f"invalid checkpoint interval : {interval}")
+        self.interval = interval        # Clock cycles between two checkpoints
+        self.cycles = array.array('Q')  # Clock cycle of each entry, in order
+        self.kinds = array.array('B')
+        self.values = array.array('q')
+        self.large = {}                 # Values which do not fit in 64 bits, by index of their entry
+        self.checkpoint_cycles = []     # Clock cycle of each checkpoint, in order
+        self.checkpoints = []           # ((ACC, IX, PC, EFLAGS, interrupt), memory) at each of them
+
+    def start(self):
+        return self.checkpoint_cycles[0]
+
+    def end(self):
+        return self.checkpoint_cycles[-1]
+
+    def record(self, cycle, kind, value):
+        try:
+            self.values.append(value)
+        except OverflowError:
+            self.large[len(self.values)] = value
+            self.values.append(0)
+        self.cycles.append(cycle)
+        self.kinds.append(kind)
+
+    def record_write(self, cycle, address, old):
+        self.record(cycle, ADDRESS, address)
+        self.record(cycle, MEMORY, old)
+
+    def value(self, index):
+        if self.large and index in self.large:
+            return self.large[index]
+        return self.values[index]
+
+    def checkpoint(self, vm):
+        state = ((vm.ACC, vm.IX, vm.PC, vm.EFLAGS, vm.interrupt), vm.MEM[:])
+
+        if self.checkpoint_cycles and self.checkpoint_cycles[-1] == vm.clock_cycles:
+            self.checkpoints[-1] = state                                            # Same cycle : keep the latest state
+        else:
+            self.checkpoint_cycles.append(vm.clock_cycles)
+            self.checkpoints.append(state)
+
+    def truncate(self, cycle):
+        # Drops every cycle after cycle : the run continues from there with another future
+        count = bisect_right(self.cycles, cycle)
+        del self.cycles[count:]
+        del self.kinds[count:]
+        del self.values[count:]
+        self.large = {index: value for index, value in self.large.items() if index < count}
+
+        kept = bisect_right(self.checkpoint_cycles, cycle)
+        del self.checkpoint_cycles[kept:]
+        del self.checkpoints[kept:]
+
+    def seek(self, vm, cycle):
+        # Puts the machine in its state at the end of cycle
+        if not self.checkpoints or not self.start() <= cycle <= self.end():
+            raise ValueError(f"clock cycle {cycle} is not in the journal")
+
+        k = bisect_left(self.checkpoint_cycles, cycle)
+
+        if not cycle <= vm.clock_cycles <= self.checkpoint_cycles[k]:               # Else undoing from here is shorter
+            registers, memory = self.checkpoints[k]
+            vm.ACC, vm.IX, vm.PC, vm.EFLAGS, vm.interrupt = registers
+            vm.MEM[:] = memory
+            vm.clock_cycles = self.checkpoint_cycles[k]
+
+        while vm.clock_cycles > cycle:
+            self.undo(vm)
+
+    def undo(self, vm):
+        # Goes back one cycle from the state at the end of vm.clock_cycles
+        cycle = vm.clock_cycles
+        cycles = self.cycles
+        kinds = self.kinds
+        index = bisect_right(cycles, cycle) - 1
+        jumped = False
+
+        while index >= 0 and cycles[index] == cycle:
+            kind = kinds[index]
+            value = self.value(index)
+            if kind == MEMORY:
+                vm.MEM[self.value(index - 1)] = value
+                index -= 2
+                continue
+            if kind == ACC:
+                vm.ACC = value
+            elif kind == IX:
+                vm.IX = value
+            elif kind == EFLAGS:
+                vm.EFLAGS = value
+            elif kind == PC:
+                vm.PC = value
+                jumped = True
+            index -= 1
+
+        if not jumped:
+            vm.PC -= 1
+        vm.interrupt = 0                                                            # Cycles only run while it is 0
+        vm.clock_cycles = cycle - 1
+
+    def writes(self, cycle):
+        # Memory addresses written during cycle
+        index = bisect_right(self.cycles, cycle) - 1
+        addresses = []
+
+        while index >= 0 and self.cycles[index] == cycle:
+            if self.kinds[index] == MEMORY:
+                addresses.append(self.value(index - 1))
+                index -= 2
+            else:
+                index -= 1
+
+        return addresses
@@ -0,0 +1,411 @@
+# Lockstep runs of one pseudo-ASM program over many inputs
+#
+# run_lockstep runs one source once for each input and initial memory and returns one Result for each instance, the
+# same Result as Batch.run_program. ACC, IX, PC, EFLAGS and the clock cycles of every instance are NumPy arrays and
+# the memory a matrix with one row for each instance : each cycle runs the instruction at the lowest PC as one array
+# operation over every instance whose PC is at it, so instances which take different branches of JPE and JPN wait
+# for each other where the branches meet again
+#
+# An instance which would report an error, read past the end of its input, write a character which is not valid or
+# reach its cycle limit leaves the lockstep run before that instruction and finishes on its own VirtualMachine from
+# the same state, so errors and exit codes are the ones of a single run
+# Every instance runs on its own VirtualMachine when NumPy is not installed, for words wider than 32 bits, with
+# console output, a time limit or the optimized clock cycles
+#
+# inputs   -> bytes read by IN, for each instance
+# memories -> initial memory of each instance : None, the words from address 0 or a dict of addresses or data flags
+#             to words. The words replace the memory once the program and its .map files are loaded
+# options  -> options of Batch.run_program
+
+import sys
+
+try:
+    import numpy
+except ImportError:                                                     # Optional : instances run one after the other
+    numpy = None
+
+from Batch import Result, prepare, collect
+from VirtualMachine import (OP_LDM, OP_LDD, OP_LDI, OP_LDX, OP_LDR, OP_MOV, OP_STO, OP_ADD, OP_SUB, OP_INC, OP_DEC,
+    OP_JMP, OP_JPE, OP_JPN, OP_CMP, OP_CMI, OP_END, OP_AND, OP_OR, OP_XOR, OP_LSL, OP_LSR, OP_OUT, OP_IN, OP_FAULT,
+    MODE_DIRECT, MODE_INDIRECT, REG_ACC)
+
+LOCKSTEP_ARCH = 32          # Widest words run in lockstep : sums of registers and words fit in 64 bits
+LOCKSTEP_BOUND = 2 ** 62    # Lowest magnitude of a negative ACC which leaves the lockstep run
+OPERAND_BOUND = 2 ** 40     # Instructions with larger operands only run on a VirtualMachine
+
+def run_lockstep(source, inputs=None, memories=None, options=None):
+    options = dict(options or {})
+
+    if inputs is None and memories is None:
+        raise ValueError("expected inputs or memories")
+    inputs = [bytes(data) for data in inputs] if inputs is not None else [b""] * len(memories)
+    memories = list(memories) if memories is not None else [None] * len(inputs)
+    if len(inputs) != len(memories):
+        raise ValueError(f"expected as many inputs as memories : {len(inputs)} inputs, {len(memories)} memories")
+
+    template = prepare(source, b"", options)
+    loaded = []
+    parsed = collect(template, lambda: loaded.append(template.load()))
+
+    if loaded != [0]:                                                   # Same parsing errors for every instance
+        return [Result(parsed.interrupt, parsed.output, parsed.clock_cycles, parsed.registers, list(parsed.errors),
+            parsed.exception) for _ in inputs]
+
+    words = [memory_words(template, memory) for memory in memories]
+
+    if numpy is None or template.ARCH > LOCKSTEP_ARCH or options.get("console", False) or \
+            options.get("time_limit") is not None or options.get("optimization") == "optimized":
+        return [run_instance(source, options, data, pairs) for data, pairs in zip(inputs, words)]
+
+    return Lockstep(template, source, options, inputs, words).run()
+
+def memory_words(VM, memory):
+    # (address, word) pairs of an initial memory
+    if memory is None:
+        return []
+    if isinstance(memory, dict):
+        pairs = [(VM.data_flags.get(address, address) if isinstance(address, str) else address, word)
+            for address, word in memory.items()]
+    else:
+        pairs = list(enumerate(memory))
+
+    for address, word in pairs:
+        if not isinstance(address, int) or not VM.is_valid_address(address):
+            raise ValueError(f"invalid address : {address}")
+        if not isinstance(word, int) or word < 0 or word >= VM.LIMIT:
+            raise ValueError(f"invalid word for x{VM.ARCH} memory : {word}")
+    return pairs
+
+def run_instance(source, options, input, pairs, state=None):
+    # One instance on its own VirtualMachine : from the start, or from the state where it left the lockstep run
+    VM = prepare(source, input, options)
+
+    def run():
+        if VM.load() != 0:
+            return
+        if state is None:
+            for address, word in pairs:
+                VM.MEM[address] = word
+            VM.set_pc(0)
+        else:
+            VM.ACC, VM.IX, VM.PC, VM.EFLAGS, VM.clock_cycles, position, memory, output = state
+            VM.input.position = position
+            VM.output.captured += output
+            for address, word in enumerate(memory):
+                VM.MEM[address] = word
+        VM.resume()
+
+    return collect(VM, run, options.get("console", False))
+
+class Lockstep:
+    def __init__(self, template, source, options, inputs, words):
+        self.source = source
+        self.options = options
+        self.inputs = inputs
+        self.program = template.program
+        self.errors = template.errors                                   # Reported while loading the program
+        self.LIMIT = template.LIMIT
+        self.MASK = template.MASK
+        self.masked = template.memory_type == "array"                  # Words are stored modulo LIMIT
+        self.separator = template.output.separator.decode()
+        self.cycle_limit = options.get("cycle_limit")
+
+        n = len(inputs)
+
+        self.ACC = numpy.zeros(n, dtype=numpy.int64)
+        self.IX = numpy.zeros(n, dtype=numpy.int64)
+        self.PC = numpy.zeros(n, dtype=numpy.int64)
+        self.EFLAGS = numpy.zeros(n, dtype=numpy.int64)
+        self.clock_cycles = numpy.zeros(n, dtype=numpy.int64)
+        self.interrupt = numpy.zeros(n, dtype=numpy.int64)
+        self.running = numpy.ones(n, dtype=bool)
+        self.escaped = numpy.zeros(n, dtype=bool)                       # Finish on their own VirtualMachine
+
+        self.MEM = numpy.tile(numpy.array(template.MEM, dtype=numpy.int64), (n, 1))
+        for i, pairs in enumerate(words):
+            for address, word in pairs:
+                self.MEM[i, address] = word
+
+        # Input of every instance in one array : each instance reads from its start to its end
+
+        ends = numpy.cumsum([len(data) for data in inputs], dtype=numpy.int64)
+        self.data = numpy.frombuffer(b"".join(inputs), dtype=numpy.uint8).astype(numpy.int64)
+        self.starts = ends - [len(data) for data in inputs]
+        self.position = self.starts.copy()
+        self.ends = ends
+
+        self.outputs = []                                               # (instances, characters) of each OUT
+
+        self.scalar = [self.scalar_only(pc) for pc in range(len(self.program))]
+
+    def scalar_only(self, pc):
+        # True for an instruction which only runs on a VirtualMachine : it always fails or its operand is out of range
+        opcode, mode, operand = self.program[pc]
+        size = len(self.program)
+        words = self.MEM.shape[1]
+
+        if opcode == OP_FAULT:
+            return True
+        if opcode in (OP_JMP, OP_JPE, OP_JPN):
+            return not 0 <= operand < size                             # Jumps out of the program
+        if opcode == OP_CMI or mode == MODE_INDIRECT:
+            return not 0 <= operand < words
+        if opcode == OP_LDM:
+            return not -OPERAND_BOUND < operand < self.LIMIT
+        if opcode in (OP_LSL, OP_LSR):
+            return operand < 0
+        if opcode == OP_LDR:
+            return False
+        if mode == MODE_DIRECT:
+            return not -OPERAND_BOUND < operand < OPERAND_BOUND
+        return False
+
+    def leave(self, ids):
+        self.running[ids] = False
+        self.escaped[ids] = True
+
+    def run(self):
+        program = self.program
+        size = len(program)
+
+        while True:
+            live = numpy.flatnonzero(self.running)
+            if live.size == 0:
+                break
+
+            pcs = self.PC[live]
+            pc = int(pcs.min())
+            ids = live[pcs == pc]
+
+            if pc >= size or self.scalar[pc]:
+                self.leave(ids)
+                continue
+
+            if self.cycle_limit is not None:
+                limited = self.clock_cycles[ids] >= self.cycle_limit
+                if limited.any():
+                    self.leave(ids[limited])
+                    ids = ids[~limited]
+                    if ids.size == 0:
+                        continue
+
+            ids = self.execute(ids, pc, *program[pc])
+            if ids.size == 0:
+                continue
+
+            if pc + 1 >= size:                                          # Ran past the last instruction
+                self.interrupt[ids] = numpy.where(self.interrupt[ids] == 0, 1, self.interrupt[ids])
+            self.running[ids] = self.interrupt[ids] == 0
+
+        return self.results()
+
+    def execute(self, ids, pc, opcode, mode, operand):
+        # Runs one instruction for the instances ids and returns those which ran it : the others leave the run first
+        ACC, IX, MEM = self.ACC, self.IX, self.MEM
+        LIMIT = self.LIMIT
+
+        acc = ACC[ids]
+        ok = None
+        value = None
+
+        if opcode == OP_LDM:
+            value = numpy.full(ids.size, operand, dtype=numpy.int64)
+
+        elif opcode == OP_LDD:
+            value = MEM[ids, operand]
+            ok = value != -1
+            value = numpy.minimum(value, self.MASK)                     # A word of LIMIT loads as MASK
+
+        elif opcode in (OP_LDI, OP_LDX):
+            if opcode == OP_LDI:
+                address = MEM[ids, operand]
+            else:
+                address = IX[ids] + operand
+            ok = (address >= 0) & (address < MEM.shape[1])
+            value = MEM[ids, numpy.where(ok, address, 0)]
+            ok &= value != -1
+            value = numpy.minimum(value, self.MASK)
+
+        elif opcode in (OP_ADD, OP_SUB, OP_AND, OP_OR, OP_XOR):
+            if mode == MODE_INDIRECT:
+                data = MEM[ids, operand]
+                if opcode != OP_ADD and opcode != OP_SUB:
+                    ok = data != -1
+            else:
+                data = operand
+            if opcode == OP_ADD:
+                value = acc + data
+            elif opcode == OP_SUB:
+                value = acc - data
+            elif opcode == OP_AND:
+                value = acc & data
+            elif opcode == OP_OR:
+                value = acc | data
+            else:
+                value = acc ^ data
+            fits = (value < LIMIT) & (value > -LOCKSTEP_BOUND)
+            ok = fits if ok is None else ok & fits
+
+        elif opcode == OP_INC or opcode == OP_DEC:
+            step = 1 if opcode == OP_INC else -1
+            if operand == REG_ACC:
+                value = acc + step
+                ok = (value < LIMIT) & (value > -LOCKSTEP_BOUND)
+            else:
+                ix = IX[ids] + step
+                ok = (ix >= 0) & (ix < LIMIT)
+
+        elif opcode == OP_LSL:
+            if operand >= LOCKSTEP_ARCH:
+                value = numpy.zeros(ids.size, dtype=numpy.int64)
+                ok = acc == 0
+            else:
+                value = acc << operand
+                ok = (acc >= 0) & (value < LIMIT)
+
+        elif opcode == OP_LSR:
+            value = acc >> min(operand, 63)
+
+        elif opcode == OP_CMP or opcode == OP_CMI:
+            if mode == MODE_DIRECT:
+                data = operand
+            else:
+                data = MEM[ids, operand]
+                ok = data != -1
+
+        elif opcode == OP_OUT:
+            ok = (acc >= 0) & (acc < 0x110000) & ((acc < 0xD800) | (acc >= 0xE000))
+
+        elif opcode == OP_IN:
+            ok = self.position[ids] < self.ends[ids]
+
+        if ok is not None and not ok.all():
+            self.leave(ids[~ok])
+            ids = ids[ok]
+            if value is not None:
+                value = value[ok]
+            if opcode in (OP_CMP, OP_CMI) and mode != MODE_DIRECT:
+                data = data[ok]
+            acc = acc[ok]
+            if ids.size == 0:
+                return ids
+
+        self.clock_cycles[ids] += 1
+        self.PC[ids] = pc + 1
+
+        if value is not None:
+            ACC[ids] = value
+
+        elif opcode == OP_LDR:
+            IX[ids] = min(max(operand, 0), self.MASK)
+
+        elif opcode == OP_MOV:
+            IX[ids] = numpy.maximum(acc, 0)
+
+        elif opcode == OP_INC or opcode == OP_DEC:
+            IX[ids] = IX[ids] + (1 if opcode == OP_INC else -1)
+
+        elif opcode == OP_STO:
+            MEM[ids, operand] = acc & self.MASK if self.masked else acc
+
+        elif opcode == OP_JMP:
+            self.PC[ids] = operand
+
+        elif opcode == OP_JPE or opcode == OP_JPN:
+            taken = (self.EFLAGS[ids] & 1) != 0
+            if opcode == OP_JPN:
+                taken = ~taken
+            self.PC[ids[taken]] = operand
+
+        elif opcode == OP_CMP or opcode == OP_CMI:
+            self.EFLAGS[ids] = numpy.where(data == acc, self.EFLAGS[ids] | 1, self.EFLAGS[ids] & ~1)
+
+        elif opcode == OP_END:
+            self.interrupt[ids] = 10
+
+        elif opcode == OP_OUT:
+            self.outputs.append((ids, acc))
+
+        elif opcode == OP_IN:
+            position = self.position[ids]
+            ACC[ids] = self.data[position]
+            self.position[ids] = position + 1
+
+        return ids
+
+    def results(self):
+        n = len(self.inputs)
+
+        # Characters of each instance in the order they were written
+
+        if self.outputs:
+            ids = numpy.concatenate([ids for ids, _ in self.outputs])
+            characters = numpy.concatenate([characters for _, characters in self.outputs])
+            order = numpy.argsort(ids, kind="stable")
+            counts = numpy.bincount(ids, minlength=n)
+            written = numpy.split(characters[order], numpy.cumsum(counts)[:-1])
+        else:
+            written = [numpy.zeros(0, dtype=numpy.int64)] * n
+
+        results = []
+        for i in range(n):
+            output = "".join(chr(character) + self.separator for character in written[i].tolist()).encode("utf-8")
+            registers = (int(self.ACC[i]), int(self.IX[i]), int(self.PC[i]), int(self.EFLAGS[i]))
+
+            if self.escaped[i]:
+                state = registers + (int(self.clock_cycles[i]), int(self.position[i] - self.starts[i]),
+                    self.MEM[i].tolist(), output)
+                results.append(run_instance(self.source, self.options, self.inputs[i], [], state))
+            else:
+                results.append(Result(int(self.interrupt[i]), output, int(self.clock_cycles[i]), registers,
+                    list(self.errors)))
+
+        return results
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) <= 2:
+        print('''usage: asmlockstep [flags] <sourcefile.s> <inputfile>...
+flags:
+\t--cycle-limit=<n>\tstop each instance with interrupt 5 after n clock cycles
+\t--memory-size=<n>\tnumber of words of memory
+''')
+        exit(0)
+
+    options = {}
+    paths = []
+
+    for arg in sys.argv[1:]:
+        name, _, value = arg.partition('=')
+        if name in ("--cycle-limit", "--memory-size"):
+            try:
+                options[name[2:].replace('-', '_')] = int(value)
+            except ValueError:
+                print(f"error: invalid number : {arg}")
+                exit(1)
+        elif arg.startswith('-'):
+            print(f"error: invalid flag : {arg}")
+            exit(1)
+        else:
+            paths.append(arg)
+
+    try:
+        with open(paths[0], 'r') as file:
+            source = file.read()
+        inputs = []
+        for path in paths[1:]:
+            with open(path, 'rb') as file:
+                inputs.append(file.read())
+    except OSError as err:
+        print(f"error: could not open file: {err}")
+        exit(1)
+
+    options["path"] = paths[0]
+
+    for path, result in zip(paths[1:], run_lockstep(source, inputs, options=options)):
+        print(f"{path} : exit code {result.interrupt} : {result.clock_cycles} clock cycles : {len(result.errors)} errors")
+        for error in result.errors:
+            print(f"\t{error}")
+        if result.exception is not None:
+            print(f"\tuncaught exception: {result.exception}")
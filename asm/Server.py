@@ -0,0 +1,198 @@
+# Server of pseudo-ASM runs
+#
+# Listens on a Unix domain socket and runs programs on a pool of processes started with the server, so a run does
+# not pay for the start of the interpreter, the imports and, for a program seen before, the parsing : each process
+# keeps the programs it assembled in memory (see Batch.py)
+#
+# Requests and responses are JSON objects, one per line, and a connection can send several requests
+#
+# request :
+#   source  -> text of the program
+#   program -> id of a program sent before, instead of the source
+#   input   -> bytes read by IN, in base64
+#   options -> options of Batch.run_program : time_limit is at most the time limit of the server, when it has one
+#
+# response :
+#   program      -> id of the program : the SHA-256 of its source
+#   interrupt    -> exit interrupt
+#   output       -> output of the program, in base64
+#   clock_cycles -> clock cycles of the run
+#   registers    -> ACC, IX, PC and EFLAGS
+#   errors       -> every error the program reported
+#   exception    -> message of an exception which stopped the machine, or null
+#   time_limit   -> time limit of the run, or null
+# or { "error": message } when the request is invalid or the run failed, "unknown program" when the id was never
+# sent or was dropped
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from Batch import ProgramCache, OPTIONS, run_job
+from Client import check_socket_directory, default_socket_path
+
+def warm():
+    # Run in each process of the pool : the modules are imported before the first job
+    return os.getpid()
+
+def listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+            return True
+        except OSError:
+            return False
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.run(json.loads(line))
+            except (ValueError, TypeError, binascii.Error) as err:
+                response = {"error": str(err)}
+            except Exception as err:                                    # The connection still gets a response
+                response = {"error": f"could not run the program : {err!r}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, workers=None, programs=1024, time_limit=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.time_limit = time_limit                                    # None lets runs take any time
+        self.sources = ProgramCache(programs)                           # Source of each program id
+        self.lock = threading.Lock()
+        check_socket_directory(path, create=True)
+        self.executor = self.start_pool()
+
+        if os.path.exists(path):
+            if listening(path):
+                self.executor.shutdown()
+                raise OSError(f"a server already listens on {path}")
+            os.unlink(path)                                             # Socket of a server which stopped
+        super().__init__(path, Handler)
+
+    def start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm)
+        for future in [executor.submit(warm) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def run(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("invalid request : expected an object")
+
+        source = request.get("source")
+        if source is None:
+            program = request.get("program")
+            with self.lock:
+                source = self.sources.get(program)
+            if source is None:
+                return {"error": "unknown program", "program": program}
+        else:
+            program = hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+            with self.lock:
+                self.sources[program] = source
+
+        options = request.get("options") or {}
+        if not isinstance(options, dict):
+            raise ValueError("invalid options : expected an object")
+        for name in options:
+            if name not in OPTIONS:
+                raise ValueError(f"invalid option : {name}")
+        if self.time_limit is not None:
+            limit = options.get("time_limit")
+            if not isinstance(limit, (int, float)) or limit > self.time_limit:
+                options = dict(options, time_limit=self.time_limit)
+        input = base64.b64decode(request.get("input", ""), validate=True)
+
+        executor = self.executor
+        try:
+            result = executor.submit(run_job, (source, input, options)).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:                           # A process died : start a new pool once
+                    self.executor = self.start_pool()
+                    executor.shutdown(wait=False)
+            raise
+
+        return {
+            "program": program,
+            "interrupt": result.interrupt,
+            "output": base64.b64encode(result.output).decode(),
+            "clock_cycles": result.clock_cycles,
+            "registers": list(result.registers),
+            "errors": result.errors,
+            "exception": result.exception,
+            "time_limit": options.get("time_limit"),
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+if __name__ == "__main__":
+
+    if "-h" in sys.argv or "--help" in sys.argv:
+        print(f'''usage: asmserver [flags]
+flags:
+\t--socket=<path>\tpath of the Unix socket (default {default_socket_path()})
+\t--jobs=<n>   \tnumber of processes (default one for each CPU)
+\t--programs=<n>\tnumber of program ids kept for the clients (default 1024)
+\t--time-limit=<seconds>\tlongest execution of a run, so a program which never ends frees its process (default none)
+
+asmvm-client takes the flags of asmvm and runs the program on the server''')
+        exit(0)
+
+    path = default_socket_path()
+    workers = None
+    programs = 1024
+    time_limit = None
+
+    for f in sys.argv[1:]:
+        name, _, value = f.partition('=')
+        try:
+            if name == "--socket":
+                path = value
+            elif name == "--jobs":
+                workers = int(value)
+            elif name == "--programs":
+                programs = int(value)
+            elif name == "--time-limit":
+                time_limit = float(value) or None
+            else:
+                raise ValueError(f"invalid flag : {f}")
+        except ValueError as err:
+            print(f"error: {err}")
+            exit(1)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server = Server(path, workers, programs, time_limit)
+    except OSError as err:
+        print(f"error: {err}")
+        exit(1)
+
+    with server:
+        limit = f" : runs stop after {time_limit:g} seconds" if time_limit is not None else ""
+        print(f"listening on {path} with {server.workers} processes{limit}")
+        try:
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
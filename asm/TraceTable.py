@@ -0,0 +1,103 @@
+# Trace table renderer
+#
+# The layout of the table only depends on the program : the label and the padded instruction of each address and
+# the widths of the columns are computed once, when the renderer is created. Each cycle only formats the clock
+# cycle, the registers and the output character around the precomputed text of its address
+#
+# Formats :
+#   table -> ASCII table, the layout of --table
+#   csv   -> comma separated values with a header row
+#   tsv   -> tab separated values with a header row
+#
+# Rows are written to a text stream : stdout keeps its own buffering so rows stay in order with the output and the
+# errors of the program, a file is opened with a large buffer
+
+import csv
+import sys
+
+FORMATS = ["table", "csv", "tsv"]
+COLUMNS = ["n", "label", "instruction", "ACC", "IX", "PC", "OUT"]
+
+class TraceTable:
+    def __init__(self, tree, code_flags, format="table", path=None, buffer_size=1 << 20):
+        if format not in FORMATS:
+            raise ValueError(f"invalid trace table format : {format}")
+
+        self.tree = tree
+        self.format = format
+        self.path = path
+        self.file = open(path, 'w', buffering=buffer_size, newline='') if path else None
+
+        self.labels = {}                                                # Last code flag of each address
+        for name, pc in code_flags.items():
+            self.labels[pc] = name
+
+        if len(tree) < 10: self.width = 2
+        elif len(tree) < 100: self.width = 3
+        elif len(tree) < 1000: self.width = 4
+        else: self.width = 5
+
+        self.has_labels = len(code_flags) > 0
+        self.cells = {}                                                 # Text of each address : (instruction, pc, end)
+
+        if format != "table":
+            self.writer = csv.writer(self.stream(), delimiter=',' if format == "csv" else '\t', lineterminator='\n')
+
+    def stream(self):
+        return self.file if self.file is not None else sys.stdout
+
+    def head(self):
+        if self.format != "table":
+            self.writer.writerow(COLUMNS)
+            return
+
+        line = '-' * (42 + self.width + 1 + (19 if self.has_labels else 0))
+        labels = ' ' * 13 if self.has_labels else ''
+        pc = ' ' * (self.width - 2)
+
+        self.stream().write(f" {line} \n |  n  | instruction    {labels}     | ACC | IX  | PC{pc}| OUT |\n {line} \n")
+
+    def tail(self):
+        if self.format != "table":
+            return
+
+        self.stream().write(f" {'-' * (42 + self.width + 1 + (19 if self.has_labels else 0))} \n")
+
+    def cell(self, pc, instruction):
+        # Label and instruction column, PC column and end of the row of an address
+        name = self.labels.get(pc, "")
+        padding = ' ' * (20 - len('  '.join(instruction)))
+        label = ' ' * (12 - len(name))
+
+        if name != "":
+            if len(instruction) >= 2:
+                text, end = f"{name}:{label}{' '.join(instruction)}{padding} ", "  |"
+            else:
+                text, end = f"{name}:{label}{instruction[0]}{padding}", "   |"
+        elif len(instruction) >= 2:
+            text, end = f" {label}{' '.join(instruction)}{padding} ", "  |"
+        else:
+            text, end = f" {label}{instruction[0]}{padding}", "  |" if self.has_labels else "   |"
+
+        cell = (text, f"{pc}{' ' * (self.width - len(str(pc)))}", end)
+        self.cells[pc] = cell
+        return cell
+
+    def row(self, number, instruction, pc, acc, ix, output):
+        if self.format != "table":
+            self.writer.writerow([number, self.labels.get(pc, ""), ' '.join(instruction), acc, ix, pc, output])
+            return
+
+        cell = self.cells.get(pc)
+        if cell is None:
+            cell = self.cell(pc, instruction)
+        text, pc, end = cell
+
+        self.stream().write(f" | {number:<4}| {text}| {acc:<4}| {ix:<4}| {pc}|  {output or ' '}{end}\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        else:
+            sys.stdout.flush()
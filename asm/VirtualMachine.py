@@ -1,9 +1,59 @@
 # Virtual Machine for pseudo-ASM syntax
 
+import array
+import hashlib
+import io
+import marshal
+import mmap
+import operator
 import os
+import re
+import signal
+import struct
 import sys
 import time
 
+# Decoded opcodes - each one is the index of its mnemonic inside VirtualMachine.valid_opcodes
+
+OP_LDM, OP_LDD, OP_LDI, OP_LDX, OP_LDR, OP_MOV, OP_STO, OP_ADD, OP_SUB, OP_INC, OP_DEC, OP_JMP, \
+    OP_IN, OP_OUT, OP_END, OP_AND, OP_OR, OP_XOR, OP_LSL, OP_LSR, OP_CMP, OP_CMI, OP_JPE, OP_JPN = range(24)
+
+OP_NOP = 24                     # Empty line : data or flag without an instruction
+OP_FAULT = 25                   # Instruction which could not be decoded : raises its errors once executed
+
+# Addressing modes of the decoded operand
+
+MODE_NONE = 0                   # No operand
+MODE_DIRECT = 1                 # Value : #n &n Bn
+MODE_INDIRECT = 2               # Data address
+MODE_REGISTER = 3               # Register : REG_ACC or REG_IX
+MODE_CODE = 4                   # Instruction address
+
+REG_ACC = 0
+REG_IX = 1
+
+# Typecodes of the unsigned array.array items for each supported word width of the typed memory
+
+WORD_TYPECODES = {}
+for typecode in "BHILQ":
+    WORD_TYPECODES.setdefault(array.array(typecode).itemsize * 8, typecode)
+
+# Header of the snapshot and program cache files : magic, format version and size of the encoded state
+
+IMAGE_HEADER = struct.Struct("<8sHI")
+
+SNAPSHOT_MAGIC = b"ASMSNAP\0"
+SNAPSHOT_VERSION = 1
+
+CACHE_MAGIC = b"ASMCACHE"
+CACHE_VERSION = 1               # Change it whenever the parser or the decoded program change
+
+CONDITIONS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+LIMIT_CHECK_CYCLES = 10000      # Clock cycles run between two checks of the cycle and time limits
+COMPILE_LIMIT = 5000            # Longest program translated by the compile engine : longer ones use the dispatch engine
+JOURNAL_INTERVAL = 100000       # Clock cycles between two checkpoints of the write journal of --journal and --rewind
+
 class VirtualMachine:
     def __init__(self):
         self.IX = 0                 # Index Register
@@ -12,32 +62,124 @@ class VirtualMachine:
         self.EFLAGS = 0             # Eflags register read and write with bitmasking
         self.interrupt = 0          # Interrupts buffer
         self.OUTPUT = ''            # Stores the output of the program
+        self.output = OutputSink()  # Buffered destination of the output of the program
+        self.input = None           # Source of the IN instruction : None reads stdin
 
         self.tree = []              # Syntax tree for source
+        self.program = []           # Decoded instructions : (opcode, mode, operand) for each line of the tree
+        self.code = []              # Decoded instructions linked to their handlers : (handler, operand)
+        self.plain_code = []        # Linked handlers before superinstructions, the optimizer and fast-forwarding
+        self.span = 1               # Most clock cycles one call of a handler of code counts, fast-forwarded loops aside
+        self.cycle_end = float("inf")   # Clock cycle which fast-forwarded loops do not pass : the end of a limited slice
+        self.compiled_source = ""   # Python source generated by the compile engine
         self.source = ""            # Raw sourcecode
+        self.source_path = None     # File of the sourcecode : relative .map paths start there
+        self.streaming = False      # Assemble the source line by line with the streaming assembler
         self.code_flags = {}        # Code flags
         self.data_flags = {}        # Data flags
 
         self.MEM = []               # Memory
         self.MAX_ADDRESS = 32       # Memory size
-        self.ARCH = 32              # Architecture size
+        self.ARCH = 32              # Architecture size : word width in bits
+        self.LIMIT = 2 ** self.ARCH # First value which does not fit in a word
+        self.MASK = self.LIMIT - 1  # Largest value of a word
+        self.memory_type = "list"   # Memory backend : list of ints or typed array of unsigned words
+        self.memory_maps = []       # Files copied into memory before running : (address, path)
+        self.directive_maps = []    # Files mapped by .map directives of the source
+        self.dump_path = None       # File which receives the memory once the run ends
+        self.snapshot_path = None   # File which receives the state of the machine once the run ends or pauses
+        self.cache_dir = None       # Directory of the cached assembled programs : None parses every run
+        self.program_cache = None   # Assembled programs kept in memory : mapping with the keys of the disk cache
+        self.pause_at = None        # Clock cycle or code flag where the run pauses before executing it
+        self.pause_cycle = None     # Clock cycle of pause_at while the run goes to it : the end of the limited run
+        self.pause_pc = None        # Instruction address of pause_at while the run goes to it : wrapped by exec_PAUSE
+        self.paused = False         # exec_PAUSE stopped the run
+        self.breakpoints = []       # Breakpoints : (instruction address, code flag or None for every address, condition)
+        self.watchpoints = []       # Data addresses or data flags whose writes stop the run
+        self.stopped = None         # (PC, clock cycles) of the last breakpoint which stopped the run : passed on resume
+        self.stop_reason = None     # Breakpoint or watchpoint which stopped the run with interrupt 7
         self.clock_cycles = 0       # Total clock cycles executed
+        self.cycle_limit = None     # Clock cycles after which the run stops with interrupt 5 : None has no limit
+        self.time_limit = None      # Seconds of execution after which the run stops with interrupt 6 : None has no limit
+        self.run_time = 0.0         # Seconds spent executing under limits or with step
         self.DELAY = 0.1            # Delay after each instruction
-
-        self.step = False           # Wait after each cycle
+        self.engine = "switch"      # Execution engine : switch, dispatch or compile
+        self.fusion = False         # Merge common instruction sequences into superinstructions
+        self.optimization = None    # Optimizer : None, optimized (skipped instructions do not count) or faithful cycles
+        self.fast_forward = False   # Compute the final state of counted loops instead of running each iteration
+        self.profile = False        # Count executions and time of each instruction and print a report
+        self.profile_counts = []    # Executions of each instruction address
+        self.profile_times = []     # Time spent on each instruction address in nanoseconds
+        self.profile_back_edges = []# Taken jumps of each address back to the same or an earlier address
+        self.recorder_size = 0      # Last cycles kept by the flight recorder : 0 disables it
+        self.recorder = None        # Ring of the flight recorder : (clock cycle, PC, ACC, IX, EFLAGS)
+        self.recorder_path = None   # File which receives the dumps of the flight recorder : None writes to stdout
+        self.journal_interval = 0   # Clock cycles between two checkpoints of the write journal : 0 disables it
+        self.journal = None         # Write journal of the run for time-travel debugging
+        self.rewind = 0             # Clock cycles undone with the journal when the run does not end with END
+
+        self.stepping = False       # Wait after each cycle
         self.DEBUG = False          # Debugging state
         self.show_pc = False        # Show Program Counter after each instruction
         self.show_ix = False        # Show Index Register after each instruction
         self.show_acc = False       # Show Accumulator after each instruction
         self.show_inst = False      # Show the instruction currently being executed
         self.tracetable = False     # Show a complete tracetable
+        self.trace = None           # Renderer of the tracetable
+        self.trace_format = "table" # Format of the tracetable : table, csv or tsv
+        self.trace_path = None      # File which receives the tracetable : None writes to stdout
 
         self.valid_opcodes = ["LDM", "LDD", "LDI", "LDX", "LDR", "MOV", "STO", "ADD", "SUB", "INC", "DEC", "JMP", "IN", "OUT", "END", "AND", "OR", "XOR", "LSL", "LSR", "CMP", "CMI", "JPE", "JPN"]
+        self.opcode_numbers = {name: number for number, name in enumerate(self.valid_opcodes)}
+
+        self.deferred_errors = None # Collects errors raised while decoding instead of printing them
+        self.errors = []            # Every error reported during the run
+        self.quiet = False          # Only keep errors in self.errors without printing them
 
     def run(self):
 
+        if self.load() != 0:
+            return
+
+        self.debug("starting program")
+
+        # Set PC to emulate index of array (virtual address) and run that line
+
+        self.set_pc(0)                                                              # Initialize PC to 0
+
+        self.resume()
+
+    def load(self):
+
         self.initialize_memory()
 
+        key = None
+
+        if self.cache_dir is not None or self.program_cache is not None:
+            key = self.cache_key()
+            if self.load_cached(key) == 0:
+                return self.map_files()
+
+        errors = len(self.errors)
+
+        if self.streaming:
+            err = self.assemble_stream()
+        else:
+            err = self.parse_source()
+
+        if err != 0:
+            return err
+
+        if key is not None:
+            self.save_cached(key, self.errors[errors:])
+
+        if self.map_files() != 0:
+            return 1
+
+        return 0
+
+    def parse_source(self):
+
         self.tree = []
 
         # Parse source into a 2D array of lines of opcodes and operands - syntax tree
@@ -46,19 +188,26 @@ class VirtualMachine:
 
         ins = self.source.split('\n')
 
+        self.directive_maps = []
+
         for i in ins:
             i = i.strip()
             if i == '' or i.startswith("//"):
                 continue
             current = i.split(' ')
             current = list(filter(('').__ne__, current))                            # Delete elements which are an empty string
+            if current[0].startswith('.'):                                          # Directives do not take an address
+                err = self.parse_directive(current)
+                if err != 0:
+                    return err
+                continue
             self.tree.append(current)
 
         err = self.parse_flags()                                                    # Do a first iteration over the code and set all the flags
 
         if err != 0:
             self.throw_syntax_error(f"could not set flags - exit code {err}")
-            return
+            return err
 
         exceptions = 0
 
@@ -68,423 +217,1657 @@ class VirtualMachine:
                 self.throw_syntax_error(f"too many arguments at instruction {i} : {' '.join(self.tree[i])}")
 
         if exceptions > 0:
-            return
+            return 1
 
         self.debug(f"initialized syntax tree with {len(self.tree)} instructions")
 
-        self.debug(f"starting program")
+        self.assemble()                                                             # Decode every instruction once
+
+        return 0
+
+    def assemble_stream(self):
+
+        # Assemble the source line by line : the file is read while it is assembled when only its path is known
+
+        from Assembler import Assembler                                             # Only loaded for streamed sources
+
+        if self.source is None:
+            with open(self.source_path, 'r') as file:
+                return Assembler(self).assemble(file)
+
+        return Assembler(self).assemble(io.StringIO(self.source))
+
+    def resume(self):
+
+        # Run from the current state until the program stops : a new program or a loaded snapshot
 
         if self.tracetable:
             self.print_head_tracetable_line()
 
-        # Set PC to emulate index of array (virtual address) and run that line
+        if self.input is None:
+            self.input = default_input()
 
-        self.set_pc(0)                                                              # Initialize PC to 0
+        self.continue_after_stop()
 
+        self.input.open()
 
-        while self.interrupt == 0:                                                  # Define exit interrupts
-            self.next_instruction()
+        try:
+            self.execute()
+        except BaseException:
+            if self.recorder is not None:                                           # Crashed or aborted by the user
+                self.dump_recorder()
+            raise
+        finally:
+            self.input.close()
+            self.output.flush()                                                     # Output is kept even if the machine crashes
+            if self.dump_path:
+                self.dump_memory(self.dump_path)
+
+        self.finish()
+
+    def finish(self):
+
+        # Report the end of a run
 
         # 1  -> Parsing error
         # 2  -> Runtime error
         # #  -> Virtual Machine Runtime Exception
+        # 5  -> Cycle limit reached
+        # 6  -> Time limit reached
+        # 7  -> Stopped at a breakpoint or watchpoint
         # 9  -> Aborted by user
         # 10 -> Program ended (naturally)
 
         if self.tracetable:
             self.print_tail_tracetable_line()
 
-        self.debug(f"program exited with exit code: {self.interrupt}")
+        if self.interrupt == 0:
+            self.debug(f"program paused at PC {self.PC}")
+        else:
+            self.debug(f"program exited with exit code: {self.interrupt}")
 
         self.debug(f"total clock cycles : {self.clock_cycles}")
 
+        if self.profile:
+            self.print_profile()
+
+        if self.recorder is not None and self.interrupt not in (0, 7, 10):
+            self.dump_recorder()
+
+        if self.rewind > 0 and self.journal is not None and self.interrupt not in (0, 7, 10):
+            self.reverse_step(self.rewind)
+            self.stop(f"rewound to {self.location(self.PC)}")
+
+        if self.snapshot_path:
+            self.save_snapshot(self.snapshot_path)
+
+    def execute(self):
+
+        self.check_cycle_tools()
+
+        if self.pause_at is not None and self.set_pause() != 0:
+            return
+
+        try:
+            self.execute_engine()
+        finally:
+            if self.pause_cycle is not None or self.pause_pc is not None:
+                self.end_pause()
+
+    def execute_engine(self):
+
+        engine = self.engine
+
+        if self.has_breakpoints() and engine != "dispatch":
+            self.debug("breakpoints are installed in the handlers of the dispatch engine : using the dispatch engine")
+            engine = "dispatch"
+
+        if self.profile:
+            self.debug("profiling each instruction : using the dispatch engine")
+            self.link()
+            self.execute_profiled()
+            return
+
+        if self.recorder_size > 0:
+            self.debug(f"recording the last {self.recorder_size} cycles : using the dispatch engine")
+            self.link()
+            self.execute_recorded()
+            return
+
+        if self.journal_interval > 0:
+            self.debug(f"journaling each write with a checkpoint every {self.journal_interval} cycles : using the dispatch engine")
+            self.link()
+            self.execute_journaled()
+            return
+
+        if engine == "compile" and self.is_observed():
+            self.debug("the compile engine cannot show each cycle : using the dispatch engine")
+            engine = "dispatch"
+
+        if engine == "compile" and len(self.program) > COMPILE_LIMIT:
+            self.debug(f"{len(self.program)} instructions take longer to compile than to run : using the dispatch engine")
+            engine = "dispatch"
+
+        if self.optimization is not None:
+            if not self.is_rewritable():
+                self.debug("the optimizer only runs when no cycle is shown and no breakpoint is set")
+            else:
+                self.eliminate_dead_code()
+                if engine == "switch":
+                    self.debug("the optimizer rewrites the handlers of the dispatch engine : using the dispatch engine")
+                    engine = "dispatch"
+
+        if self.fast_forward and engine == "switch" and not self.is_observed():
+            self.debug("counted loops are fast-forwarded by the dispatch engine : using the dispatch engine")
+            engine = "dispatch"
+
+        if self.fusion and engine == "switch" and self.is_rewritable():
+            self.debug("superinstructions replace handlers of the dispatch engine : using the dispatch engine")
+            engine = "dispatch"
+
+        if self.has_limits():
+            self.debug("running under cycle or time limits : checking them between slices")
+            self.link()
+            if engine == "compile":
+                self.execute_limited(compiled=self.compile_program(sliced=True))
+            else:
+                if self.is_rewritable():
+                    self.rewrite()
+                self.execute_limited()
+        elif engine == "compile":
+            execute = self.compile_program()
+            while self.interrupt == 0:                                              # Define exit interrupts
+                execute(self)
+        else:
+            if engine == "dispatch":
+                self.link()
+                if self.is_rewritable():
+                    self.rewrite()
+
+            if not self.is_observed() and len(self.program) < self.LIMIT:
+                self.debug("no cycle is shown : running headless")
+                self.run_headless(engine)
+            elif engine == "dispatch":
+                while self.interrupt == 0:
+                    self.dispatch_instruction()
+            else:
+                while self.interrupt == 0:
+                    self.next_instruction()
+
+    # Pause points
+    # A pause at a clock cycle ends the run like a limit, and a pause at a code flag stops it like a breakpoint before
+    # the instruction of the flag runs, so the engine, the limits, the profiler, the flight recorder and the journal
+    # run as they would without the pause
+
+    def set_pause(self):
+        point = str(self.pause_at)
+        self.pause_at = None                                                        # The run only pauses once
+
+        if point.isdigit():
+            self.pause_cycle = int(point)
+        elif point in self.code_flags:
+            self.pause_pc = self.code_flags[point]
+            self.code = []                                                          # Linked again with exec_PAUSE
+        else:
+            self.throw_syntax_error(f"invalid pause point : {point} ; expected a clock cycle or a code flag")
+            self.set_interrupt(1)
+            return 1
+
+        return 0
+
+    def end_pause(self):
+        if self.paused:
+            self.interrupt = 0
+
+        if self.interrupt == 0:
+            self.debug(f"paused at PC {self.PC} after {self.clock_cycles} clock cycles")
+
+        if self.pause_pc is not None:
+            self.code = []                                                          # Linked again without exec_PAUSE
+
+        self.pause_cycle = None
+        self.pause_pc = None
+        self.paused = False
+
+    def exec_PAUSE(self, operands):
+        pc, handler, operand = operands
+
+        if self.paused:
+            return handler(operand)
+
+        self.clock_cycles -= 1                                                      # Pause before the instruction runs
+        self.PC = pc
+        self.paused = True
+        self.interrupt = 7                                                          # Stops the loop : end_pause clears it
+        return 1
+
+    # Limited execution
+    # The dispatch loop runs slices of at most LIMIT_CHECK_CYCLES cycles and the limits are only checked between
+    # slices, so runs without limits keep their loops unchanged. The time limit counts the seconds spent executing :
+    # with step it is shared by every call
+    # Superinstructions, optimized sequences and compiled blocks count several cycles at once : they run while the end
+    # of the slice is further than the most cycles one of them counts, then the linked handlers finish the slice one
+    # cycle at a time, so a slice ends on its exact clock cycle. Fast-forwarded loops stop at the end of the slice
+
+    def step(self, cycles=1):
+
+        # Run at most cycles clock cycles from the current state and return the interrupt : 0 while the program can
+        # run further. The state is kept between calls, so a scheduler can load() many machines and share its time
+        # between them with step()
+
+        if self.input is None:
+            self.input = default_input()
+        self.continue_after_stop()
+        if len(self.code) != len(self.program):
+            self.link()
+            if self.is_rewritable():
+                self.rewrite()
+
+        self.input.open()
+
+        try:
+            self.execute_limited(cycles)
+        finally:
+            self.output.flush()
+            if self.interrupt != 0:
+                self.input.close()
+
+        return self.interrupt
+
+    def execute_limited(self, cycles=float("inf"), after=None, compiled=None):
+
+        # Run the linked handlers, or the function of the compile engine, in slices. The profiler, the flight recorder
+        # and the journal pass after to run_dispatch
+
+        end = self.clock_cycles + cycles
+        if self.pause_cycle is not None:
+            end = min(end, self.pause_cycle)
+        cycle_limit = self.cycle_limit if self.cycle_limit is not None else float("inf")
+        start = time.monotonic()
+
+        try:
+            while self.interrupt == 0 and self.clock_cycles < end:
+                self.run_slice(min(end, cycle_limit, self.clock_cycles + LIMIT_CHECK_CYCLES), after, compiled)
+
+                if self.interrupt != 0:
+                    break
+                if self.clock_cycles >= cycle_limit:
+                    self.throw_runtime_error(f"cycle limit reached : {self.cycle_limit} clock cycles : {self.PC}")
+                    self.set_interrupt(5)
+                elif self.time_limit is not None and self.run_time + time.monotonic() - start >= self.time_limit:
+                    self.throw_runtime_error(f"time limit reached : {self.time_limit} seconds : {self.PC}")
+                    self.set_interrupt(6)
+        finally:
+            self.run_time += time.monotonic() - start
+
+    def run_slice(self, end, after=None, compiled=None):
+        self.cycle_end = end
+
+        try:
+            if compiled is not None:
+                compiled(self)                                                      # Returns before a block could pass end
+            else:
+                self.run_dispatch(end - self.span + 1, after)
+
+            if self.interrupt == 0 and self.clock_cycles < end:
+                code, self.code = self.code, self.plain_code
+                try:
+                    self.run_dispatch(end, after)
+                finally:
+                    self.code = code
+        finally:
+            self.cycle_end = float("inf")
+
+    def run_dispatch(self, end=float("inf"), after=None):
+
+        # Dispatch loop of every run over the linked handlers : stops on an interrupt or once the clock cycles reach
+        # end. The profiler, the flight recorder and the journal pass after, called with the address of each
+        # instruction once it has run
+
+        if self.is_observed() or len(self.code) >= self.LIMIT:
+            while self.interrupt == 0 and self.clock_cycles < end:
+                pc = self.PC
+                self.dispatch_instruction()
+                if after is not None:
+                    after(pc)
+            return
+
+        code = self.code
+        size = len(code)
+
+        while self.interrupt == 0 and self.clock_cycles < end:
+            pc = self.PC
+            self.clock_cycles += 1
+            handler, operand = code[pc]
+            self.PC = pc + 1
+            if pc + 1 >= size:
+                self.set_interrupt(1)
+
+            try:
+                handler(operand)
+
+            except (IndexError, ValueError):
+                self.throw_runtime_error(f"missing arguments : {self.PC}")
+                self.set_interrupt(2)
+
+            except Exception as err:
+                self.throw_runtime_error(f"uncaught VirtualMachine exception : {err} : {self.PC}")
+                self.set_interrupt(3)
+
+            if after is not None:
+                after(pc)
+
+        self.OUTPUT = ''
+
+    # Asynchronous execution
+    # run_async runs the program inside an asyncio event loop : IN reads an asyncio.StreamReader and OUT writes to an
+    # asyncio.StreamWriter, or any objects with the same read, write and drain methods. The machine runs slices of up
+    # to yield_every cycles and gives the event loop control between them. Before an IN which finds no buffered input
+    # it awaits the reader instead of blocking, so one process can run many sessions at once
+    # The profiler, the flight recorder, pause points and limits only apply to run and step
+
+    async def run_async(self, reader, writer, yield_every=10000):
+
+        if self.stepping:
+            raise ValueError("stepping blocks the event loop : run_async cannot step")
+
+        self.set_input(AsyncInput(reader))
+        self.set_output(OutputSink(writer, separator=self.output.separator))
+
+        if self.load() != 0:
+            return
+
+        self.debug("starting program")
+
+        self.set_pc(0)
+
+        await self.resume_async(yield_every)
+
+    async def resume_async(self, yield_every=10000):
+
+        if self.tracetable:
+            self.print_head_tracetable_line()
+
+        self.input.open()
+
+        try:
+            await self.execute_async(yield_every)
+        finally:
+            self.input.close()
+            self.output.flush()
+            if self.dump_path:
+                self.dump_memory(self.dump_path)
+
+        await self.output.stream.drain()
+
+        self.finish()
+
+    async def execute_async(self, yield_every):
+        import asyncio
+
+        engine = self.engine
+
+        if engine == "compile":
+            self.debug("the compile engine cannot wait for input : using the dispatch engine")
+            engine = "dispatch"
+
+        if self.has_breakpoints() and engine != "dispatch":
+            self.debug("breakpoints are installed in the handlers of the dispatch engine : using the dispatch engine")
+            engine = "dispatch"
+
+        if self.fusion and engine == "switch" and self.is_rewritable():
+            self.debug("superinstructions replace handlers of the dispatch engine : using the dispatch engine")
+            engine = "dispatch"
+
+        if engine == "dispatch":
+            self.link()
+            if self.fusion and self.is_rewritable():
+                self.fuse()
+            step = self.dispatch_instruction
+        else:
+            step = self.next_instruction
+
+        reads = bytes(opcode == OP_IN for opcode, mode, operand in self.program)  # Addresses which read input
+        size = len(reads)
+        source = self.input
+
+        while self.interrupt == 0:
+            for _ in range(yield_every):
+                if self.PC < size and reads[self.PC] and not source.ready():    # A jump out of the program fails in step
+                    break
+                step()
+                if self.interrupt != 0:
+                    break
+
+            self.output.flush()                                                     # Show pending output, such as a prompt
+            await self.output.stream.drain()
+
+            if self.interrupt == 0 and self.PC < size and reads[self.PC] and not source.ready():
+                await source.fill()
+            else:
+                await asyncio.sleep(0)
+
     def next_instruction(self):
 
         buff = self.PC
 
         self.clock_cycles += 1
 
-        instruction = self.tree[self.PC]
+        opcode, mode, operand = self.program[self.PC]
 
         self.set_pc(self.PC + 1)
 
-        if self.PC >= len(self.tree):
+        if self.PC >= len(self.program):
             self.set_interrupt(1)
 
-        if len(instruction) > 3:
-            self.throw_syntax_error(f"too many arguments : {self.PC}")
-            self.set_interrupt(1)
+        if self.execute_instruction(opcode, mode, operand) != 0:                    # Failed or empty instruction : nothing to show
             return
 
-        if instruction == []:                                                       # Empty instruction
-            return
+        # Show data for instruction according to config
 
-        # Parse the Instruction
+        self.show_cycle(buff)
 
-        try:
-            opcode = instruction[0].upper()
+    def execute_instruction(self, opcode, mode, operand):
 
-            if not self.is_valid_opcode(opcode):
-                self.throw_syntax_error(f"invalid opcode : {' '.join(instruction)} : {self.PC}")
-                self.set_interrupt(1)
-                return
+        if opcode == OP_NOP:                                                        # Empty instruction
+            return 1
+
+        # Execute the decoded instruction
+
+        try:
+            if opcode == OP_FAULT:                                                  # Errors found while decoding
+                self.raise_fault(mode, operand)
+                return -1
 
             # Switch Case the opcode
 
-            if opcode == "LDM":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    self.throw_runtime_error(f"invalid value for LDM : {instruction[1]} : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.LDM(val)
+            if opcode == OP_LDM:
+                err = self.LDM(operand)
                 if err != 0:
                     self.throw_runtime_error(f"exception at LDM : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
-            elif opcode == "LDD":
-                addr = self.parse_data_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid value for address : {instruction[1]} : {self.PC}")
+            elif opcode == OP_LDD:
+                err = self.LDD(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"invalid data or position : {operand} : {self.PC}")
                     self.set_interrupt(2)
-                    return
-                err = self.LDD(addr)
+                    return -1
+
+            elif opcode == OP_LDI:
+                err = self.LDI(operand)
                 if err != 0:
-                    self.throw_runtime_error(f"invalid data or position : {addr} : {self.PC}")
+                    self.throw_runtime_error(f"invalid address or data during LDI : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
-            elif opcode == "LDI":
-                addr = self.parse_data_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid value for address : {instruction[1]} : {self.PC}")
+            elif opcode == OP_LDX:
+                err = self.LDX(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"invalid address : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
-                err = self.LDI(addr)
+            elif opcode == OP_LDR:
+                self.LDR(operand)
+
+            elif opcode == OP_MOV:
+                self.MOV()
+
+            elif opcode == OP_STO:
+                err = self.STO(operand)
                 if err != 0:
-                    self.throw_runtime_error(f"invalid address or data during LDI : {self.PC}")
+                    self.throw_runtime_error(f"invalid address : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
-            elif opcode == "LDX":
-                addr = self.parse_data_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid value for address : {instruction[1]} : {self.PC}")
+            elif opcode == OP_ADD:
+                if mode == MODE_INDIRECT:
+                    err = self.ADD_INDIRECT(operand)
+                else:
+                    err = self.ADD_DIRECT(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"exception at ADD instruction : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
-                err = self.LDX(addr)
+            elif opcode == OP_SUB:
+                if mode == MODE_INDIRECT:
+                    err = self.SUB_INDIRECT(operand)
+                else:
+                    err = self.SUB_DIRECT(operand)
                 if err != 0:
-                    self.throw_runtime_error(f"invalid address : {self.PC}")
+                    self.throw_runtime_error(f"exception at SUB instruction : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
+            elif opcode == OP_INC:
+                err = self.INC(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"error at INC : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
 
-            elif opcode == "LDR":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    self.throw_runtime_error(f"invalid value for LDR : {instruction[1]} : {self.PC}")
+            elif opcode == OP_DEC:
+                err = self.DEC(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"error at DEC : {self.PC}")
                     self.set_interrupt(2)
-                    return
-                self.LDR(val)
+                    return -1
 
-            elif opcode == "MOV":
-                if not instruction[1].upper() == "IX":
-                    self.throw_syntax_error(f"invalid register : expected \"IX\" : {self.PC}")
-                    self.set_interrupt(1)
-                    return
+            elif opcode == OP_JMP:
+                err = self.JMP(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"error during JMP : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
 
-                self.MOV()
+            elif opcode == OP_JPE:                                                  # Jump Equal
+                err = self.JPE(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"error during JPE : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
 
-            elif opcode == "STO":
-                addr = self.parse_data_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid address : {instruction[1]} : {self.PC}")
+            elif opcode == OP_JPN:                                                  # Jump Not Equal
+                err = self.JPN(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"error during JPN : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
 
-                err = self.STO(addr)
+            elif opcode == OP_CMP:
+                if mode == MODE_INDIRECT:
+                    err = self.CMP_INDIRECT(operand)
+                else:
+                    err = self.CMP_DIRECT(operand)
                 if err != 0:
-                    self.throw_runtime_error(f"invalid address : {self.PC}")
+                    self.throw_runtime_error(f"exception at CMP instruction : {self.PC}")
                     self.set_interrupt(2)
-                    return
-
-            elif opcode == "ADD":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    val = self.parse_data_address(instruction[1])
-                    if val == -1:
-                        self.throw_runtime_error(f"expected a valid address or direct addressing value but found none : {instruction[1]} : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-                    else:
-                        err = self.ADD_INDIRECT(val)
-                        if err != 0:
-                            self.throw_runtime_error(f"exception at ADD instruction : {self.PC}")
-                            self.set_interrupt(2)
-                            return
+                    return -1
+
+            elif opcode == OP_CMI:
+                err = self.CMI(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"error during CMI : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_END:
+                err = self.END()
+                if err != 0:
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_AND:
+                if mode == MODE_INDIRECT:
+                    err = self.AND_INDIRECT(operand)
                 else:
-                    err = self.ADD_DIRECT(val)
-                    if err != 0:
-                        self.throw_runtime_error(f"exception at ADD instruction : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-
-            elif opcode == "SUB":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    val = self.parse_data_address(instruction[1])
-                    if val == -1:
-                        self.throw_runtime_error(f"expected a valid address or direct addressing value : found none : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-                    else:
-                        err = self.SUB_INDIRECT(val)
-                        if err != 0:
-                            self.throw_runtime_error(f"exception at SUB instruction : {self.PC}")
-                            self.set_interrupt(2)
-                            return
+                    err = self.AND_DIRECT(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"exception at AND instruction : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_OR:
+                if mode == MODE_INDIRECT:
+                    err = self.OR_INDIRECT(operand)
                 else:
-                    err = self.SUB_DIRECT(val)
-                    if err != 0:
-                        self.throw_runtime_error(f"exception at SUB instruction : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-
-            elif opcode == "INC":
-                if not instruction[1].upper() in ["ACC", "IX"]:
-                    self.throw_runtime_error(f"invalid register : {instruction[1]} : {self.PC}")
+                    err = self.OR_DIRECT(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"exception at OR instruction : {self.PC}")
                     self.set_interrupt(2)
-                    return
-                err = self.INC(instruction[1])
+                    return -1
+
+            elif opcode == OP_XOR:
+                if mode == MODE_INDIRECT:
+                    err = self.XOR_INDIRECT(operand)
+                else:
+                    err = self.XOR_DIRECT(operand)
                 if err != 0:
-                    self.throw_runtime_error(f"error at INC : {self.PC}")
+                    self.throw_runtime_error(f"exception at XOR instruction : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_LSL:
+                err = self.LSL(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"exception at LSL : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_LSR:
+                err = self.LSR(operand)
+                if err != 0:
+                    self.throw_runtime_error(f"exception at LSR : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_OUT:                                                  # Send ACC to screen
+                err = self.OUT()
+                if err != 0:
+                    self.throw_runtime_error(f"exception at OUT : {self.PC}")
+                    self.set_interrupt(2)
+                    return -1
+
+            elif opcode == OP_IN:
+                err = self.IN()
+                if err != 0:
+                    self.throw_runtime_error(f"exception at IN : {self.PC}")
                     self.set_interrupt(2)
-                    return
+                    return -1
+
+            else:
+                self.throw_runtime_error(f"uncaught invalid opcode : {opcode}")
+                self.set_interrupt(1)
+                return -1
+
+        except (IndexError, ValueError):
+            self.throw_runtime_error(f"missing arguments : {self.PC}")
+            self.set_interrupt(2)
+            return -1
+
+        except Exception as err:
+            self.throw_runtime_error(f"uncaught VirtualMachine exception : {err} : {self.PC}")
+            self.set_interrupt(3)
+            return -1
+
+        return 0
+
+    def dispatch_instruction(self):
+
+        buff = self.PC
+
+        self.clock_cycles += 1
+
+        handler, operand = self.code[self.PC]
+
+        self.set_pc(self.PC + 1)
+
+        if self.PC >= len(self.code):
+            self.set_interrupt(1)
+
+        try:
+            if handler(operand) != 0:                                               # Failed or empty instruction : nothing to show
+                return
+
+        except (IndexError, ValueError):
+            self.throw_runtime_error(f"missing arguments : {self.PC}")
+            self.set_interrupt(2)
+            return
+
+        except Exception as err:
+            self.throw_runtime_error(f"uncaught VirtualMachine exception : {err} : {self.PC}")
+            self.set_interrupt(3)
+            return
+
+        self.show_cycle(buff)
+
+    # Headless execution
+    # When no cycle is shown the loops below only fetch, advance PC and execute : there is no display, no
+    # stepping and no range check on PC, which cannot overflow while the program is shorter than 2 ** ARCH
+
+    def run_headless(self, engine):
+        if engine == "dispatch":
+            self.run_dispatch()
+        else:
+            self.headless_switch()
+
+        self.OUTPUT = ''                                                            # Same output buffer as after a shown cycle
+
+    def headless_switch(self):
+        program = self.program
+        size = len(program)
+        execute = self.execute_instruction
+
+        while self.interrupt == 0:
+            pc = self.PC
+            self.clock_cycles += 1
+            opcode, mode, operand = program[pc]
+            self.PC = pc + 1
+            if pc + 1 >= size:
+                self.set_interrupt(1)
+            execute(opcode, mode, operand)
+
+    # Profiler
+    # Counts the executions of each instruction address and the time spent on them. Each cycle reads the clock
+    # once and charges the time since the previous reading to the instruction that just ran
+    # A taken jump to the same or an earlier address is counted as a back edge of the loop it closes
+    # The counts and times of each opcode are summed from the addresses once the run ends
+
+    def execute_profiled(self):
+        size = len(self.code)
+        counts = self.profile_counts = [0] * size
+        times = self.profile_times = [0] * size
+        back_edges = self.profile_back_edges = [0] * size
+        clock = time.perf_counter_ns
+        last = clock()
+
+        def after(pc):
+            nonlocal last
+            now = clock()
+            times[pc] += now - last
+            last = now
+            counts[pc] += 1
+            if self.PC <= pc:
+                back_edges[pc] += 1
+
+        self.execute_limited(after=after)
+
+    # Flight recorder
+    # Keeps the last recorder_size cycles in a preallocated ring : each slot holds the clock cycle, PC and the
+    # registers once the instruction has run. The instruction and its memory write are found from PC in the
+    # decoded program when the ring is dumped, so each cycle only stores one tuple
+    # The ring is dumped when the run ends with any interrupt other than END, on an uncaught exception and on
+    # SIGUSR1 while the program runs
+
+    def execute_recorded(self):
+        slots = self.recorder_size
+        ring = self.recorder = [None] * slots
+
+        def after(pc):
+            cycle = self.clock_cycles
+            ring[cycle % slots] = (cycle, pc, self.ACC, self.IX, self.EFLAGS)
+
+        try:
+            previous = signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump_recorder())
+        except (AttributeError, ValueError):                                        # No SIGUSR1 or not the main thread
+            previous = None
+
+        try:
+            self.execute_limited(after=after)
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGUSR1, previous)
+
+    def dump_recorder(self):
+        entries = sorted(entry for entry in self.recorder or [] if entry is not None)
+
+        lines = [f"flight recorder : last {len(entries)} cycles of {self.clock_cycles} : exit code {self.interrupt}",
+            f"  {'cycle':>10} {'PC':>6}  {'instruction':<28}{'ACC':>12}{'IX':>12}{'EFLAGS':>8}  write"]
+
+        labels = {}
+        for name, pc in self.code_flags.items():
+            labels[pc] = name
+
+        for cycle, pc, acc, ix, eflags in entries:
+            opcode, mode, operand = self.program[pc]
+            instruction = ' '.join(self.tree[pc])
+            if pc in labels:
+                instruction = f"{labels[pc]}: {instruction}"
+            write = ""
+            if opcode == OP_STO and 0 <= operand < len(self.MEM):                 # The value stored is still in ACC
+                write = f"[{operand}] = {acc & self.MASK if self.memory_type == 'array' else acc}"
+            lines.append(f"  {cycle:>10} {pc:>6}  {instruction:<28}{acc:>12}{ix:>12}{eflags:>8}  {write}")
+
+        text = '\n'.join(lines) + '\n'
+
+        if self.recorder_path:
+            with open(self.recorder_path, 'a') as file:
+                file.write(text)
+        else:
+            self.output.flush()
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def show_cycle(self, pc):
+
+        self.output.flush()
+
+        instruction = self.tree[pc]
+
+        if self.tracetable:
+            self.trace.row(self.clock_cycles, instruction, pc, self.ACC, self.IX, self.OUTPUT)
+
+        else:
+            if self.show_inst:
+                self.print_instruction(pc, instruction)
+            if self.show_pc:
+                self.print_value("PC :", pc)
+            if self.show_ix:
+                self.print_value("IX :", self.IX)
+            if self.show_acc:
+                self.print_value("ACC:", self.ACC)
+
+        if self.stepping:
+            time.sleep(self.DELAY)
+
+        self.OUTPUT = ''                                                        # Delete Output
+
+    # Dispatch engine
+    # Each decoded instruction is linked to the handler of its opcode and addressing mode, so selecting the
+    # handler costs one list lookup whatever the opcode is
+    # Handlers return 0 once the instruction is executed, -1 after reporting an error and 1 for empty lines
+
+    def link(self):
+        table = {
+            (OP_LDM, MODE_DIRECT): self.exec_LDM,
+            (OP_LDD, MODE_INDIRECT): self.exec_LDD,
+            (OP_LDI, MODE_INDIRECT): self.exec_LDI,
+            (OP_LDX, MODE_INDIRECT): self.exec_LDX,
+            (OP_LDR, MODE_DIRECT): self.exec_LDR,
+            (OP_MOV, MODE_REGISTER): self.exec_MOV,
+            (OP_STO, MODE_INDIRECT): self.exec_STO,
+            (OP_ADD, MODE_DIRECT): self.exec_ADD_DIRECT,
+            (OP_ADD, MODE_INDIRECT): self.exec_ADD_INDIRECT,
+            (OP_SUB, MODE_DIRECT): self.exec_SUB_DIRECT,
+            (OP_SUB, MODE_INDIRECT): self.exec_SUB_INDIRECT,
+            (OP_INC, MODE_REGISTER): self.exec_INC,
+            (OP_DEC, MODE_REGISTER): self.exec_DEC,
+            (OP_JMP, MODE_CODE): self.exec_JMP,
+            (OP_JPE, MODE_CODE): self.exec_JPE,
+            (OP_JPN, MODE_CODE): self.exec_JPN,
+            (OP_CMP, MODE_DIRECT): self.exec_CMP_DIRECT,
+            (OP_CMP, MODE_INDIRECT): self.exec_CMP_INDIRECT,
+            (OP_CMI, MODE_CODE): self.exec_CMI,
+            (OP_END, MODE_NONE): self.exec_END,
+            (OP_AND, MODE_DIRECT): self.exec_AND_DIRECT,
+            (OP_AND, MODE_INDIRECT): self.exec_AND_INDIRECT,
+            (OP_OR, MODE_DIRECT): self.exec_OR_DIRECT,
+            (OP_OR, MODE_INDIRECT): self.exec_OR_INDIRECT,
+            (OP_XOR, MODE_DIRECT): self.exec_XOR_DIRECT,
+            (OP_XOR, MODE_INDIRECT): self.exec_XOR_INDIRECT,
+            (OP_LSL, MODE_DIRECT): self.exec_LSL,
+            (OP_LSR, MODE_DIRECT): self.exec_LSR,
+            (OP_OUT, MODE_NONE): self.exec_OUT,
+            (OP_IN, MODE_NONE): self.exec_IN,
+            (OP_NOP, MODE_NONE): self.exec_NOP,
+        }
+
+        self.code = []
+        for opcode, mode, operand in self.program:
+            if opcode == OP_FAULT:
+                self.code.append((self.exec_FAULT, (mode, operand)))
+            else:
+                self.code.append((table[(opcode, mode)], operand))
+
+        self.debug(f"linked {len(self.code)} instructions to the dispatch table")
+
+        if self.has_breakpoints():
+            self.install_breakpoints()
+
+        self.plain_code = self.code
+        self.span = 1
+
+    def rewrite(self):
+
+        # Replace linked handlers with superinstructions, optimized sequences and fast-forwarded counted loops. The
+        # linked handlers stay in plain_code
+
+        if not (self.fusion or self.optimization is not None or self.fast_forward):
+            return
+
+        self.code = self.code[:]
+        if self.fusion:
+            self.fuse()
+        if self.optimization is not None:
+            self.optimize()
+        if self.fast_forward:
+            self.fast_forward_loops()
+
+    # Superinstructions
+    # Short sequences which are repeated inside most loops are merged into one handler linked at the address
+    # of their first instruction. The following instructions keep their own handlers, so jumping into the
+    # middle of a sequence still works. Each merged instruction still counts its clock cycle and sets PC
+    # before it runs, so errors report the address of the original instruction
+    # Sequences are only fused when cycles are not shown, as each one runs as a single step
+
+    def fuse(self):
+        fused = 0
+        program = self.program
+
+        for i in range(len(program) - 3):                                           # The last instruction sets interrupt 1
+            first = program[i]
+            second = program[i + 1]
+            third = program[i + 2]
+
+            # LDD x / INC ACC / STO x
+
+            if first[0] == OP_LDD and second[0] in (OP_INC, OP_DEC) and third[0] == OP_STO:
+                self.code[i] = (self.exec_LDD_COUNT_STO, (first[2], second[0] == OP_INC, second[2], third[2]))
+                fused += 1
+
+            # LDX array / OUT / INC IX
+
+            elif first[0] == OP_LDX and second[0] == OP_OUT and third[0] == OP_INC and third[2] == REG_IX:
+                self.code[i] = (self.exec_LDX_OUT_INC, first[2])
+                fused += 1
+
+            # CMP y / JPN label
+
+            elif first[0] == OP_CMP and second[0] in (OP_JPE, OP_JPN):
+                self.code[i] = (self.exec_CMP_JUMP, (first[1], first[2], second[0] == OP_JPE, second[2]))
+                fused += 1
+
+        if fused > 0:
+            self.span = max(self.span, 3)
+
+        self.debug(f"fused {fused} instruction sequences")
+
+    # Optimizer
+    # Dead code elimination replaces the instructions which no path from the first instruction or a code flag
+    # reaches with empty lines, for every engine. The peephole pass then rewrites handlers of the dispatch engine :
+    #   JMP, JPE or JPN to a JMP  -> jump straight to the final target
+    #   LDM a / LDM b             -> only the last load runs
+    #   STO x / LDD x             -> LDD is skipped when it would load ACC back
+    #   ADD #0, SUB #0, empty line -> skipped after the instruction before them
+    # Like superinstructions, the rewritten handlers live at the address of the first instruction and the others
+    # keep their own handlers, so jumping into the middle of a sequence still works. Sequences never reach the last
+    # instruction, which sets interrupt 1 before it runs
+    # In faithful mode the skipped instructions still count their clock cycles, in optimized mode they do not
+
+    def eliminate_dead_code(self):
+        program = self.program
+        size = len(program)
+
+        reachable = [False] * size
+        pending = [0] + [pc for pc in self.code_flags.values() if 0 <= pc < size]
+
+        while pending:
+            pc = pending.pop()
+            if pc >= size or reachable[pc]:
+                continue
+            reachable[pc] = True
+
+            opcode, mode, operand = program[pc]
+            if opcode in (OP_JMP, OP_JPE, OP_JPN) and 0 <= operand < size:
+                pending.append(operand)
+            if opcode not in (OP_JMP, OP_END, OP_FAULT):
+                pending.append(pc + 1)
+
+        removed = sum(1 for pc in range(size) if not reachable[pc] and program[pc][0] != OP_NOP)
+        if removed > 0:                                                             # The program may be shared with the cache
+            empty = (OP_NOP, MODE_NONE, 0)
+            self.program = [program[pc] if reachable[pc] else empty for pc in range(size)]
+
+        self.debug(f"removed {removed} unreachable instructions")
+
+    def optimize(self):
+        program = self.program
+        code = self.code
+        last = len(program) - 1
+        faithful = self.optimization == "faithful"
+        rewritten = 0
+        span = self.span
+
+        def is_skippable(instruction):
+            opcode, mode, operand = instruction
+            return opcode == OP_NOP or (opcode in (OP_ADD, OP_SUB) and mode == MODE_DIRECT and operand == 0)
+
+        for i in range(last):
+            opcode, mode, operand = program[i]
+
+            # Jump to a JMP : follow the chain while each JMP is neither the last instruction nor seen before
+
+            if opcode in (OP_JMP, OP_JPE, OP_JPN) and 0 <= operand < last and program[operand][0] == OP_JMP:
+                target, hops, seen = operand, 0, {i}
+                while 0 <= target < last and program[target][0] == OP_JMP and target not in seen:
+                    seen.add(target)
+                    target = program[target][2]
+                    hops += 1
+                if not 0 <= target < len(program):                                 # The last JMP fails : keep it
+                    continue
+                code[i] = (self.exec_JUMP_THREADED, (opcode, target, hops if faithful else 0))
+                span = max(span, 1 + (hops if faithful else 0))
+                rewritten += 1
+
+            # Run of LDM : every load but the last one is overwritten
+
+            elif opcode == OP_LDM and program[i + 1][0] == OP_LDM and (i == 0 or program[i - 1][0] != OP_LDM):
+                end = i
+                while end + 1 < last and program[end + 1][0] == OP_LDM and 0 <= program[end][2] < self.LIMIT:
+                    end += 1
+                if end > i:
+                    skipped = end - i
+                    code[i] = (self.exec_LDM_LAST, (program[end][2], skipped, skipped if faithful else 0))
+                    span = max(span, 1 + (skipped if faithful else 0))
+                    rewritten += 1
+
+            # STO x / LDD x
+
+            elif opcode == OP_STO and i + 1 < last and program[i + 1][0] == OP_LDD and program[i + 1][2] == operand:
+                code[i] = (self.exec_STO_LOAD, (operand, 1 if faithful else 0))
+                span = max(span, 2 if faithful else 1)
+                rewritten += 1
+
+        # Instructions without any effect after another instruction : they add their cycles to any handler before them
+
+        wrapped = span
+        i = 0
+        while i < last:
+            end = i + 1
+            while end < last and is_skippable(program[end]):
+                end += 1
+            skipped = end - i - 1
+            if skipped > 0 and not is_skippable(program[i]):
+                handler, operand = code[i]
+                code[i] = (self.exec_THEN_SKIP, (handler, operand, i + 1, skipped, skipped if faithful else 0))
+                span = max(span, wrapped + (skipped if faithful else 0))
+                rewritten += 1
+            i = end
+
+        self.span = span
+        self.debug(f"optimized {rewritten} instructions")
+
+    def exec_JUMP_THREADED(self, operands):
+        opcode, target, cycles = operands
+
+        if opcode == OP_JPE and not self.EFLAGS & 1 or opcode == OP_JPN and self.EFLAGS & 1:
+            return 0
+
+        self.PC = target
+        self.clock_cycles += cycles
+        return 0
+
+    def exec_LDM_LAST(self, operands):
+        val, skipped, cycles = operands
+
+        self.PC += skipped
+        self.clock_cycles += cycles
+        return self.exec_LDM(val)
+
+    def exec_STO_LOAD(self, operands):
+        addr, cycles = operands
+
+        if self.exec_STO(addr) != 0:
+            return -1
+
+        if self.MEM[addr] == self.ACC and self.ACC != -1:                          # LDD would load the same value
+            self.PC += 1
+            self.clock_cycles += cycles
+        return 0
+
+    def exec_THEN_SKIP(self, operands):
+        handler, operand, following, skipped, cycles = operands
+
+        result = handler(operand)
+        if result == 0 and self.PC == following and self.interrupt == 0:
+            self.PC = following + skipped
+            self.clock_cycles += cycles
+        return result
+
+    # Counted loops
+    # A loop of this shape only changes its counter, ACC and the zero flag :
+    #   loop: LDD counter
+    #         INC ACC           or DEC ACC
+    #         STO counter
+    #         CMP #n            or CMP limit, any address but the counter
+    #         JPN loop
+    # When it is entered with a counter below n (above n with DEC) and both values fit in a word, it ends once the
+    # counter reaches n : the counter and ACC hold n, the zero flag is set and each iteration took 5 clock cycles
+    # Otherwise, for example for a loop which overflows, the iterations run one by one
+    # A limited run only skips the iterations which end by cycle_end, and the loop goes on from its first instruction
+
+    def find_counted_loops(self):
+        program = self.program
+        loops = {}
+
+        for pc in range(len(program) - 5):                                          # JPN is never the last instruction
+            load, count, store, compare, jump = program[pc:pc + 5]
+            counter = load[2]
+
+            if load[:2] != (OP_LDD, MODE_INDIRECT) or not 0 <= counter < len(self.MEM):
+                continue
+            if count[0] not in (OP_INC, OP_DEC) or count[2] != REG_ACC:
+                continue
+            if store[:2] != (OP_STO, MODE_INDIRECT) or store[2] != counter:
+                continue
+            if compare[0] != OP_CMP or (compare[1] == MODE_INDIRECT and compare[2] == counter):
+                continue
+            if jump[0] != OP_JPN or jump[2] != pc:
+                continue
+
+            loops[pc] = (counter, 1 if count[0] == OP_INC else -1, compare[1], compare[2])
+
+        return loops
+
+    def counted_loop_iterations(self, loop):
+
+        # Iterations left from the current state, or 0 when the loop has to run one iteration at a time
+
+        counter, step, mode, limit = loop
+
+        if mode == MODE_INDIRECT:
+            if not 0 <= limit < len(self.MEM):
+                return 0
+            limit = self.MEM[limit]
+
+        value = self.MEM[counter]
+        if not (0 <= value < self.LIMIT and 0 <= limit < self.LIMIT):
+            return 0
+        return max((limit - value) * step, 0)
+
+    def fast_forward_loops(self):
+        loops = self.find_counted_loops()
+
+        for pc, loop in loops.items():
+            handler, operand = self.code[pc]
+            self.code[pc] = (self.exec_COUNTED_LOOP, (loop, handler, operand))
+
+        self.debug(f"found {len(loops)} counted loops")
+
+    def exec_COUNTED_LOOP(self, operands):
+        loop, handler, operand = operands
+
+        iterations = self.counted_loop_iterations(loop)
+        if iterations == 0:
+            return handler(operand)
+
+        counter, step = loop[0], loop[1]
+        left = self.cycle_end - self.clock_cycles + 1                               # Cycles of the loop until cycle_end
+
+        if left < 5 * iterations:
+            allowed = left // 5
+            if allowed < 1:
+                return handler(operand)
+            value = self.MEM[counter] + step * allowed                              # Back at the loop with ZF clear
+            self.MEM[counter] = value
+            self.ACC = value
+            self.EFLAGS &= ~1
+            self.PC -= 1
+            self.clock_cycles += 5 * allowed - 1
+            return 0
+
+        value = self.MEM[counter] + step * iterations
+
+        self.MEM[counter] = value
+        self.ACC = value
+        self.EFLAGS |= 1
+        self.PC += 4
+        self.clock_cycles += 5 * iterations - 1                                     # The first cycle is already counted
+        return 0
+
+    # Breakpoints and watchpoints
+    # They are installed by link() : the handler of each instruction with a breakpoint, and of each STO which writes a
+    # watched address, is wrapped by exec_BREAK or exec_WATCH. The other instructions and the dispatch loops are left
+    # as they are, so a run without breakpoints does not pay for them
+    # A breakpoint stops the run before its instruction executes, with its clock cycle and PC undone, and a
+    # watchpoint right after the write. Both set interrupt 7, and resume or step continue from there
+    # Conditions compare a register with a number : ACC, IX or EFLAGS, then ==, !=, <, <=, > or >=, then the number
+
+    def add_breakpoint(self, location=None, condition=None):
+        # location : instruction address or code flag, or None to check the condition before every instruction
+        if location is None and condition is None:
+            raise ValueError("expected a location or a condition for the breakpoint")
+        if isinstance(condition, str):
+            condition = self.parse_condition(condition)
+        self.breakpoints.append((location, condition))
+        self.code = []                                                              # Linked again with the breakpoint
+        self.debug(f"set breakpoint at {location if location is not None else 'every instruction'} when {condition}")
+
+    def add_watchpoint(self, address):
+        self.watchpoints.append(address)
+        self.code = []
+        self.debug(f"set watchpoint on {address}")
+
+    def clear_breakpoints(self):
+        self.breakpoints = []
+        self.watchpoints = []
+        self.code = []
+        self.debug("cleared breakpoints and watchpoints")
+
+    def parse_condition(self, condition):
+        match = re.fullmatch(r"\s*(ACC|IX|EFLAGS)\s*(==|!=|<=|>=|<|>)\s*(-?\d+)\s*", condition, re.IGNORECASE)
+        if match is None:
+            raise ValueError(f"invalid condition : {condition} ; expected ACC, IX or EFLAGS, a comparison and a number")
+        return (match.group(1).upper(), match.group(2), int(match.group(3)))
+
+    def install_breakpoints(self):
+        points = self.resolve_breakpoints()
+        if points is None:
+            return
+        stops, watched = points
+
+        for pc, conditions in stops.items():
+            handler, operand = self.code[pc]
+            self.code[pc] = (self.exec_BREAK, (pc, handler, operand, conditions))
+
+        for pc, (opcode, mode, operand) in enumerate(self.program):
+            if opcode == OP_STO and operand in watched:
+                handler, handler_operand = self.code[pc]
+                self.code[pc] = (self.exec_WATCH, (handler, handler_operand, operand))
+
+        self.debug(f"installed breakpoints at {len(stops)} addresses and watchpoints on {len(watched)} addresses")
+
+        if self.pause_pc is not None and 0 <= self.pause_pc < len(self.code):
+            handler, operand = self.code[self.pause_pc]
+            self.code[self.pause_pc] = (self.exec_PAUSE, (self.pause_pc, handler, operand))
+
+    def resolve_breakpoints(self):
+        # Conditions of each instruction address with a breakpoint and the watched data addresses, or None after
+        # a syntax error
+        stops = {}                                                                  # Conditions of each address : None always stops
+
+        for location, condition in self.breakpoints:
+            if location is None:
+                addresses = range(len(self.program))
+            else:
+                pc = int(location) if str(location).isdigit() else self.code_flags.get(location, -1)
+                if not 0 <= pc < len(self.program):
+                    self.throw_syntax_error(f"invalid breakpoint : {location} ; expected an instruction address or a code flag")
+                    self.set_interrupt(1)
+                    return None
+                addresses = [pc]
+            for pc in addresses:
+                stops.setdefault(pc, []).append(condition)
+
+        watched = set()
+        for location in self.watchpoints:
+            address = int(location) if str(location).isdigit() else self.data_flags.get(location, -1)
+            if not self.is_valid_address(address):
+                self.throw_syntax_error(f"invalid watchpoint : {location} ; expected a data address or a data flag")
+                self.set_interrupt(1)
+                return None
+            watched.add(address)
+
+        return stops, watched
+
+    def exec_BREAK(self, operands):
+        pc, handler, operand, conditions = operands
+
+        if self.stopped != (pc, self.clock_cycles - 1) and any(self.holds(condition) for condition in conditions):
+            self.clock_cycles -= 1                                                  # Stop before the instruction runs
+            self.PC = pc
+            self.stopped = (pc, self.clock_cycles)
+            self.set_interrupt(7)
+            self.stop(f"breakpoint at {self.location(pc)}")
+            return 1
+
+        return handler(operand)
+
+    def exec_WATCH(self, operands):
+        handler, operand, address = operands
+
+        old = self.MEM[address]
+        err = handler(operand)
+
+        if self.interrupt in (0, 1):                                                # The write succeeded
+            if self.interrupt == 0:                                                 # Else the program ends here anyways
+                self.set_interrupt(7)
+            self.stop(f"watchpoint on {address} : {old} -> {self.MEM[address]} at {self.location(self.PC - 1)}")
+        return err
+
+    def holds(self, condition):
+        if condition is None:
+            return True
+        register, comparison, value = condition
+        current = self.ACC if register == "ACC" else self.IX if register == "IX" else self.EFLAGS
+        return CONDITIONS[comparison](current, value)
+
+    def location(self, pc):
+        names = [name for name, address in self.code_flags.items() if address == pc]
+        return f"{pc} ({', '.join(names)})" if names else f"{pc}"
+
+    def stop(self, reason):
+        self.stop_reason = reason
+        if not self.quiet:
+            self.output.flush()
+            print(f"\033[38;5;3mstop:\033[m {reason} : ACC {self.ACC} IX {self.IX} EFLAGS {self.EFLAGS} : {self.clock_cycles} clock cycles")
+
+    def continue_after_stop(self):
+        if self.interrupt != 7:
+            return
+        if self.stopped is None:                                                    # Snapshot saved at a breakpoint
+            self.stopped = (self.PC, self.clock_cycles)
+        self.interrupt = 0
+        self.stop_reason = None
+        self.debug(f"continuing at PC {self.PC}")
+
+    # Time-travel debugging
+    # With a journal, each cycle of run and resume records the registers it changed, the address it jumped from and
+    # the old value of each word written by STO, and the whole state is copied every journal_interval cycles (see
+    # Journal.py). seek, reverse_step and reverse_continue then move the machine to any cycle of the run, backwards
+    # or forwards up to its end, in a time bounded by the interval
+    # Input already read and output already written are not taken back : resuming from an earlier cycle runs the
+    # program from there and drops the cycles the journal held after it
+
+    def execute_journaled(self):
+        from Journal import Journal, ACC, IX, EFLAGS, PC                            # Only loaded for journaled runs
+
+        if self.journal is None or self.journal.interval != self.journal_interval:
+            self.journal = Journal(self.journal_interval)
+        journal = self.journal
+        journal.truncate(self.clock_cycles)
+        journal.checkpoint(self)
+
+        for pc, (opcode, mode, operand) in enumerate(self.program):
+            if opcode == OP_STO:
+                handler, handler_operand = self.code[pc]
+                self.code[pc] = (self.exec_JOURNAL, (handler, handler_operand, operand))
+
+        record = journal.record
+        interval = journal.interval
+        next_checkpoint = self.clock_cycles + interval
+        acc, ix, eflags, last = self.ACC, self.IX, self.EFLAGS, self.clock_cycles
+
+        def after(pc):
+            nonlocal acc, ix, eflags, last, next_checkpoint
+            cycle = self.clock_cycles
+            if cycle == last:                                                       # Stopped by a breakpoint before running
+                return
+            last = cycle
+
+            if self.ACC != acc:
+                record(cycle, ACC, acc)
+                acc = self.ACC
+            if self.IX != ix:
+                record(cycle, IX, ix)
+                ix = self.IX
+            if self.EFLAGS != eflags:
+                record(cycle, EFLAGS, eflags)
+                eflags = self.EFLAGS
+            if self.PC != pc + 1:
+                record(cycle, PC, pc)
+
+            if cycle >= next_checkpoint:
+                journal.checkpoint(self)
+                next_checkpoint = cycle + interval
+
+        try:
+            self.execute_limited(after=after)
+        finally:
+            journal.checkpoint(self)                                                # The end of the run can be reached again
+            self.debug(f"journaled {len(journal.cycles)} entries and {len(journal.checkpoints)} checkpoints")
+
+    def exec_JOURNAL(self, operands):
+        handler, operand, address = operands
+
+        if not self.is_valid_address(address):                                      # Fails without writing
+            return handler(operand)
+
+        old = self.MEM[address]
+        err = handler(operand)
+
+        if err == 0:
+            self.journal.record_write(self.clock_cycles, address, old)
+        return err
+
+    def seek(self, cycle):
+        # Puts the machine back in its state at the end of a clock cycle of the journaled run
+        if self.journal is None:
+            raise ValueError("no journal : set_journal before running the program")
+
+        self.journal.seek(self, cycle)
+        self.stopped = (self.PC, self.clock_cycles)                                 # A breakpoint here is passed on resume
+        self.stop_reason = None
+        self.debug(f"went to clock cycle {cycle} : PC {self.PC}")
+
+    def reverse_step(self, cycles=1):
+        # Undoes the last cycles, at most back to the start of the journal, and returns the clock cycle reached
+        if self.journal is None:
+            raise ValueError("no journal : set_journal before running the program")
+
+        self.seek(max(self.clock_cycles - cycles, self.journal.start()))
+        return self.clock_cycles
+
+    def reverse_continue(self):
+        # Goes back to the last state where a breakpoint or a watchpoint stopped or would have stopped the run, else
+        # to the start of the journal, and returns the clock cycle reached
+        self.seek(self.clock_cycles)
+
+        points = self.resolve_breakpoints()
+        if points is None:
+            return self.clock_cycles
+        stops, watched = points
+
+        journal = self.journal
+        start = journal.start()
+
+        while self.clock_cycles > start:
+            journal.undo(self)
+            cycle = self.clock_cycles
+
+            written = [address for address in journal.writes(cycle) if address in watched] if watched else []
+            if written:
+                self.seek(cycle)
+                self.stop(f"watchpoint on {written[0]} written at clock cycle {cycle}")
+                return cycle
+
+            conditions = stops.get(self.PC)
+            if conditions is not None and any(self.holds(condition) for condition in conditions):
+                self.seek(cycle)
+                self.stop(f"breakpoint at {self.location(self.PC)}")
+                return cycle
+
+        self.seek(start)
+        self.stop("start of the journal")
+        return start
+
+    # Compile engine
+    # The whole program is translated into a Python function which keeps the registers in local variables
+
+    def compile_program(self, sliced=False):
+        # sliced : the function returns before a block could pass cycle_end, for limited runs
+        from Compiler import compile_program
+
+        execute, self.compiled_source = compile_program(self, sliced)
+        self.debug(f"compiled {len(self.program)} instructions into {self.compiled_source.count(chr(10))} lines of Python")
+        return execute
+
+    def fail(self, error):
+        self.throw_runtime_error(error)
+        self.set_interrupt(2)
+        return -1
+
+    def exec_LDM(self, val):
+        if self.LDM(val) != 0:
+            return self.fail(f"exception at LDM : {self.PC}")
+        return 0
+
+    def exec_LDD(self, addr):
+        if self.LDD(addr) != 0:
+            return self.fail(f"invalid data or position : {addr} : {self.PC}")
+        return 0
+
+    def exec_LDI(self, addr):
+        if self.LDI(addr) != 0:
+            return self.fail(f"invalid address or data during LDI : {self.PC}")
+        return 0
+
+    def exec_LDX(self, addr):
+        if self.LDX(addr) != 0:
+            return self.fail(f"invalid address : {self.PC}")
+        return 0
+
+    def exec_LDR(self, val):
+        self.LDR(val)
+        return 0
+
+    def exec_MOV(self, register):
+        self.MOV()
+        return 0
+
+    def exec_STO(self, addr):
+        if self.STO(addr) != 0:
+            return self.fail(f"invalid address : {self.PC}")
+        return 0
+
+    def exec_ADD_DIRECT(self, val):
+        if self.ADD_DIRECT(val) != 0:
+            return self.fail(f"exception at ADD instruction : {self.PC}")
+        return 0
+
+    def exec_ADD_INDIRECT(self, addr):
+        if self.ADD_INDIRECT(addr) != 0:
+            return self.fail(f"exception at ADD instruction : {self.PC}")
+        return 0
+
+    def exec_SUB_DIRECT(self, val):
+        if self.SUB_DIRECT(val) != 0:
+            return self.fail(f"exception at SUB instruction : {self.PC}")
+        return 0
+
+    def exec_SUB_INDIRECT(self, addr):
+        if self.SUB_INDIRECT(addr) != 0:
+            return self.fail(f"exception at SUB instruction : {self.PC}")
+        return 0
+
+    def exec_INC(self, register):
+        if self.INC(register) != 0:
+            return self.fail(f"error at INC : {self.PC}")
+        return 0
+
+    def exec_DEC(self, register):
+        if self.DEC(register) != 0:
+            return self.fail(f"error at DEC : {self.PC}")
+        return 0
+
+    def exec_JMP(self, addr):
+        if self.set_pc(addr) != 0:
+            return self.fail(f"error during JMP : {self.PC}")
+        return 0
+
+    def exec_JPE(self, addr):
+        if self.EFLAGS & 1 and self.set_pc(addr) != 0:                             # ZF is bit 0 of EFLAGS
+            return self.fail(f"error during JPE : {self.PC}")
+        return 0
+
+    def exec_JPN(self, addr):
+        if not self.EFLAGS & 1 and self.set_pc(addr) != 0:
+            return self.fail(f"error during JPN : {self.PC}")
+        return 0
+
+    def exec_CMP_DIRECT(self, val):
+        if val == self.ACC:
+            self.EFLAGS |= 1
+        else:
+            self.EFLAGS &= ~1
+        return 0
+
+    def exec_CMP_INDIRECT(self, addr):
+        if self.CMP_INDIRECT(addr) != 0:
+            return self.fail(f"exception at CMP instruction : {self.PC}")
+        return 0
+
+    def exec_CMI(self, addr):
+        if self.CMI(addr) != 0:
+            return self.fail(f"error during CMI : {self.PC}")
+        return 0
+
+    def exec_END(self, operand):
+        if self.END() != 0:
+            self.set_interrupt(2)
+            return -1
+        return 0
+
+    def exec_AND_DIRECT(self, val):
+        if self.AND_DIRECT(val) != 0:
+            return self.fail(f"exception at AND instruction : {self.PC}")
+        return 0
+
+    def exec_AND_INDIRECT(self, addr):
+        if self.AND_INDIRECT(addr) != 0:
+            return self.fail(f"exception at AND instruction : {self.PC}")
+        return 0
+
+    def exec_OR_DIRECT(self, val):
+        if self.OR_DIRECT(val) != 0:
+            return self.fail(f"exception at OR instruction : {self.PC}")
+        return 0
+
+    def exec_OR_INDIRECT(self, addr):
+        if self.OR_INDIRECT(addr) != 0:
+            return self.fail(f"exception at OR instruction : {self.PC}")
+        return 0
+
+    def exec_XOR_DIRECT(self, val):
+        if self.XOR_DIRECT(val) != 0:
+            return self.fail(f"exception at XOR instruction : {self.PC}")
+        return 0
+
+    def exec_XOR_INDIRECT(self, addr):
+        if self.XOR_INDIRECT(addr) != 0:
+            return self.fail(f"exception at XOR instruction : {self.PC}")
+        return 0
 
-            elif opcode == "DEC":
-                if not instruction[1].upper() in ["ACC", "IX"]:
-                    self.throw_runtime_error(f"invalid register : {instruction[1]} : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.DEC(instruction[1])
-                if err != 0:
-                    self.throw_runtime_error(f"error at DEC : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_LSL(self, val):
+        if self.LSL(val) != 0:
+            return self.fail(f"exception at LSL : {self.PC}")
+        return 0
 
-            elif opcode == "JMP":
-                addr = self.parse_code_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid address for JMP : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.JMP(addr)
-                if err != 0:
-                    self.throw_runtime_error(f"error during JMP : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_LSR(self, val):
+        if self.LSR(val) != 0:
+            return self.fail(f"exception at LSR : {self.PC}")
+        return 0
 
-            elif opcode == "JPE":                                                                       # Jump Equal
-                addr = self.parse_code_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid address for JPE : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.JPE(addr)
-                if err != 0:
-                    self.throw_runtime_error(f"error during JPE : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_OUT(self, operand):
+        if self.OUT() != 0:
+            return self.fail(f"exception at OUT : {self.PC}")
+        return 0
 
-            elif opcode == "JPN":                                                                       # Jump Not Equal
-                addr = self.parse_code_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid address for JPN : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.JPN(addr)
-                if err != 0:
-                    self.throw_runtime_error(f"error during JPN : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-
-            elif opcode == "CMP":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    val = self.parse_data_address(instruction[1])
-                    if val == -1:
-                        self.throw_runtime_error(f"expected a valid address or direct addressing value : found none : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-                    else:
-                        err = self.CMP_INDIRECT(val)
-                        if err != 0:
-                            self.throw_runtime_error(f"exception at CMP instruction : {self.PC}")
-                            self.set_interrupt(2)
-                            return
-                else:
-                    err = self.CMP_DIRECT(val)
-                    if err != 0:
-                        self.throw_runtime_error(f"exception at CMP instruction : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-
-            elif opcode == "CMI":
-                addr = self.parse_code_address(instruction[1])
-                if addr == -1:
-                    self.throw_runtime_error(f"invalid address for CMI : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.CMI(addr)
-                if err != 0:
-                    self.throw_runtime_error(f"error during CMI : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_IN(self, operand):
+        if self.IN() != 0:
+            return self.fail(f"exception at IN : {self.PC}")
+        return 0
 
-            elif opcode == "END":
-                err = self.END()
-                if err != 0:
-                    self.set_interrupt(2)
-                    return
-
-            elif opcode == "AND":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    val = self.parse_data_address(instruction[1])
-                    if val == -1:
-                        self.throw_runtime_error(f"expected a valid address or direct addressing value : found none : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-                    else:
-                        err = self.AND_INDIRECT(val)
-                        if err != 0:
-                            self.throw_runtime_error(f"exception at AND instruction : {self.PC}")
-                            self.set_interrupt(2)
-                            return
-                else:
-                    err = self.AND_DIRECT(val)
-                    if err != 0:
-                        self.throw_runtime_error(f"exception at AND instruction : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-
-            elif opcode == "OR":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    val = self.parse_data_address(instruction[1])
-                    if val == -1:
-                        self.throw_runtime_error(f"expected a valid address or direct addressing value : found none : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-                    else:
-                        err = self.OR_INDIRECT(val)
-                        if err != 0:
-                            self.throw_runtime_error(f"exception at OR instruction : {self.PC}")
-                            self.set_interrupt(2)
-                            return
-                else:
-                    err = self.OR_DIRECT(val)
-                    if err != 0:
-                        self.throw_runtime_error(f"exception at OR instruction : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-
-            elif opcode == "XOR":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    val = self.parse_data_address(instruction[1])
-                    if val == -1:
-                        self.throw_runtime_error(f"expected a valid address or direct addressing value : found none : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-                    else:
-                        err = self.XOR_INDIRECT(val)
-                        if err != 0:
-                            self.throw_runtime_error(f"exception at XOR instruction : {self.PC}")
-                            self.set_interrupt(2)
-                            return
-                else:
-                    err = self.XOR_DIRECT(val)
-                    if err != 0:
-                        self.throw_runtime_error(f"exception at XOR instruction : {self.PC}")
-                        self.set_interrupt(2)
-                        return
-
-            elif opcode == "LSL":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    self.throw_runtime_error(f"invalid value for LSL : {instruction[1]} : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.LSL(val)
-                if err != 0:
-                    self.throw_runtime_error(f"exception at LSL : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_NOP(self, operand):
+        return 1
 
-            elif opcode == "LSR":
-                val = self.parse_byte_representation(instruction[1])
-                if val == -1:
-                    self.throw_runtime_error(f"invalid value for LSR : {instruction[1]} : {self.PC}")
-                    self.set_interrupt(2)
-                    return
-                err = self.LSR(val)
-                if err != 0:
-                    self.throw_runtime_error(f"exception at LSR : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_FAULT(self, fault):
+        self.raise_fault(fault[0], fault[1])
+        return -1
 
-            elif opcode == "OUT":                                                   # Send ACC to screen
-                err = self.OUT()
-                if err != 0:
-                    self.throw_runtime_error(f"exception at OUT : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+    def exec_LDD_COUNT_STO(self, operands):
+        load, increment, register, store = operands
 
-            elif opcode == "IN":
-                err = self.IN()
-                if err != 0:
-                    self.throw_runtime_error(f"exception at IN : {self.PC}")
-                    self.set_interrupt(2)
-                    return
+        if self.LDD(load) != 0:
+            return self.fail(f"invalid data or position : {load} : {self.PC}")
 
-            else:
-                self.throw_runtime_error(f"uncaught invalid opcode : {opcode}")
-                self.set_interrupt(1)
-                return
+        self.clock_cycles += 1
+        self.PC += 1
 
-        except (IndexError, ValueError):
-            self.throw_runtime_error(f"missing arguments : {self.PC}")
-            self.set_interrupt(2)
-            return
+        if increment:
+            if self.INC(register) != 0:
+                return self.fail(f"error at INC : {self.PC}")
+        elif self.DEC(register) != 0:
+            return self.fail(f"error at DEC : {self.PC}")
 
-        except Exception as err:
-            self.throw_runtime_error(f"uncaught VirtualMachine exception : {err} : {self.PC}")
-            self.set_interrupt(3)
-            return
+        self.clock_cycles += 1
+        self.PC += 1
 
-        # Show data for instruction according to config
+        if self.STO(store) != 0:
+            return self.fail(f"invalid address : {self.PC}")
+        return 0
 
-        if self.tracetable:
-            self.print_tracetable_frame(self.clock_cycles, instruction, buff, self.ACC, self.IX, self.OUTPUT)
+    def exec_LDX_OUT_INC(self, addr):
+        if self.LDX(addr) != 0:
+            return self.fail(f"invalid address : {self.PC}")
+
+        self.clock_cycles += 1
+        self.PC += 1
+
+        if self.OUT() != 0:
+            return self.fail(f"exception at OUT : {self.PC}")
+
+        self.clock_cycles += 1
+        self.PC += 1
+
+        if self.INC(REG_IX) != 0:
+            return self.fail(f"error at INC : {self.PC}")
+        return 0
 
+    def exec_CMP_JUMP(self, operands):
+        mode, val, on_equal, addr = operands
+
+        if mode == MODE_INDIRECT:
+            val = self.get_mem(val)
+            if val == -1:
+                return self.fail(f"exception at CMP instruction : {self.PC}")
+
+        if val == self.ACC:
+            self.EFLAGS |= 1
         else:
-            if self.show_inst:
-                self.print_instruction(buff, instruction)
-            if self.show_pc:
-                self.print_value("PC :", buff)
-            if self.show_ix:
-                self.print_value("IX :", self.IX)
-            if self.show_acc:
-                self.print_value("ACC:", self.ACC)
+            self.EFLAGS &= ~1
 
-        if self.step:
-            time.sleep(self.DELAY)
+        self.clock_cycles += 1
+        self.PC += 1
 
-        self.OUTPUT = ''                                                        # Delete Output
+        if (val == self.ACC) == on_equal and self.set_pc(addr) != 0:
+            if on_equal:
+                return self.fail(f"error during JPE : {self.PC}")
+            return self.fail(f"error during JPN : {self.PC}")
+        return 0
 
     # Opcodes
 
@@ -565,7 +1948,7 @@ class VirtualMachine:
         return 0
 
     def INC(self, register):
-        if register.upper() == "ACC":
+        if register == REG_ACC:
             err = self.set_acc(self.ACC + 1)
             if err != 0:
                 return -1
@@ -576,7 +1959,7 @@ class VirtualMachine:
         return 0
 
     def DEC(self, register):
-        if register.upper() == "ACC":
+        if register == REG_ACC:
             err = self.set_acc(self.ACC - 1)
             if err != 0:
                 return -1
@@ -726,13 +2109,15 @@ class VirtualMachine:
 
     def IN(self):
         try:
-            a = _Getch()
-            getch = a.__call__()
+            if self.input.interactive:
+                self.output.flush()                                             # Show pending output before waiting for input
+
+            getch = self.input.read()
 
             self.set_acc(ord(getch))
 
-            if not self.tracetable:
-                print(getch, end='')
+            if self.input.interactive and not self.tracetable:
+                self.output.echo(getch)
 
         except Exception:
 
@@ -742,6 +2127,110 @@ class VirtualMachine:
 
     # System
 
+    # Assembler
+    # Every line of the syntax tree is decoded once before the program starts, so the execution loop only
+    # reads integers : the opcode number, the addressing mode and the operand already resolved to a value,
+    # a data address or an instruction address
+
+    def assemble(self):
+        self.program = []
+        for i in range(len(self.tree)):
+            self.program.append(self.decode_instruction(i))
+
+        self.debug(f"decoded {len(self.program)} instructions")
+
+    def decode_instruction(self, index):
+        instruction = self.tree[index]
+
+        if instruction == []:
+            return (OP_NOP, MODE_NONE, 0)
+
+        pc = index + 1                                                              # Value of PC while the instruction runs
+
+        self.deferred_errors = []
+
+        try:
+            decoded = self.decode_operands(instruction, pc)
+
+        except (IndexError, ValueError):
+            decoded = self.fault(2, f"missing arguments : {pc}")
+
+        except Exception as err:
+            decoded = self.fault(3, f"uncaught VirtualMachine exception : {err} : {pc}")
+
+        errors = self.deferred_errors
+        self.deferred_errors = None
+
+        if decoded[0] == OP_FAULT:
+            return (OP_FAULT, decoded[1], tuple(errors) + decoded[2])
+
+        for error in errors:                                                        # Warnings of an instruction which decoded anyways
+            self.throw_runtime_error(error)
+
+        return decoded
+
+    def decode_operands(self, instruction, pc):
+        opcode = instruction[0].upper()
+        op = self.opcode_numbers.get(opcode)
+
+        if op is None:
+            return self.fault(1, f"invalid opcode : {' '.join(instruction)} : {pc}")
+
+        if op in (OP_LDM, OP_LDR, OP_LSL, OP_LSR):
+            val = self.parse_byte_representation(instruction[1])
+            if val == -1:
+                return self.fault(2, f"invalid value for {opcode} : {instruction[1]} : {pc}")
+            return (op, MODE_DIRECT, val)
+
+        if op in (OP_LDD, OP_LDI, OP_LDX, OP_STO):
+            addr = self.parse_data_address(instruction[1])
+            if addr == -1:
+                if op == OP_STO:
+                    return self.fault(2, f"invalid address : {instruction[1]} : {pc}")
+                return self.fault(2, f"invalid value for address : {instruction[1]} : {pc}")
+            return (op, MODE_INDIRECT, addr)
+
+        if op in (OP_ADD, OP_SUB, OP_AND, OP_OR, OP_XOR, OP_CMP):
+            val = self.parse_byte_representation(instruction[1])
+            if val != -1:
+                return (op, MODE_DIRECT, val)
+            addr = self.parse_data_address(instruction[1])
+            if addr == -1:
+                if op == OP_ADD:
+                    return self.fault(2, f"expected a valid address or direct addressing value but found none : {instruction[1]} : {pc}")
+                return self.fault(2, f"expected a valid address or direct addressing value : found none : {pc}")
+            return (op, MODE_INDIRECT, addr)
+
+        if op == OP_MOV:
+            if not instruction[1].upper() == "IX":
+                return self.fault(1, f"invalid register : expected \"IX\" : {pc}")
+            return (op, MODE_REGISTER, REG_IX)
+
+        if op in (OP_INC, OP_DEC):
+            register = instruction[1].upper()
+            if not register in ["ACC", "IX"]:
+                return self.fault(2, f"invalid register : {instruction[1]} : {pc}")
+            return (op, MODE_REGISTER, REG_ACC if register == "ACC" else REG_IX)
+
+        if op in (OP_JMP, OP_JPE, OP_JPN, OP_CMI):
+            addr = self.parse_code_address(instruction[1])
+            if addr == -1:
+                return self.fault(2, f"invalid address for {opcode} : {pc}")
+            return (op, MODE_CODE, addr)
+
+        return (op, MODE_NONE, 0)                                                   # IN, OUT, END
+
+    def fault(self, interrupt, error):
+        return (OP_FAULT, interrupt, (error,))
+
+    def raise_fault(self, interrupt, errors):
+        for error in errors:
+            if interrupt == 1:
+                self.throw_syntax_error(error)
+            else:
+                self.throw_runtime_error(error)
+        self.set_interrupt(interrupt)
+
     def parse_flags(self) -> int:
 
         parsing_data = False
@@ -812,12 +2301,40 @@ class VirtualMachine:
         return 0
 
 
+    # Memory
+    # The list backend stores Python ints and keeps negative values as they are
+    # The array backend stores unsigned words of ARCH bits (8, 16, 32 or 64) in a compact array.array :
+    # writes are wrapped to the word width, so negative values are stored in two's complement
+
+    def parse_directive(self, directive):
+        if directive[0].lower() == ".map":
+            if len(directive) != 3:
+                self.throw_syntax_error(f"expected .map <address> <file> : {' '.join(directive)}")
+                return 1
+            self.directive_maps.append((directive[1], directive[2]))
+            return 0
+
+        self.throw_syntax_error(f"invalid directive : {' '.join(directive)}")
+        return 1
+
     def initialize_memory(self):
-        self.MEM = []
-        for i in range(self.MAX_ADDRESS):
-            self.MEM.append(0)
+        self.set_arch(self.ARCH)
+
+        if self.memory_type == "array":
+            typecode = WORD_TYPECODES[self.ARCH]
+            self.MEM = array.array(typecode, bytes(self.MAX_ADDRESS * array.array(typecode).itemsize))
+        else:
+            self.MEM = [0] * self.MAX_ADDRESS
+
         self.debug(f"initialized memory with size {self.MAX_ADDRESS}")
 
+    def set_arch(self, width):
+        if self.memory_type == "array" and width not in WORD_TYPECODES:
+            raise ValueError(f"unsupported word width for array memory : {width}")
+        self.ARCH = width
+        self.LIMIT = 2 ** width
+        self.MASK = self.LIMIT - 1
+
     def set_mem(self, position, data: int):
         if position >= len(self.MEM):
             self.throw_runtime_error(f"invalid mem position : {position} ; maximum is at : {len(self.MEM) - 1}")
@@ -826,7 +2343,7 @@ class VirtualMachine:
             self.throw_syntax_error(f"invalid mem position : {position} ; mem position cannot be negative")
             return 1
 
-        if data > (2 ** self.ARCH):
+        if data > self.LIMIT:
             self.throw_runtime_error(f"invalid data to write to memory ; maximum supported architecture is x{self.ARCH} ; provided data : {data}")
             return 1
 
@@ -834,6 +2351,9 @@ class VirtualMachine:
             self.throw_syntax_error(f"invalid data provided ; needed int : {data}")
             return 1
 
+        if self.memory_type == "array":
+            data &= self.MASK
+
         self.MEM[position] = data
 
         return 0
@@ -848,6 +2368,260 @@ class VirtualMachine:
 
         return self.MEM[position]
 
+    # Memory mapped files
+    # .map <address> <file> copies a binary file into memory from the given address or data flag
+    # The file is mapped with mmap and copied into the memory in one block : each word is read in the
+    # native byte order with the width of the architecture
+
+    def map_files(self):
+        for address, path in self.memory_maps + self.directive_maps:
+            start = self.parse_data_address(address)
+            if start == -1:
+                self.throw_syntax_error(f"invalid address for .map : {address}")
+                return 1
+
+            if self.source_path and not os.path.isabs(path):                        # Relative to the source file
+                path = os.path.join(os.path.dirname(self.source_path), path)
+
+            try:
+                words = self.map_file(start, path)
+            except (OSError, ValueError) as err:
+                self.throw_syntax_error(f"could not map file : {path} : {err}")
+                return 1
+
+            self.debug(f"mapped {words} words of {path} at address {start}")
+
+        return 0
+
+    def map_file(self, start, path):
+        if self.ARCH not in WORD_TYPECODES:
+            raise ValueError(f"no word type for architecture x{self.ARCH}")
+
+        typecode = WORD_TYPECODES[self.ARCH]
+        itemsize = array.array(typecode).itemsize
+
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            words = size // itemsize
+            if words == 0:
+                return 0
+            if start + words > len(self.MEM):
+                raise ValueError(f"{words} words do not fit in memory from address {start}")
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as source:
+                    data = source[:words * itemsize]
+                    if self.memory_type == "array":
+                        with memoryview(self.MEM).cast('B') as memory:
+                            memory[start * itemsize:(start + words) * itemsize] = data
+                    else:
+                        with data.cast(typecode) as values:
+                            self.MEM[start:start + words] = values
+                    data.release()
+
+        return words
+
+    def dump_memory(self, path):
+        if self.memory_type == "array":
+            memory = self.MEM
+        else:
+            memory = array.array(WORD_TYPECODES[self.ARCH], [value & self.MASK for value in self.MEM])
+
+        with open(path, 'wb') as file:
+            file.write(memoryview(memory).cast('B'))
+
+        self.debug(f"wrote {len(memory)} words of memory to {path}")
+
+    # Snapshots
+    # The complete state of the machine is saved to a binary file so a run can resume from that point
+    # without parsing the source and running its first cycles again
+
+    def save_snapshot(self, path):
+        state = {
+            "registers": (self.ACC, self.IX, self.PC, self.EFLAGS),
+            "interrupt": self.interrupt,
+            "clock_cycles": self.clock_cycles,
+            "output": self.OUTPUT,
+            "tree": self.tree,
+            "program": self.program,
+            "code_flags": self.code_flags,
+            "data_flags": self.data_flags,
+        }
+
+        self.write_image(path, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, state)
+
+        self.debug(f"saved snapshot at PC {self.PC} after {self.clock_cycles} clock cycles to {path}")
+
+    def load_snapshot(self, path):
+        state = self.read_image(path, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, "snapshot")
+
+        self.ACC, self.IX, self.PC, self.EFLAGS = state["registers"]
+        self.interrupt = state["interrupt"]
+        self.clock_cycles = state["clock_cycles"]
+        self.OUTPUT = state["output"]
+        self.tree = state["tree"]
+        self.program = state["program"]
+        self.code_flags = state["code_flags"]
+        self.data_flags = state["data_flags"]
+
+        self.code = []                                                              # Linked again by the engine
+        self.compiled_source = ""
+
+        self.debug(f"loaded snapshot at PC {self.PC} after {self.clock_cycles} clock cycles from {path}")
+
+    # Program cache
+    # The assembled program is saved once its source is parsed : syntax tree, decoded program, flags, memory
+    # image before the mapped files and the errors reported while parsing. The file is named after a hash of
+    # the source and of the memory settings, so a changed source or configuration never finds an old entry
+    # Files are still mapped on each run as their contents can change without the source
+
+    def cache_key(self):
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION} {sys.version_info[:2]} {self.memory_type} {self.MAX_ADDRESS} {self.ARCH}\n".encode())
+        if self.source is None:                                                     # Streamed file : hashed in chunks
+            with open(self.source_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(self.source.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.asmc")
+
+    def load_cached(self, key):
+        state = self.program_cache.get(key) if self.program_cache is not None else None
+
+        if state is not None:
+            self.restore_memory(state["memory"], state["words"])
+        elif self.cache_dir is None:
+            return 1
+        else:
+            try:
+                state = self.read_image(self.cache_path(key), CACHE_MAGIC, CACHE_VERSION, "cached program")
+            except FileNotFoundError:
+                return 1
+            except (OSError, ValueError) as err:                                    # Written again once parsed
+                self.debug(f"ignoring cached program : {err}")
+                return 1
+            if self.program_cache is not None:
+                self.program_cache[key] = dict(state, words=self.memory_words())
+
+        self.tree = state["tree"]
+        self.program = state["program"]
+        self.code_flags = state["code_flags"]
+        self.data_flags = state["data_flags"]
+        self.directive_maps = state["directive_maps"]
+
+        for error in state["errors"]:
+            self.throw_syntax_error(error)
+
+        self.debug(f"loaded cached program with {len(self.tree)} instructions")
+        return 0
+
+    def save_cached(self, key, errors):
+
+        # Equal tokens and instructions are saved once : marshal writes a reference to an object it already wrote,
+        # which also saves creating each copy when the program is loaded
+
+        tokens = {}
+        decoded = {}
+
+        state = {
+            "tree": [[tokens.setdefault(token, token) for token in line] for line in self.tree],
+            "program": [decoded.setdefault(instruction, instruction) for instruction in self.program],
+            "code_flags": self.code_flags,
+            "data_flags": self.data_flags,
+            "directive_maps": self.directive_maps,
+            "errors": errors,
+        }
+
+        if self.program_cache is not None:                                          # Shared by the next runs : never changed
+            self.program_cache[key] = dict(state, memory=(self.memory_type, self.MAX_ADDRESS, self.ARCH),
+                words=self.memory_words())
+
+        if self.cache_dir is None:
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.write_image(self.cache_path(key), CACHE_MAGIC, CACHE_VERSION, state)
+        except OSError as err:
+            self.debug(f"could not cache program : {err}")
+            return
+
+        self.debug(f"cached program as {key}")
+
+    # Image files
+    # Layout : header (magic, version, size of the state), the state encoded with marshal and the words of an
+    # array memory as raw bytes. marshal is not a portable format : images are meant to be loaded by the same
+    # version of Python that saved them
+
+    def write_image(self, path, magic, version, state):
+        state["memory"] = (self.memory_type, self.MAX_ADDRESS, self.ARCH)
+
+        if self.memory_type == "array":
+            words = memoryview(self.MEM).cast('B')
+        else:
+            state["words"] = list(self.MEM)
+            words = b""
+
+        data = marshal.dumps(state)
+
+        temporary = f"{path}.{os.getpid()}.tmp"                                     # An interrupted save keeps the old file
+        with open(temporary, 'wb') as file:
+            file.write(IMAGE_HEADER.pack(magic, version, len(data)))
+            file.write(data)
+            file.write(words)
+        os.replace(temporary, path)
+
+    def read_image(self, path, magic, version, kind):
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        if len(data) < IMAGE_HEADER.size:
+            raise ValueError(f"not a {kind} : {path}")
+
+        found, found_version, size = IMAGE_HEADER.unpack_from(data)
+        if found != magic:
+            raise ValueError(f"not a {kind} : {path}")
+        if found_version != version:
+            raise ValueError(f"unsupported {kind} version : {found_version}")
+
+        start = IMAGE_HEADER.size
+        try:
+            state = marshal.loads(data[start:start + size])
+        except (EOFError, ValueError, TypeError):
+            raise ValueError(f"corrupted {kind} : {path}")
+
+        if state["memory"][0] == "array":
+            self.restore_memory(state["memory"], data[start + size:])
+        else:
+            self.restore_memory(state["memory"], state["words"])
+
+        return state
+
+    def memory_words(self):
+        # Copy of the memory : bytes of the words for an array, list of ints otherwise
+        if self.memory_type == "array":
+            return self.MEM.tobytes()
+        return list(self.MEM)
+
+    def restore_memory(self, memory, words):
+        memory_type, size, width = memory
+        self.memory_type = memory_type
+        self.MAX_ADDRESS = size
+        self.set_arch(width)
+
+        if memory_type == "array":
+            self.MEM = array.array(WORD_TYPECODES[width])
+            self.MEM.frombytes(words)
+        else:
+            self.MEM = list(words)
+
+        if len(self.MEM) != size:
+            raise ValueError(f"memory holds {len(self.MEM)} words instead of {size}")
+
     def parse_byte_representation(self, byte):
         if len(byte) < 2:
             return -1
@@ -864,7 +2638,7 @@ class VirtualMachine:
             else:
                 return -1
 
-            if val > (2 ** self.ARCH):
+            if val > self.LIMIT:
                 self.throw_runtime_error(f"byte exceeds architecture max size : {byte}")
                 return -1
 
@@ -915,21 +2689,43 @@ class VirtualMachine:
         return True
 
     def is_valid_opcode(self, opcode):
-        if opcode.upper() in self.valid_opcodes:
+        if opcode.upper() in self.opcode_numbers:
             return True
         return False
 
-    def load_source(self, source):
+    def load_source(self, source, path=None):
         self.source = source
+        self.source_path = path
+
+    def load_file(self, path):
+        # The file is only read by load, one line at a time, with the streaming assembler
+        self.source = None
+        self.source_path = path
+        self.streaming = True
 
     def throw_syntax_error(self, error):
+        if self.deferred_errors is not None:
+            self.deferred_errors.append(error)
+            return
+        self.errors.append(error)
+        if self.quiet:
+            return
+        self.output.flush()
         print(f"\033[38;5;1merror:\033[m {error}")
 
     def throw_runtime_error(self, error):
+        if self.deferred_errors is not None:
+            self.deferred_errors.append(error)
+            return
+        self.errors.append(error)
+        if self.quiet:
+            return
+        self.output.flush()
         print(f"\033[38;5;1merror:\033[m {error}")
 
     def debug(self, text):
         if self.DEBUG:
+            self.output.flush()
             print(f"\033[38;5;5mdebug:\033[m {text}")
 
     def print_value(self, name, value):
@@ -944,114 +2740,70 @@ class VirtualMachine:
         print(f"\033[38;5;14m{instruction[1]}\033[m")
 
     def print_head_tracetable_line(self):
+        from TraceTable import TraceTable                                       # Only loaded for trace tables
 
-        count = 0
-        for key, value in self.code_flags.items():
-            count += 1
-
-        if len(self.tree) < 10: l = 2
-        elif len(self.tree) >= 10 and len(self.tree) < 100: l = 3
-        elif len(self.tree) >= 100 and len(self.tree) < 1000: l = 4
-        else: l = 5
-
-        total = 42 + l
-
-        a = ""
-        b = ""
-        g = ""
-
-        for _ in range(total + 1): a += '-'
-        for _ in range(l - 2): b += ' '
-
-        if count > 0:
-            for _ in range(19): a += '-'
-            for _ in range(13): g += ' '
-
-        print(f" {a} ")
-        print(f" |  n  | instruction    {g}     | ACC | IX  | PC{b}| OUT |")
-        print(f" {a} ")
+        self.trace = TraceTable(self.tree, self.code_flags, self.trace_format, self.trace_path)
+        self.trace.head()
 
     def print_tail_tracetable_line(self):
-
-        count = 0
-        for key, value in self.code_flags.items():
-            count += 1
-
-        if len(self.tree) < 10: l = 2
-        elif len(self.tree) >= 10 and len(self.tree) < 100: l = 3
-        elif len(self.tree) >= 100 and len(self.tree) < 1000: l = 4
-        else: l = 5
-
-        total = 42 + l
-
-        if count > 0:
-            total += 19
-
-        a = ""
-
-        for _ in range(total + 1): a += '-'
-
-        print(f" {a} ")
+        self.trace.tail()
+        self.trace.close()
 
     def print_tracetable_frame(self, number, instruction, pc, acc, ix, output):
-        #for _ in range(len(' '.join(instruction))): print('-', end='')
-
-        count = 0
-        name = ""
-
-        for key, value in self.code_flags.items():
-            count += 1
-            if value == pc:
-                name = key
-
-        if len(self.tree) < 10: l = 2
-        elif len(self.tree) >= 10 and len(self.tree) < 100: l = 3
-        elif len(self.tree) >= 100 and len(self.tree) < 1000: l = 4
-        else: l = 5
-
-        m = ""
-        n = ""
-        o = ""
-        p = ""
-        q = ""
-        r = ""
-        s = ""
-
-        for _ in range(20 - len('  '.join(instruction))): n += ' '
-
-        for _ in range(l - len(str(pc))): q += ' '
-        for _ in range(4 - len(str(acc))): o += ' '
-        for _ in range(4 - len(str(ix))): p += ' '
-        for _ in range(4 - len(str(number))): m += ' '
-
-        for _ in range(12 - len(name)): r += ' '
-
-        if output == '':
-            s = ' '
-
-        #print(f">| {number}{m}| {' '.join(instruction)}{n}| {acc}{o}| {ix}{p}| {pc}{q}|", end="\r")
-        #time.sleep(self.DELAY)
-
-        if count > 0:
-            if name != "":
-                if len(instruction) >= 2:
-                    print(f" | {number}{m}| {name}:{r}{' '.join(instruction)}{n} | {acc}{o}| {ix}{p}| {pc}{q}|  {output}{s}  |")
-                else:
-                    print(f" | {number}{m}| {name}:{r}{instruction[0]}{n}| {acc}{o}| {ix}{p}| {pc}{q}|  {output}{s}   |")
-            else:
-                if len(instruction) >= 2:
-                    print(f" | {number}{m}|  {r}{' '.join(instruction)}{n} | {acc}{o}| {ix}{p}| {pc}{q}|  {output}{s}  |")
-                else:
-                    print(f" | {number}{m}|  {r}{instruction[0]}{n}| {acc}{o}| {ix}{p}| {pc}{q}|  {output}{s}  |")
-        else:
-            if len(instruction) >= 2:
-                print(f" | {number}{m}|  {r}{' '.join(instruction)}{n} | {acc}{o}| {ix}{p}| {pc}{q}|  {output}{s}  |")
-            else:
-                print(f" | {number}{m}|  {r}{instruction[0]}{n}| {acc}{o}| {ix}{p}| {pc}{q}|  {output}{s}   |")
+        self.trace.row(number, instruction, pc, acc, ix, output)
+
+    def print_profile(self, top=20):
+        counts, back_edges = self.profile_counts, self.profile_back_edges
+        times = [spent / 1e9 for spent in self.profile_times]
+        total = sum(times) or 1.0
+
+        labels = {}
+        for name, pc in self.code_flags.items():
+            labels.setdefault(pc, []).append(name)
+
+        def location(pc):
+            names = ', '.join(labels.get(pc, []))
+            return f"{pc} ({names})" if names else f"{pc}"
+
+        def mnemonic(opcode):
+            if opcode == OP_NOP:
+                return "NOP"
+            if opcode == OP_FAULT:
+                return "FAULT"
+            return self.valid_opcodes[opcode]
+
+        self.output.flush()
+
+        print(f"\033[38;5;242mprofile:\033[m {sum(counts)} instructions in {sum(times):.6f} s")
+
+        print("\033[38;5;242mhottest instructions\033[m")
+        print(f"  {'count':>12} {'time (s)':>12} {'share':>7}   address")
+        hottest = sorted((pc for pc in range(len(counts)) if counts[pc] > 0), key=lambda pc: (-times[pc], pc))
+        for pc in hottest[:top]:
+            print(f"  {counts[pc]:>12} {times[pc]:>12.6f} {times[pc] / total:>7.1%}   {location(pc)} : {' '.join(self.tree[pc])}")
+
+        print("\033[38;5;242mopcode mix\033[m")
+        print(f"  {'opcode':<8}{'count':>12} {'share':>7} {'time (s)':>12} {'share':>7}")
+        mix = {}
+        for pc in range(len(counts)):
+            if counts[pc] > 0:
+                name = mnemonic(self.program[pc][0])
+                count, spent = mix.get(name, (0, 0.0))
+                mix[name] = (count + counts[pc], spent + times[pc])
+        executed = sum(counts) or 1
+        for name, (count, spent) in sorted(mix.items(), key=lambda item: -item[1][0]):
+            print(f"  {name:<8}{count:>12} {count / executed:>7.1%} {spent:>12.6f} {spent / total:>7.1%}")
+
+        print("\033[38;5;242mback edges\033[m")
+        loops = sorted((pc for pc in range(len(back_edges)) if back_edges[pc] > 0), key=lambda pc: -back_edges[pc])
+        if not loops:
+            print("  none")
+        for pc in loops:
+            print(f"  {back_edges[pc]:>12} taken   {location(pc)} : {' '.join(self.tree[pc])} -> {location(self.program[pc][2])}")
 
     def print_program_output(self, text):
         if not self.tracetable:
-            print(text)
+            self.output.write(text)
         return 0
 
     def set_debug(self, value):
@@ -1059,7 +2811,7 @@ class VirtualMachine:
         self.debug("enabled debugging")
 
     def set_step(self, value):
-        self.step = value
+        self.stepping = value
         self.debug(f"set stepping to : {value}")
 
     def set_tracetable(self, value):
@@ -1082,11 +2834,105 @@ class VirtualMachine:
         self.show_inst = value
         self.debug(f"set show instruction to : {value}")
 
+    def is_observed(self):
+        return self.tracetable or self.stepping or self.show_pc or self.show_ix or self.show_acc or self.show_inst
+
+    def has_breakpoints(self):
+        return bool(self.breakpoints or self.watchpoints) or self.pause_pc is not None
+
+    def is_rewritable(self):
+        # Superinstructions, the optimizer and fast-forwarding replace handlers : not while cycles are shown or
+        # while breakpoints wrap the handlers
+        return not self.is_observed() and not self.has_breakpoints()
+
+    def has_limits(self):
+        return self.cycle_limit is not None or self.time_limit is not None or self.pause_cycle is not None
+
+    def check_cycle_tools(self):
+        # The profiler, the flight recorder and the journal see each cycle on its own : they cannot run handlers or
+        # compiled blocks which count several cycles at once
+        tools = [name for name, on in (("the profiler", self.profile), ("the flight recorder", self.recorder_size > 0),
+            ("the journal", self.journal_interval > 0)) if on]
+        rewrites = [name for name, on in (("the compile engine", self.engine == "compile"),
+            ("superinstructions", self.fusion), ("the optimizer", self.optimization is not None),
+            ("fast-forwarding", self.fast_forward)) if on]
+
+        if tools and rewrites:
+            raise ValueError(f"{tools[0]} runs each cycle on its own : it cannot run with {rewrites[0]}")
+
+    def set_engine(self, value):
+        if value not in ["switch", "dispatch", "compile"]:
+            raise ValueError(f"invalid engine : {value}")
+        self.engine = value
+        self.debug(f"set engine to : {value}")
+
+    def set_memory(self, memory_type, size, width):
+        if memory_type not in ["list", "array"]:
+            raise ValueError(f"invalid memory type : {memory_type}")
+        if size < 1:
+            raise ValueError(f"invalid memory size : {size}")
+        self.memory_type = memory_type
+        self.MAX_ADDRESS = size
+        self.set_arch(width)
+        self.debug(f"set {memory_type} memory of {size} words of {width} bits")
+
+    def set_input(self, source):
+        self.input = source
+        self.debug("set input source")
+
+    def set_output(self, sink):
+        self.output = sink
+        self.debug("set output sink")
+
+    def set_streaming(self, value):
+        self.streaming = value
+        self.debug(f"set streaming assembler to : {value}")
+
+    def set_fusion(self, value):
+        self.fusion = value
+        self.debug(f"set instruction fusion to : {value}")
+
+    def set_fast_forward(self, value):
+        self.fast_forward = value
+        self.debug(f"set fast-forwarding of counted loops to : {value}")
+
+    def set_optimization(self, value):
+        if value not in [None, "optimized", "faithful"]:
+            raise ValueError(f"invalid cycle counting : {value}")
+        self.optimization = value
+        self.debug(f"set optimizer to : {value}")
+
+    def set_profile(self, value):
+        self.profile = value
+        self.debug(f"set profiling to : {value}")
+
+    def set_recorder(self, cycles):
+        if cycles < 0:
+            raise ValueError(f"invalid number of cycles : {cycles}")
+        self.recorder_size = cycles
+        self.debug(f"set flight recorder to the last {cycles} cycles")
+
+    def set_journal(self, interval):
+        if interval < 0:
+            raise ValueError(f"invalid checkpoint interval : {interval}")
+        self.journal_interval = interval
+        self.debug(f"set write journal with a checkpoint every {interval} cycles")
+
+    def set_limits(self, cycles=None, seconds=None):
+        if cycles is not None and cycles < 0:
+            raise ValueError(f"invalid cycle limit : {cycles}")
+        if seconds is not None and seconds < 0:
+            raise ValueError(f"invalid time limit : {seconds}")
+        self.cycle_limit = cycles
+        self.time_limit = seconds
+        self.debug(f"set limits to : {cycles} clock cycles, {seconds} seconds")
+
     def set_interrupt(self, value):
-        if value < 0 or value > (2 ** self.ARCH):
+        if value < 0 or value > self.LIMIT:
             self.throw_runtime_error(f"invalid interrupt value : {value}")
             return -1
         self.interrupt = value
+        self.output.interrupt(value)
         self.debug(f"set interrupt to : {value}")
         return 0
 
@@ -1129,8 +2975,8 @@ class VirtualMachine:
         if value < 0:
             self.throw_runtime_error(f"value for PC cannot be lower than 0 : {value}")
             return -1
-        elif value >= 2 ** self.ARCH:
-            self.throw_runtime_error(f"value for PC cannot be greater than {2 ** self.ARCH} : {value}")
+        elif value >= self.LIMIT:
+            self.throw_runtime_error(f"value for PC cannot be greater than {self.LIMIT} : {value}")
             return -1
 
         self.PC = value
@@ -1140,8 +2986,8 @@ class VirtualMachine:
         if value < 0:
             self.IX = 0
             return -1
-        elif value >= 2 ** self.ARCH:
-            self.IX = (2 ** self.ARCH) - 1
+        elif value >= self.LIMIT:
+            self.IX = self.MASK
             return -1
         self.IX = value
         return 0
@@ -1150,48 +2996,279 @@ class VirtualMachine:
         if value < 0:
             self.ACC = 0
             #return -1
-        elif value >= 2 ** self.ARCH:
-            self.ACC = (2 ** self.ARCH) - 1
+        elif value >= self.LIMIT:
+            self.ACC = self.MASK
             return -1
         self.ACC = value
         return 0
 
-# Getch to read characters from stdin
+# Output sink for the OUT instruction
+
+class OutputSink:
+    # Collects the characters written by the program and sends them to the stream in bulk
+    # Flush triggers :
+    #   newline   -> the program outputs a newline character, or any character when the separator holds a newline
+    #                and the stream is a terminal, so each OUT shows at once like print
+    #   size      -> the buffer holds at least flush_size bytes
+    #   end       -> the program executes END
+    #   interrupt -> the program stops with any other interrupt
+    # In capture mode nothing is written : the whole output is kept and returned by getvalue
+
+    TRIGGERS = ["newline", "size", "end", "interrupt"]
+
+    def __init__(self, stream=None, triggers=None, flush_size=65536, separator=b"\n", capture=False):
+        if triggers is None:
+            triggers = self.TRIGGERS
+        for trigger in triggers:
+            if trigger not in self.TRIGGERS:
+                raise ValueError(f"invalid flush trigger : {trigger}")
+
+        self.stream = stream                    # None writes to the current sys.stdout
+        self.separator = separator              # Written after each character : print() adds a newline
+        self.capture = capture
+        self.buffer = bytearray()
+        self.captured = bytearray()
+
+        self.on_newline = "newline" in triggers
+        self.checked = None                     # Last stream checked by is_terminal and its result
+        self.terminal = False
+        self.on_end = "end" in triggers
+        self.on_interrupt = "interrupt" in triggers
+        self.flush_size = flush_size if "size" in triggers else float("inf")
+
+    def write(self, text):
+        self.buffer += text.encode("utf-8")
+        self.buffer += self.separator
+        if len(self.buffer) >= self.flush_size or (self.on_newline and (text == "\n" or
+                (b"\n" in self.separator and self.is_terminal()))):
+            self.flush()
+
+    def is_terminal(self):
+        if self.capture:
+            return False
+        stream = self.stream if self.stream is not None else sys.stdout
+        if stream is not self.checked:
+            self.checked = stream
+            try:
+                self.terminal = stream.isatty()
+            except (AttributeError, ValueError):
+                self.terminal = False
+        return self.terminal
+
+    def echo(self, text):
+        self.buffer += text.encode("utf-8")
+
+    def interrupt(self, value):
+        if (value == 10 and self.on_end) or (value != 10 and self.on_interrupt):
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.capture:
+            self.captured += self.buffer
+            self.buffer.clear()
+            return
+
+        stream = self.stream if self.stream is not None else sys.stdout
+        data = bytes(self.buffer)
+        self.buffer.clear()
+
+        if hasattr(stream, "buffer"):                                   # Text stream : keep the order of previous prints
+            stream.flush()
+            stream.buffer.write(data)
+            stream.buffer.flush()
+        elif isinstance(stream, io.TextIOBase):
+            stream.write(data.decode("utf-8"))
+        else:
+            stream.write(data)
+
+    def getvalue(self):
+        return bytes(self.captured + self.buffer)
+
+# Input sources for the IN instruction
+# read() returns the next character, or '' once the input has ended
+
+class InputSource:
+    interactive = False                         # Flush pending output and echo each character
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def read(self):
+        return ''
+
+
+class BytesInput(InputSource):
+    # Reads the characters of an in-memory bytes object
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.position = 0
+
+    def read(self):
+        if self.position >= len(self.data):
+            return ''
+        ch = chr(self.data[self.position])
+        self.position += 1
+        return ch
+
+
+class StreamInput(InputSource):
+    # Reads a binary stream such as a stdin pipe in chunks of up to chunk_size bytes
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunk = b''
+        self.position = 0
+
+    def read(self):
+        if self.position >= len(self.chunk):
+            read = getattr(self.stream, "read1", self.stream.read)             # Do not wait for a full chunk on pipes
+            self.chunk = read(self.chunk_size)
+            self.position = 0
+            if not self.chunk:
+                return ''
+        ch = chr(self.chunk[self.position])
+        self.position += 1
+        return ch
+
+
+class FileInput(StreamInput):
+    # Reads a file opened for the duration of the run
+    def __init__(self, path, chunk_size=65536):
+        super().__init__(None, chunk_size)
+        self.path = path
+
+    def open(self):
+        if self.stream is None:
+            self.stream = open(self.path, 'rb')
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def read(self):
+        self.open()
+        return super().read()
+
+
+class CallableInput(InputSource):
+    # Asks a function for input : it returns an int, str or bytes, or None / empty once the input has ended
+    def __init__(self, function):
+        self.function = function
+        self.pending = ''
+
+    def read(self):
+        if self.pending == '':
+            data = self.function()
+            if data is None:
+                return ''
+            if isinstance(data, int):
+                data = chr(data)
+            elif isinstance(data, (bytes, bytearray)):
+                data = data.decode("latin-1")
+            self.pending = data
+            if data == '':
+                return ''
+        ch = self.pending[0]
+        self.pending = self.pending[1:]
+        return ch
+
+
+class AsyncInput(InputSource):
+    # Reads an asyncio.StreamReader : the machine awaits fill() whenever ready() is False before an IN, so read()
+    # only returns buffered characters and never blocks
+    def __init__(self, reader, chunk_size=65536):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.chunk = b''
+        self.position = 0
+        self.ended = False
+
+    def ready(self):
+        return self.position < len(self.chunk) or self.ended
+
+    async def fill(self):
+        self.chunk = await self.reader.read(self.chunk_size)
+        self.position = 0
+        if not self.chunk:
+            self.ended = True
+
+    def read(self):
+        if self.position >= len(self.chunk):
+            return ''
+        ch = chr(self.chunk[self.position])
+        self.position += 1
+        return ch
+
+
+class TerminalInput(InputSource):
+    # Reads single keys from the terminal without waiting for a newline and without echo
+    # The terminal is configured at the first read and restored once the run ends
+    interactive = True
 
-class _Getch:
-    #Gets a single character from standard input.  Does not echo to the screen
     def __init__(self):
-        try:
-            self.impl = _GetchWindows()
-        except ImportError:
-            self.impl = _GetchUnix()
+        self.impl = None
+
+    def read(self):
+        if self.impl is None:
+            try:
+                self.impl = _TerminalWindows()
+            except ImportError:
+                self.impl = _TerminalUnix()
+        return self.impl.read()
 
-    def __call__(self): return self.impl()
+    def close(self):
+        if self.impl is not None:
+            self.impl.close()
+            self.impl = None
 
 
-class _GetchUnix:
+class _TerminalUnix:
+    # Only input is raw : output processing and signals such as Ctrl-C keep working during the run
     def __init__(self):
-        import tty, sys
+        import termios
+        self.fd = sys.stdin.fileno()
+        self.old_settings = termios.tcgetattr(self.fd)
+        settings = termios.tcgetattr(self.fd)
+        settings[0] &= ~(termios.ICRNL | termios.IXON)                          # Enter is read as \r like in raw mode
+        settings[3] &= ~(termios.ICANON | termios.ECHO)
+        settings[6][termios.VMIN] = 1
+        settings[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, settings)
 
-    def __call__(self):
-        import sys, tty, termios
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setraw(sys.stdin.fileno())
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
+    def read(self):
+        return sys.stdin.read(1)
+
+    def close(self):
+        import termios
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self.old_settings)
 
 
-class _GetchWindows:
+class _TerminalWindows:
     def __init__(self):
         import msvcrt
 
-    def __call__(self):
+    def read(self):
         import msvcrt
-        return msvcrt.getch()
+        return msvcrt.getch().decode("latin-1")
+
+    def close(self):
+        pass
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pseudo_asm")
+
+def default_input():
+    if sys.stdin is not None and sys.stdin.isatty():
+        return TerminalInput()
+    return StreamInput(sys.stdin.buffer)
 
 
 
@@ -1204,15 +3281,49 @@ flags:
 \t-d, --debug  \tenable real time debugging
 \t-s, --step   \twait for a predefined time after each cycle
 \t-t, --table  \tdraw a complete trace table for the program - not compatible with other representations
+\t--table-format=<format>\ttrace table format : table (default), csv or tsv
+\t--table-file=<file>\twrite the trace table to a file instead of stdout
 \t--acc        \tshow accumulator status after each cycle
 \t--ix         \tshow index register status after each cycle
 \t--pc         \tshow program counter status after each cycle
+\t--engine=<name>\texecution engine : switch (default), dispatch or compile
+\t--compile    \tcompile the program into a Python function : same as --engine=compile ; dispatch above 5000 instructions
+\t--fuse       \tmerge common instruction sequences into superinstructions : dispatch engine
+\t--fast-forward\tcompute the final state of counted loops instead of running each iteration
+\t--optimize[=<cycles>]\tremove dead code and redundant instructions ; cycles : optimized (default) or faithful
+\t--profile    \tcount executions and time of each instruction and print a report at exit
+\t--record=<n> \tkeep the last n cycles and print them when the program does not end with END
+\t--record-file=<file>\tappend the cycles kept by --record to a file instead of stdout
+\t--journal[=<n>]\tjournal each write of the run, with a checkpoint every n cycles (default 100000)
+\t--rewind=<n>  \tgo back n cycles with the journal when the program does not end with END
+\t--cycle-limit=<n>\tstop the run with exit code 5 after n clock cycles
+\t--time-limit=<seconds>\tstop the run with exit code 6 after some seconds of execution
+\t--flush=<triggers>\twrite buffered output on : newline,size,end,interrupt (default all) ; newline writes each character to a terminal
+\t--buffer=<bytes>\tsize of the output buffer for the size trigger (default 65536)
+\t--raw-output \tdo not write a newline after each output character
+\t--input=<file>\tread the input of IN from a file instead of stdin
+\t--memory=<type>\tmemory backend : list (default) or array of unsigned words
+\t--memory-size=<words>\tnumber of words of memory (default 32)
+\t--width=<bits>\tword width : 8, 16, 32 (default) or 64 for array memory
+\t--map=<address>:<file>\tcopy a binary file into memory at an address or data flag ; --memory=array copies it without an int per word
+\t--dump=<file>\twrite the memory to a binary file once the run ends
+\t--stream     \tassemble the file while reading it, line by line, and report every syntax error
+\t--cache[=<dir>]\tkeep assembled programs in a directory (default ~/.cache/pseudo_asm) to skip parsing
+\t--snapshot=<file>\tsave the state of the machine to a file once the run ends or pauses
+\t--snapshot-at=<point>\tpause the run before a clock cycle or a code flag ; limits and tools still apply
+\t--break=<address>[:<condition>]\tstop with exit code 7 before an instruction address or code flag, when the
+\t             \tcondition holds : ACC, IX or EFLAGS, ==, !=, <, <=, > or >=, a number (alone : at every address)
+\t--watch=<address>\tstop with exit code 7 after each write to a data address or data flag
+\t--resume     \tthe file is a snapshot : resume the run where it was saved
 ''')
         exit(0)
 
     source = ""
 
-    if os.path.isfile(sys.argv[len(sys.argv) - 1]):
+    resume = "--resume" in sys.argv[1:len(sys.argv) - 1]                # The file is a snapshot instead of a sourcefile
+    stream = "--stream" in sys.argv[1:len(sys.argv) - 1]                # The file is read by the streaming assembler
+
+    if os.path.isfile(sys.argv[len(sys.argv) - 1]) and not resume and not stream:
         try:
             with open(sys.argv[len(sys.argv) - 1], 'r') as file:
                 source = file.read()
@@ -1221,7 +3332,7 @@ flags:
             print(f"error: could not open file: {err}")
             exit(1)
 
-    else:
+    elif not os.path.isfile(sys.argv[len(sys.argv) - 1]):
         print(f"file does not exist : {sys.argv[1]}")
         exit(1)
 
@@ -1233,6 +3344,10 @@ flags:
             if not f.startswith('-'):
                 print(f"error: invalid flag : {f}")
                 exit(1)
+        memory_type = VM.memory_type
+        memory_size = VM.MAX_ADDRESS
+        width = VM.ARCH
+
         for f in flags:
             if f == "-d" or f == "--debug":
                 VM.set_debug(True)
@@ -1240,6 +3355,16 @@ flags:
                 VM.set_step(True)
             elif f == "-t" or f == "--table":
                 VM.set_tracetable(True)
+            elif f.startswith("--table-format="):
+                trace_format = f[len("--table-format="):]
+                if trace_format not in ["table", "csv", "tsv"]:
+                    print(f"error: invalid table format : {trace_format}")
+                    exit(1)
+                VM.trace_format = trace_format
+                VM.set_tracetable(True)
+            elif f.startswith("--table-file="):
+                VM.trace_path = f[len("--table-file="):]
+                VM.set_tracetable(True)
             elif f == "--acc":
                 VM.set_show_acc(True)
             elif f == "--ix":
@@ -1248,18 +3373,156 @@ flags:
                 VM.set_show_pc(True)
             elif f == "--instruction":
                 VM.set_show_inst(True)
+            elif f.startswith("--engine="):
+                try:
+                    VM.set_engine(f[len("--engine="):])
+                except ValueError as err:
+                    print(f"error: {err}")
+                    exit(1)
+            elif f == "--compile":
+                VM.set_engine("compile")
+            elif f == "--fuse":
+                VM.set_fusion(True)
+            elif f == "--fast-forward":
+                VM.set_fast_forward(True)
+            elif f == "--optimize" or f.startswith("--optimize="):
+                try:
+                    VM.set_optimization(f[len("--optimize="):] if '=' in f else "optimized")
+                except ValueError as err:
+                    print(f"error: {err}")
+                    exit(1)
+            elif f == "--profile":
+                VM.set_profile(True)
+            elif f.startswith("--record="):
+                try:
+                    VM.set_recorder(int(f[len("--record="):]))
+                except ValueError:
+                    print(f"error: invalid number of cycles : {f}")
+                    exit(1)
+            elif f.startswith("--record-file="):
+                VM.recorder_path = f[len("--record-file="):]
+            elif f == "--journal" or f.startswith("--journal="):
+                try:
+                    VM.set_journal(int(f[len("--journal="):]) if '=' in f else JOURNAL_INTERVAL)
+                except ValueError:
+                    print(f"error: invalid number of cycles : {f}")
+                    exit(1)
+            elif f.startswith("--rewind="):
+                try:
+                    VM.rewind = int(f[len("--rewind="):])
+                    if VM.rewind < 0:
+                        raise ValueError
+                except ValueError:
+                    print(f"error: invalid number of cycles : {f}")
+                    exit(1)
+                if VM.journal_interval == 0:
+                    VM.set_journal(JOURNAL_INTERVAL)
+            elif f.startswith("--cycle-limit="):
+                try:
+                    VM.set_limits(int(f[len("--cycle-limit="):]), VM.time_limit)
+                except ValueError:
+                    print(f"error: invalid number of cycles : {f}")
+                    exit(1)
+            elif f.startswith("--time-limit="):
+                try:
+                    VM.set_limits(VM.cycle_limit, float(f[len("--time-limit="):]))
+                except ValueError:
+                    print(f"error: invalid number of seconds : {f}")
+                    exit(1)
+            elif f.startswith("--flush="):
+                triggers = [t for t in f[len("--flush="):].split(',') if t != '']
+                try:
+                    VM.output = OutputSink(triggers=triggers, flush_size=VM.output.flush_size, separator=VM.output.separator)
+                except ValueError as err:
+                    print(f"error: {err}")
+                    exit(1)
+            elif f.startswith("--buffer="):
+                try:
+                    VM.output.flush_size = int(f[len("--buffer="):])
+                except ValueError:
+                    print(f"error: invalid buffer size : {f}")
+                    exit(1)
+            elif f == "--raw-output":
+                VM.output.separator = b""
+            elif f.startswith("--input="):
+                path = f[len("--input="):]
+                if not os.path.isfile(path):
+                    print(f"error: input file does not exist : {path}")
+                    exit(1)
+                VM.set_input(FileInput(path))
+            elif f.startswith("--map="):
+                address, sep, path = f[len("--map="):].partition(':')
+                if sep == '' or address == '' or path == '':
+                    print(f"error: expected --map=<address>:<file> : {f}")
+                    exit(1)
+                VM.memory_maps.append((address, path))
+            elif f.startswith("--dump="):
+                VM.dump_path = f[len("--dump="):]
+            elif f == "--cache":
+                VM.cache_dir = default_cache_dir()
+            elif f.startswith("--cache="):
+                VM.cache_dir = f[len("--cache="):]
+            elif f.startswith("--snapshot="):
+                VM.snapshot_path = f[len("--snapshot="):]
+            elif f.startswith("--snapshot-at="):
+                VM.pause_at = f[len("--snapshot-at="):]
+            elif f.startswith("--break="):
+                point, _, condition = f[len("--break="):].partition(':')
+                try:
+                    if condition == "" and re.match(r"(ACC|IX|EFLAGS)\b", point, re.IGNORECASE):
+                        VM.add_breakpoint(None, point)                          # Condition checked at every address
+                    else:
+                        VM.add_breakpoint(point, condition or None)
+                except ValueError as err:
+                    print(f"error: {err}")
+                    exit(1)
+            elif f.startswith("--watch="):
+                VM.add_watchpoint(f[len("--watch="):])
+            elif f == "--resume" or f == "--stream":
+                pass
+            elif f.startswith("--memory="):
+                memory_type = f[len("--memory="):]
+            elif f.startswith("--memory-size=") or f.startswith("--width="):
+                try:
+                    value = int(f.split('=', 1)[1])
+                except ValueError:
+                    print(f"error: invalid number : {f}")
+                    exit(1)
+                if f.startswith("--width="):
+                    width = value
+                else:
+                    memory_size = value
             else:
                 print(f"error: invalid flag : {f}")
                 exit(1)
 
+        try:
+            VM.set_memory(memory_type, memory_size, width)
+            VM.check_cycle_tools()
+        except ValueError as err:
+            print(f"error: {err}")
+            exit(1)
+
     try:
 
-        VM.load_source(source)
-        VM.run()
+        if resume:
+            try:
+                VM.load_snapshot(sys.argv[len(sys.argv) - 1])
+            except (OSError, ValueError) as err:
+                print(f"error: could not load snapshot: {err}")
+                exit(1)
+            VM.resume()
+        elif stream:
+            VM.load_file(sys.argv[len(sys.argv) - 1])
+            VM.run()
+        else:
+            VM.load_source(source, sys.argv[len(sys.argv) - 1])
+            VM.run()
 
     except KeyboardInterrupt:
 
         VM.interrupt = 9                                                # Aborted by User
+        VM.output.flush()
         print(f"\n * Clock cycles completed : {VM.clock_cycles}")       # Display clock cycles
         print("exiting...")
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules of the machine import each other by name, as when they run from asm/
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "asm"))
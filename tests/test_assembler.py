@@ -0,0 +1,107 @@
+import pytest
+
+from VirtualMachine import VirtualMachine, OutputSink
+
+VALID = """
+start:  LDM #0
+        MOV IX
+loop:   LDX text
+        CMP #0
+        JPE done
+        OUT
+        INC IX
+        JMP loop
+done:   END
+text:   #79
+        #75
+        #0
+"""
+
+INVALID = """
+start:  LDM #1
+        FOO #2
+        MOV ACC
+        LDD nowhere
+        JMP later
+        ADD #x
+        INC BX
+later:  OUT
+        END
+"""
+
+def machine(streaming):
+    vm = VirtualMachine()
+    vm.quiet = True
+    vm.set_output(OutputSink(capture=True))
+    vm.set_streaming(streaming)
+    return vm
+
+def assemble(source):
+    vm = machine(True)
+    vm.load_source(source)
+    vm.run()
+    return vm
+
+def test_streamed_program_matches_the_parsed_program():
+    streamed = assemble(VALID)
+    parsed = machine(False)
+    parsed.load_source(VALID)
+    parsed.run()
+
+    assert streamed.errors == parsed.errors == []
+    assert streamed.program == parsed.program
+    assert streamed.code_flags == parsed.code_flags
+    assert streamed.output.getvalue() == parsed.output.getvalue() == b"O\nK\n"
+
+def test_every_invalid_instruction_is_reported():
+    vm = assemble(INVALID)
+
+    assert vm.errors == [
+        "invalid opcode : FOO #2 : 2 at instruction 1 : FOO #2",
+        'invalid register : expected "IX" : 3 at instruction 2 : MOV ACC',
+        "invalid value for address : nowhere : 4 at instruction 3 : LDD nowhere",
+        "expected a valid address or direct addressing value but found none : #x : 6 at instruction 5 : ADD #x",
+        "invalid register : BX : 7 at instruction 6 : INC BX",
+        "could not assemble the program : 5 errors",
+    ]
+
+def test_program_with_errors_does_not_run():
+    vm = assemble(INVALID)
+
+    assert vm.clock_cycles == 0
+    assert vm.output.getvalue() == b""
+
+def test_unreachable_errors_are_reported():
+    vm = assemble("LDM #65\nOUT\nEND\nFOO\nLDD missing")
+
+    assert vm.clock_cycles == 0
+    assert len(vm.errors) == 3
+    assert vm.errors[-1] == "could not assemble the program : 2 errors"
+
+def test_flags_defined_further_down_are_patched():
+    vm = assemble("JMP skip\nOUT\nskip: LDD value\nOUT\nEND\nvalue: #33")
+
+    assert vm.errors == []
+    assert vm.output.getvalue() == b"!\n"
+
+@pytest.mark.parametrize("line, error", [
+    ("too many operands here", "too many arguments"),
+    (".unknown directive", "invalid directive"),
+    (".map data", "expected .map <address> <file>"),
+])
+def test_syntax_errors_are_reported_with_the_others(line, error):
+    vm = assemble(f"FOO\n{line}\nEND")
+
+    assert any(message.startswith("invalid opcode") for message in vm.errors)
+    assert any(error in message for message in vm.errors)
+    assert vm.clock_cycles == 0
+
+def test_file_is_assembled_while_it_is_read(tmp_path):
+    path = tmp_path / "program.s"
+    path.write_text(INVALID)
+    vm = machine(False)
+    vm.load_file(str(path))
+    vm.run()
+
+    assert vm.source is None
+    assert vm.errors[-1] == "could not assemble the program : 5 errors"
@@ -0,0 +1,176 @@
+import random
+
+import pytest
+
+from VirtualMachine import VirtualMachine, OutputSink
+
+# Every engine must end in the state of the baseline : the switch engine stepping one cycle at a time, which runs
+# each instruction with next_instruction and no rewritten handler
+
+ENGINES = {
+    "switch": {},
+    "dispatch": {"engine": "dispatch"},
+    "fusion": {"engine": "dispatch", "fusion": True},
+    "compile": {"engine": "compile"},
+    "compile-fusion": {"engine": "compile", "fusion": True},
+}
+
+PROGRAMS = {
+    "count": """
+        LDM #0
+loop:   INC ACC
+        CMP #70
+        JPN loop
+        OUT
+        END
+""",
+    "sum": """
+        LDM #0
+        STO total
+        LDM #10
+        MOV IX
+next:   LDD total
+        ADD IX
+        STO total
+        DEC IX
+        LDD zero
+        CMP IX
+        JPN next
+        LDD total
+        OUT
+        END
+total:  #0
+zero:   #0
+""",
+    "table": """
+        LDM #0
+        MOV IX
+print:  LDX text
+        CMP #0
+        JPE done
+        OUT
+        INC IX
+        JMP print
+done:   END
+text:   #72
+        #105
+        #33
+        #0
+""",
+    "indirect": """
+        LDI pointer
+        ADD #1
+        STO value
+        LDD value
+        LSL #3
+        LSR #1
+        AND #255
+        XOR #15
+        OR &40
+        OUT
+        END
+pointer: #7
+value:  #64
+""",
+    "cmi": """
+        LDM #5
+        CMI pointer
+        JPE equal
+        LDM #78
+        OUT
+        END
+equal:  LDM #89
+        OUT
+        END
+pointer: #13
+        #5
+""",
+    "overflow": """
+        LDM #4294967295
+        ADD #1
+        OUT
+        END
+""",
+    "past-end": """
+        LDM #65
+        OUT
+""",
+    "bad-address": """
+        LDM #1
+        STO 100
+        END
+""",
+}
+
+# Random programs mix valid instructions with faults : each engine must stop with the same interrupt
+
+OPS = ["LDM #%d", "LDD %s", "LDI %s", "LDX %s", "LDR #%d", "MOV IX", "STO %s", "ADD #%d", "ADD %s", "SUB #%d",
+    "SUB %s", "INC ACC", "INC IX", "DEC ACC", "DEC IX", "JMP %l", "JPE %l", "JPN %l", "CMP #%d", "CMP %s", "CMI %s",
+    "AND #%d", "OR %s", "XOR #%d", "LSL #%d", "LSR #%d", "OUT", "END", "LDD %s\nINC ACC\nSTO %s", "CMP %s\nJPN %l",
+    "LDX %s\nOUT\nINC IX", "STO %s\nLDD %s"]
+
+def random_program(rng):
+    labels = [f"l{i}" for i in range(rng.randint(3, 14))]
+    data = [f"d{i}" for i in range(rng.randint(1, 5))]
+    lines = []
+    for label in labels:
+        line = rng.choice(OPS)
+        line = line.replace("%d", str(rng.choice([0, 1, 2, 3, 5, 65, 255, 4294967295])))
+        line = line.replace("%s", rng.choice(data + [str(rng.randint(0, 40))]))
+        line = line.replace("%l", rng.choice(labels + [str(rng.randint(0, 30))]))
+        lines.append(f"{label}: {line}" if rng.random() < 0.7 else line)
+    for flag in data:
+        lines.append(f"{flag}: #{rng.choice([0, 1, 3, 20, 65])}")
+    return "\n".join(lines)
+
+def run(source, settings, baseline=False):
+    vm = VirtualMachine()
+    vm.quiet = True
+    vm.set_output(OutputSink(capture=True))
+    for name, value in settings.items():
+        getattr(vm, f"set_{name}")(value)
+    if baseline:
+        vm.stepping = True
+        vm.DELAY = 0
+    vm.load_source(source)
+    exception = None
+    try:
+        vm.run()
+    except IndexError as err:                                               # A jump past the program
+        exception = repr(err)
+    return {
+        "exception": exception,
+        "output": vm.output.getvalue(),
+        "registers": (vm.ACC, vm.IX, vm.PC, vm.EFLAGS),
+        "interrupt": vm.interrupt,
+        "clock_cycles": vm.clock_cycles,
+        "memory": list(vm.MEM),
+        "errors": vm.errors,
+    }
+
+def random_programs(count, seed):
+    rng = random.Random(seed)
+    programs = []
+    while len(programs) < count:
+        source = random_program(rng)
+        if run(source, {"limits": 5000})["interrupt"] != 5:                   # Programs which end before the limit
+            programs.append(source)
+    return programs
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_engine_matches_baseline(name, engine):
+    source = PROGRAMS[name]
+    assert run(source, ENGINES[engine]) == run(source, {}, baseline=True)
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_matches_baseline_on_random_programs(engine):
+    for source in random_programs(60, 1):
+        assert run(source, ENGINES[engine]) == run(source, {}, baseline=True), source
+
+def test_programs_stop_as_expected():
+    assert run(PROGRAMS["count"], {}, baseline=True)["output"] == b"F\n"
+    assert run(PROGRAMS["table"], {}, baseline=True)["output"] == b"H\ni\n!\n"
+    assert run(PROGRAMS["overflow"], {}, baseline=True)["interrupt"] == 2
+    assert run(PROGRAMS["past-end"], {}, baseline=True)["interrupt"] == 1
+    assert run(PROGRAMS["bad-address"], {}, baseline=True)["interrupt"] == 2
@@ -0,0 +1,139 @@
+import array
+import os
+import subprocess
+import sys
+
+import pytest
+
+from VirtualMachine import VirtualMachine, OutputSink, WORD_TYPECODES
+
+MACHINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "asm", "VirtualMachine.py")
+
+# Adds the two words mapped at data and writes the sum after them
+
+SOURCE = """
+        .map data {file}
+        LDD data
+        ADD second
+        STO total
+        OUT
+        END
+data:   #0
+second: #0
+total:  #0
+"""
+
+def words(*values, width=32):
+    return array.array(WORD_TYPECODES[width], values).tobytes()
+
+def machine(memory="list"):
+    vm = VirtualMachine()
+    vm.quiet = True
+    vm.set_output(OutputSink(capture=True))
+    vm.set_memory(memory, vm.MAX_ADDRESS, vm.ARCH)
+    return vm
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("memory", ["list", "array"])
+def test_map_directive_copies_the_file(tmp_path, memory, streaming):
+    (tmp_path / "values.bin").write_bytes(words(30, 35))
+    vm = machine(memory)
+    vm.set_streaming(streaming)
+    vm.load_source(SOURCE.format(file="values.bin"), str(tmp_path / "sum.s"))   # Relative to the source
+    vm.run()
+
+    assert vm.errors == []
+    assert vm.output.getvalue() == b"A\n"
+    assert list(vm.MEM[5:8]) == [30, 35, 65]
+
+@pytest.mark.parametrize("memory", ["list", "array"])
+def test_map_keeps_the_memory_type(tmp_path, memory):
+    path = tmp_path / "values.bin"
+    path.write_bytes(words(7, 8, 9))
+    vm = machine(memory)
+    vm.memory_maps.append(("2", str(path)))
+    vm.load_source("END")
+    vm.run()
+
+    assert vm.memory_type == memory
+    assert isinstance(vm.MEM, array.array if memory == "array" else list)
+    assert list(vm.MEM[:6]) == [0, 0, 7, 8, 9, 0]
+
+def test_map_ignores_a_partial_word(tmp_path):
+    path = tmp_path / "values.bin"
+    path.write_bytes(words(5) + b"\x01\x02")
+    vm = machine()
+    vm.initialize_memory()
+    assert vm.map_file(0, str(path)) == 1
+    assert vm.MEM[:2] == [5, 0]
+
+@pytest.mark.parametrize("memory", ["list", "array"])
+def test_map_rejects_a_file_larger_than_memory(tmp_path, memory):
+    path = tmp_path / "values.bin"
+    path.write_bytes(words(*range(40)))
+    vm = machine(memory)
+    vm.memory_maps.append(("0", str(path)))
+    vm.load_source("LDM #65\nOUT\nEND")
+    vm.run()
+
+    assert vm.clock_cycles == 0
+    assert vm.errors == [f"could not map file : {path} : 40 words do not fit in memory from address 0"]
+
+def test_map_rejects_an_invalid_address(tmp_path):
+    path = tmp_path / "values.bin"
+    path.write_bytes(words(1))
+    vm = machine()
+    vm.load_source(f".map nowhere {path}\nEND")
+    vm.run()
+
+    assert vm.clock_cycles == 0
+    assert vm.errors == ["invalid address for .map : nowhere"]
+
+@pytest.mark.parametrize("memory", ["list", "array"])
+def test_dump_writes_the_final_memory(tmp_path, memory):
+    dump = tmp_path / "memory.bin"
+    vm = machine(memory)
+    vm.dump_path = str(dump)
+    vm.load_source("LDM #4294967295\nSTO 10\nLDM #3\nSTO 31\nEND")
+    vm.run()
+
+    data = array.array(WORD_TYPECODES[32], dump.read_bytes())
+    assert len(data) == vm.MAX_ADDRESS
+    assert data[10] == 4294967295 and data[31] == 3
+    assert list(data) == list(vm.MEM)
+
+def test_dump_of_a_run_maps_back(tmp_path):
+    dump = tmp_path / "memory.bin"
+    vm = machine()
+    vm.dump_path = str(dump)
+    vm.load_source("LDM #66\nSTO 20\nEND")
+    vm.run()
+
+    vm = machine("array")
+    vm.memory_maps.append(("0", str(dump)))
+    vm.load_source("LDD 20\nOUT\nEND")
+    vm.run()
+    assert vm.output.getvalue() == b"B\n"
+
+def test_command_line_maps_and_dumps(tmp_path):
+    (tmp_path / "values.bin").write_bytes(words(30, 35))
+    source = tmp_path / "sum.s"
+    source.write_text(SOURCE.format(file="values.bin"))
+    dump = tmp_path / "memory.bin"
+
+    result = subprocess.run([sys.executable, MACHINE, f"--dump={dump}", str(source)], capture_output=True)
+
+    assert result.returncode == 0
+    assert result.stdout == b"A\n"
+    assert list(array.array(WORD_TYPECODES[32], dump.read_bytes())[5:8]) == [30, 35, 65]
+
+def test_command_line_map_flag(tmp_path):
+    values = tmp_path / "values.bin"
+    values.write_bytes(words(30, 35))
+    source = tmp_path / "sum.s"
+    source.write_text("\n".join(SOURCE.split("\n")[2:]))                 # Without the .map directive
+
+    result = subprocess.run([sys.executable, MACHINE, f"--map=data:{values}", str(source)], capture_output=True)
+
+    assert result.returncode == 0
+    assert result.stdout == b"A\n"
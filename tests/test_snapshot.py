@@ -0,0 +1,91 @@
+import pytest
+
+from VirtualMachine import VirtualMachine, OutputSink
+
+SOURCE = """
+        LDM #0
+        MOV IX
+print:  LDX text
+        CMP #0
+        JPE done
+        OUT
+        INC IX
+        JMP print
+done:   LDD count
+        ADD #1
+        STO count
+        END
+text:   #72
+        #101
+        #108
+        #108
+        #111
+        #0
+count:  #41
+"""
+
+def machine(memory="list"):
+    vm = VirtualMachine()
+    vm.quiet = True
+    vm.set_output(OutputSink(capture=True))
+    vm.set_memory(memory, vm.MAX_ADDRESS, vm.ARCH)
+    return vm
+
+def state(vm):
+    return (vm.ACC, vm.IX, vm.PC, vm.EFLAGS, vm.interrupt, vm.clock_cycles, list(vm.MEM))
+
+def full_run(memory="list"):
+    vm = machine(memory)
+    vm.load_source(SOURCE)
+    vm.run()
+    return vm
+
+def paused_run(tmp_path, point, memory="list"):
+    vm = machine(memory)
+    vm.pause_at = point
+    vm.snapshot_path = str(tmp_path / "run.snap")
+    vm.load_source(SOURCE)
+    vm.run()
+    return vm
+
+@pytest.mark.parametrize("memory", ["list", "array"])
+@pytest.mark.parametrize("point", [0, 1, 7, 25, "print", "done"])
+@pytest.mark.parametrize("engine", ["switch", "dispatch", "compile"])
+def test_resumed_run_ends_like_a_full_run(tmp_path, point, engine, memory):
+    expected = full_run(memory)
+    paused = paused_run(tmp_path, point, memory)
+    assert paused.interrupt == 0
+
+    vm = machine(memory)
+    vm.set_engine(engine)
+    vm.load_snapshot(str(tmp_path / "run.snap"))
+    assert state(vm) == state(paused)
+    vm.resume()
+
+    assert state(vm) == state(expected)
+    assert paused.output.getvalue() + vm.output.getvalue() == expected.output.getvalue()
+
+def test_pause_at_a_code_flag_stops_before_its_instruction(tmp_path):
+    vm = paused_run(tmp_path, "done")
+    assert vm.PC == vm.code_flags["done"]
+    assert vm.output.getvalue() == b"H\ne\nl\nl\no\n"
+
+def test_pause_past_the_end_saves_the_final_state(tmp_path):
+    expected = full_run()
+    paused_run(tmp_path, 10000)
+
+    vm = machine()
+    vm.load_snapshot(str(tmp_path / "run.snap"))
+    assert state(vm) == state(expected)
+
+def test_invalid_pause_point_stops_the_run(tmp_path):
+    vm = paused_run(tmp_path, "nowhere")
+    assert vm.interrupt == 1
+    assert vm.clock_cycles == 0
+    assert "invalid pause point : nowhere ; expected a clock cycle or a code flag" in vm.errors
+
+def test_load_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "source.s"
+    path.write_text(SOURCE)
+    with pytest.raises(ValueError, match="not a snapshot"):
+        machine().load_snapshot(str(path))